@@ -0,0 +1,98 @@
+"""
+Benchmark the JSON backends (--json-backend orjson or stdlib) on the payloads the server serializes and parses.
+
+Run from the server directory:
+    PYTHONPATH=.:modules python benchmarks/benchmark_json_media.py --tags 10000
+
+The payloads are a /get_tag_batch response of synthetic tag values (DINT, REAL with the odd NaN and infinity, BOOL,
+STRING, REAL arrays and raw bytes), a /get_tag_list response and a /get_tag_value request body. Each is serialized
+and parsed with each backend, after checking that both backends write the same JSON.
+"""
+# Python dependencies
+import argparse
+import random
+import time
+
+# Import our own dependencies
+from json_media import JsonMedia, orjson
+
+
+def make_tag_values(tags):
+    """Synthetic tag values, as pylogix returns them, with a mix of types"""
+    random.seed(1)
+    tag_values = []
+    for tag_no in range(tags):
+        kind = tag_no % 6
+        if kind == 0:
+            value, tag_type = random.randint(-2 ** 31, 2 ** 31 - 1), "DINT"
+        elif kind == 1:
+            # One REAL in 50 is NaN or infinite, which JSON has no literal for
+            value = random.uniform(-1e6, 1e6) if tag_no % 50 != 1 else random.choice([float('nan'), float('inf')])
+            tag_type = "REAL"
+        elif kind == 2:
+            value, tag_type = random.random() < 0.5, "BOOL"
+        elif kind == 3:
+            value, tag_type = f'Recipe {tag_no} ÄÖÜ', "STRING"
+        elif kind == 4:
+            value, tag_type = [random.uniform(0, 100) for _ in range(10)], "REAL"
+        else:
+            value, tag_type = bytes(random.getrandbits(8) for _ in range(16)), "Motor"
+        tag_values.append({"tag_name": f'Controller_Tag_{tag_no:06d}', "value": value, "success": True,
+                           "status": "Success", "read_time": time.time(), "tag_type": tag_type})
+    return tag_values
+
+
+def make_payloads(tags):
+    tag_values = make_tag_values(tags)
+    return {
+        "tag_batch": {"tag_values": tag_values, "plc_time": time.time(), "seq": 1, "epoch": "0123456789ab"},
+        "tag_list": {"plc_id": "plc-1", "plc_time": time.time(),
+                     "tag_list": {tag_value["tag_name"]: {"type": tag_value["tag_type"]} for tag_value in tag_values}},
+        "request": {"plc_id": "plc-1", "tag_list": [tag_value["tag_name"] for tag_value in tag_values]},
+    }
+
+
+def time_ms(function, repeat):
+    """The best time of a function (ms) out of repeat runs"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the JSON backends")
+    parser.add_argument("--tags", type=int, default=10000, help="Number of tags in the payloads (default 10000)")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each measurement, the best is kept (default 5)")
+    args = parser.parse_args()
+
+    backends = ["orjson", "stdlib"] if orjson is not None else ["stdlib"]
+    if orjson is None:
+        print('orjson is not installed (pip install orjson), only the stdlib backend is measured')
+    payloads = make_payloads(args.tags)
+
+    # Both backends must write the same bytes, or switching them would change the responses
+    outputs = {}
+    for backend in backends:
+        JsonMedia.configure(backend)
+        outputs[backend] = {name: JsonMedia.dumps(payload) for name, payload in payloads.items()}
+    for name in payloads:
+        if len({output[name] for output in outputs.values()}) != 1:
+            raise Exception(f'The backends write different JSON for the {name} payload')
+
+    print(f'{args.tags} tags, best of {args.repeat}')
+    print(f'{"payload":<10} {"backend":<8} {"KB":>8} {"dumps ms":>10} {"loads ms":>10}')
+    for name, payload in payloads.items():
+        for backend in backends:
+            JsonMedia.configure(backend)
+            data = outputs[backend][name]
+            dumps_ms = time_ms(lambda: JsonMedia.dumps(payload), args.repeat)
+            loads_ms = time_ms(lambda: JsonMedia.loads(data), args.repeat)
+            print(f'{name:<10} {backend:<8} {len(data) // 1024:>8} {dumps_ms:>10.2f} {loads_ms:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
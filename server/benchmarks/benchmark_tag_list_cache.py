@@ -0,0 +1,106 @@
+"""
+Benchmark the tag list cache formats (--tag-list-cache-format json or binary) for load time, lookup time and memory.
+"json" is the JSON file as parsed, "compact" the same file kept as a CompactTagList (what TagList keeps in memory
+for the json format) and "binary" the memory-mapped binary file.
+
+Run from the server directory:
+    PYTHONPATH=.:modules python benchmarks/benchmark_tag_list_cache.py --tags 50000
+
+A synthetic tag list (controller and program scoped tags, atomic and UDT types) is written in both formats, then
+each format is loaded in its own fresh Python process, so the memory numbers don't include the other's.
+"""
+# Python dependencies
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Import our own dependencies
+from binary_tag_list import BinaryTagList, write_binary_tag_list
+from compact_tag_list import CompactTagList
+
+_TYPES = ["BOOL", "SINT", "INT", "DINT", "REAL", "LREAL", "STRING", "TIMER", "COUNTER", "Motor", "Valve", "Axis"]
+
+
+def make_tag_list(tags):
+    """A synthetic tag list of the given size, a quarter of it program scoped"""
+    random.seed(1)
+    tag_list = {}
+    for tag_no in range(tags):
+        if tag_no % 4 == 0:
+            tag_name = f'Program:Program{tag_no % 40:02d}.Local_Tag_{tag_no:06d}'
+        else:
+            tag_name = f'Controller_Tag_{tag_no:06d}'
+        tag_list[tag_name] = {"type": random.choice(_TYPES)}
+    return tag_list
+
+
+def get_rss_kb():
+    """The resident memory of this process (KB)"""
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def measure(cache_format, file_path, lookups):
+    """Load a cache file, look up tags in it, and print the numbers as JSON (run in a fresh process)"""
+    rss_before = get_rss_kb()
+    started = time.perf_counter()
+    if cache_format == "binary":
+        tag_list = BinaryTagList(file_path)
+    elif cache_format == "compact":
+        with open(file_path, "r") as file:
+            tag_list = CompactTagList.load(file)
+    else:
+        with open(file_path, "r") as file:
+            tag_list = json.load(file)
+    load_ms = (time.perf_counter() - started) * 1000
+    rss_after_load = get_rss_kb()
+
+    tag_names = list(tag_list)
+    random.seed(2)
+    sample = [random.choice(tag_names) for _ in range(lookups)]
+    del tag_names
+    started = time.perf_counter()
+    for tag_name in sample:
+        tag_list.get(tag_name)["type"]
+    lookup_us = (time.perf_counter() - started) * 1e6 / lookups
+
+    print(json.dumps({'load_ms': load_ms, 'rss_kb': rss_after_load - rss_before, 'lookup_us': lookup_us}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tag list cache formats")
+    parser.add_argument("--tags", type=int, default=50000, help="Number of tags in the tag list (default 50000)")
+    parser.add_argument("--lookups", type=int, default=10000, help="Number of tag lookups (default 10000)")
+    parser.add_argument("--measure", nargs=2, metavar=("FORMAT", "FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure[0], args.measure[1], args.lookups)
+        return
+
+    tag_list = make_tag_list(args.tags)
+    with tempfile.TemporaryDirectory() as directory:
+        files = {"json": os.path.join(directory, "plc.json"), "binary": os.path.join(directory, "plc.tags")}
+        with open(files["json"], "w") as file:
+            json.dump(tag_list, file)
+        write_binary_tag_list(files["binary"], tag_list)
+        files = {"json": files["json"], "compact": files["json"], "binary": files["binary"]}
+
+        print(f'{args.tags} tags, {args.lookups} lookups')
+        print(f'{"format":<8} {"file KB":>10} {"load ms":>10} {"RSS KB":>10} {"lookup us":>10}')
+        for cache_format, file_path in files.items():
+            output = subprocess.run([sys.executable, __file__, "--lookups", str(args.lookups),
+                                     "--measure", cache_format, file_path],
+                                    check=True, capture_output=True, text=True, env=os.environ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f'{cache_format:<8} {os.path.getsize(file_path) // 1024:>10} {result["load_ms"]:>10.1f} '
+                  f'{result["rss_kb"]:>10} {result["lookup_us"]:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# Python dependencies
+import threading
+
+# Import our own dependencies
+import model_PlcList
+import model_BatchList
+from controller_get_tag_list import TagList
+from read_planner import ReadPlanner
+from plc_session_pool import PlcSessionPool
+from read_chunk_tuner import ReadChunkTuner
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+class _BatchReadPlan:
+    """A helper class to store everything needed to read one batch, resolved ahead of time"""
+
+    def __init__(self, batch_config, plc_config, tag_list, tag_types, tag_types_version, config_generations):
+        self.batch_config = batch_config
+        self.plc_config = plc_config
+        # The batch tag list with the allow/exclude rules of the PLC already applied
+        self.tag_list = tag_list
+        # tag_name -> tag type (resolved against the PLC tag list), or None if the PLC tag list wasn't available
+        self.tag_types = tag_types
+        self.tag_types_version = tag_types_version
+        self.config_generations = config_generations
+
+
+class BatchReadPlans:
+    """
+    Ready-to-execute read plans for the batches of the config.
+    Supports a singleton pattern so that only one instance is created!
+
+    Each batch is resolved once into its PLC config, its tag list (filtered by the PLC's allow/exclude rules)
+    and the tag type of each of its tags. Its packet chunking is planned ahead too (see ReadPlanner, which
+    caches the plan). A plan is rebuilt only when the config is reloaded or its PLC gets a new tag list.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(BatchReadPlans, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._plans = {}
+        return cls._instance
+
+    def build(self, batch_list: model_BatchList.BatchList):
+        """
+        Build the plan of every batch (at startup).
+        :param batch_list: the list of batch configs
+        """
+        for batch_config in batch_list:
+            plan = self.get(batch_config.id)
+            if plan is None:
+                shared_logger.log.error(f'No read plan for tag_batch_id="{batch_config.id}": '
+                                        f'plc_id="{batch_config.plc_id}" not found in the config.')
+
+    def get(self, batch_id):
+        """
+        Get the read plan of a batch, rebuilding it if the config or its PLC tag list changed.
+        :param batch_id: the batch ID
+        :return: the _BatchReadPlan, or None if the batch or its PLC is not in the config
+        """
+        with self._lock:
+            plan = self._plans.get(batch_id)
+        if plan is not None and self._is_current(plan):
+            return plan
+
+        plan = self._build_plan(batch_id)
+        with self._lock:
+            if plan is None:
+                self._plans.pop(batch_id, None)
+            else:
+                self._plans[batch_id] = plan
+        return plan
+
+    @classmethod
+    def _config_generations(cls):
+        return model_PlcList.PlcList().generation, model_BatchList.BatchList().generation
+
+    def _is_current(self, plan):
+        """Return True if neither the config nor the PLC tag list changed since the plan was built"""
+        if plan.config_generations != self._config_generations():
+            return False
+        _, tag_types_version = ReadPlanner.get_tag_types(plan.plc_config.id)
+        return plan.tag_types_version == tag_types_version
+
+    def _build_plan(self, batch_id):
+        """Resolve a batch into a _BatchReadPlan"""
+        config_generations = self._config_generations()
+        batch_config = model_BatchList.BatchList().get(batch_id)
+        if batch_config is None:
+            return None
+        plc_config = model_PlcList.PlcList().get(batch_config.plc_id)
+        if plc_config is None:
+            return None
+
+        tag_list = plc_config.access_policy.filter(batch_config.tag_list)
+        plc_tag_list, tag_types_version = ReadPlanner.get_tag_types(plc_config.id)
+        tag_types = None
+        if plc_tag_list is not None:
+            tag_types = TagList.resolve_tag_types(plc_tag_list, ReadPlanner.get_udt_types(plc_config.id), tag_list)
+
+        # Plan the packets ahead for the connection size we know of, so the first read doesn't have to
+        if PlcSessionPool.is_fixed_connection_size(plc_config.connection_size):
+            connection_size = plc_config.connection_size
+        else:
+            connection_size = PlcSessionPool().get_connection_size(plc_config.ip, plc_config.port, plc_config.slot)
+        if connection_size is not None:
+            chunk_size = ReadChunkTuner().get_chunk_size(plc_config.id, connection_size)
+            chunks = ReadPlanner.plan(plc_config.id, tag_list, chunk_size)
+            shared_logger.log.debug(f'Read plan for tag_batch_id="{batch_id}": {len(tag_list)} tag(s) in '
+                                    f'{len(chunks)} packet(s) of up to {chunk_size} bytes')
+        return _BatchReadPlan(batch_config, plc_config, tag_list, tag_types, tag_types_version, config_generations)
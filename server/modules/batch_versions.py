@@ -0,0 +1,173 @@
+# Python dependencies
+import hashlib
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+
+# The memory shared by the worker processes: the last seq given out, then a slot per batch with the digest of the
+# latest values seen for it and their seq
+_COUNTER = struct.Struct('<Q')
+_SLOT = struct.Struct('<16sQ')
+
+
+def _is_same_value(value, other_value):
+    """Compare two tag values, with NaN the same as NaN (so a NaN tag doesn't change on every read)"""
+    if value == other_value:
+        return True
+    return (isinstance(value, float) and isinstance(other_value, float)
+            and math.isnan(value) and math.isnan(other_value))
+
+
+def _is_same_state(state, other_state):
+    """Compare two (success, value) tag states"""
+    return state[0] == other_state[0] and _is_same_value(state[1], other_state[1])
+
+
+class _BatchVersion:
+    """A helper class to store the recent versions of a batch, and the tag states of each"""
+
+    def __init__(self):
+        self.seq = None
+        # seq -> {tag_name: (success, value)}, the most recent last
+        self.history = OrderedDict()
+        # The last list of tag values compared, so polls of the same scan skip the comparison
+        self.last_tag_values = None
+
+    def is_changed(self, states):
+        """Return True if the tag states are different from those of the current version"""
+        if self.seq is None:
+            return True
+        current_states = self.history[self.seq]
+        return (len(states) != len(current_states)
+                or any(tag_name not in current_states or not _is_same_state(state, current_states[tag_name])
+                       for tag_name, state in states.items()))
+
+
+class BatchVersions:
+    """
+    The version (seq) of the values of each batch, for /get_tag_batch delta responses.
+    Supports a singleton pattern so that only one instance is created!
+
+    The seq of a batch only goes up: each time a worker process reads values of a batch that differ from the
+    previous ones, they get the next number of a counter shared by all the workers. A worker that reads the same
+    values as the latest ones numbered for the batch (by any worker) gives them the same seq, so polls that land on
+    different workers still agree on it.
+
+    Each worker remembers the tag values of the last few versions of each batch it read, so a client that passes
+    the seq of its last response as since only gets the tags whose value differs from that version. A since the
+    worker doesn't remember gets every tag.
+
+    The epoch identifies the server run. It's made once, before the worker processes are forked, so all the
+    workers share it, and it changes when the server restarts.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    # Defaults. The number of versions of each batch remembered.
+    history_size = 8
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(BatchVersions, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._batches = {}
+            cls._instance.epoch = uuid.uuid4().hex[:12]
+            cls._instance.configure([])
+        return cls._instance
+
+    def configure(self, batch_ids):
+        """
+        Set up the memory shared by the worker processes, with a slot for each batch. Call before the workers are
+        forked (see server.py).
+        :param batch_ids: the IDs of the batches in the config
+        """
+        self._slots = {batch_id: index for index, batch_id in enumerate(dict.fromkeys(batch_ids))}
+        # An anonymous mapping, which forked processes share
+        self._shared = mmap.mmap(-1, _COUNTER.size + len(self._slots) * _SLOT.size)
+        self._shared_lock = multiprocessing.Lock()
+
+    def update(self, batch_id, tag_values, since=None):
+        """
+        Record the values read for a batch, and return what changed.
+        :param batch_id: the batch ID
+        :param tag_values: the list of tag values read (dictionaries with tag_name, value and success)
+        :param since: the seq of the client's last response (of this epoch), or None for every tag
+        :return: a tuple of (the batch seq, the tag values that are different from version since, or all of them
+            if since is None or not a version of this batch that's remembered)
+        """
+        with self._lock:
+            version = self._batches.get(batch_id)
+            if version is None:
+                version = self._batches[batch_id] = _BatchVersion()
+
+            if tag_values is not version.last_tag_values:
+                states = {tag_value['tag_name']: (tag_value['success'], tag_value['value'])
+                          for tag_value in tag_values}
+                if version.is_changed(states):
+                    version.seq = self._next_seq(batch_id, tag_values)
+                    version.history[version.seq] = states
+                    while len(version.history) > self.history_size:
+                        version.history.popitem(last=False)
+                version.last_tag_values = tag_values
+
+            since_states = version.history.get(since) if since is not None else None
+            if since_states is None:
+                return version.seq, tag_values
+            current_states = version.history[version.seq]
+            return version.seq, [tag_value for tag_value in tag_values
+                                 if tag_value['tag_name'] not in since_states
+                                 or not _is_same_state(since_states[tag_value['tag_name']],
+                                                       current_states[tag_value['tag_name']])]
+
+    def _next_seq(self, batch_id, tag_values):
+        """
+        Return the seq of new values of a batch: the seq the latest values numbered for the batch got if these are
+        the same values (read by another worker), else the next number of the shared counter.
+        """
+        slot = self._slots.get(batch_id)
+        digest = self._get_digest(tag_values) if slot is not None else None
+        slot_offset = _COUNTER.size + slot * _SLOT.size if slot is not None else None
+        with self._shared_lock:
+            if slot is not None:
+                latest_digest, latest_seq = _SLOT.unpack_from(self._shared, slot_offset)
+                if latest_seq and latest_digest == digest:
+                    return latest_seq
+            (seq,) = _COUNTER.unpack_from(self._shared, 0)
+            seq += 1
+            _COUNTER.pack_into(self._shared, 0, seq)
+            if slot is not None:
+                _SLOT.pack_into(self._shared, slot_offset, digest, seq)
+        return seq
+
+    @classmethod
+    def _get_digest(cls, tag_values):
+        """Hash the tag names, read successes and values of a batch, to spot the same values read by another
+        worker"""
+        content = repr([(tag_value['tag_name'], tag_value['success'], tag_value['value'])
+                        for tag_value in tag_values])
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+
+def _reset_batch_versions_after_fork():
+    """
+    The lock may have been held by another thread at the time of the fork. The epoch and the shared memory are
+    shared by all workers.
+    """
+    if BatchVersions._instance is not None:
+        BatchVersions._instance._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_batch_versions_after_fork)
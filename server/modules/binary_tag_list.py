@@ -0,0 +1,184 @@
+# Python dependencies
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Mapping
+
+# A binary tag list cache file is laid out as:
+# - a header: magic, format version, tag count, type count, and the offsets of the type table and the name table
+# - the index: one entry per tag, sorted by tag name (UTF-8 bytes), with the offset and length of the name in the
+#   name table and the index of its type in the type table
+# - the type table: each distinct type name once, as a length followed by its UTF-8 bytes
+# - the name table: every tag name in UTF-8, one after the other
+_MAGIC = b'PLTL'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHIIII')
+_INDEX_ENTRY = struct.Struct('<IHH')
+_TYPE_LENGTH = struct.Struct('<H')
+
+
+def write_binary_tag_list(file_path, tag_list):
+    """
+    Write a tag list to a binary tag list cache file, atomically (see utils.write_json_file_atomically).
+    :param file_path: the path of the file
+    :param tag_list: the tag list dictionary ({tag_name: {"type": data_type}})
+    """
+    types = []
+    type_indexes = {}
+    entries = []
+    for tag_name, tag_info in tag_list.items():
+        tag_type = tag_info.get("type") or ""
+        type_index = type_indexes.get(tag_type)
+        if type_index is None:
+            type_index = type_indexes[tag_type] = len(types)
+            types.append(tag_type)
+        entries.append((tag_name.encode('utf-8'), type_index))
+    entries.sort()
+
+    type_table = b''.join(_TYPE_LENGTH.pack(len(encoded)) + encoded
+                          for encoded in (tag_type.encode('utf-8') for tag_type in types))
+    index = bytearray()
+    name_offset = 0
+    for encoded_name, type_index in entries:
+        index += _INDEX_ENTRY.pack(name_offset, len(encoded_name), type_index)
+        name_offset += len(encoded_name)
+    types_offset = _HEADER.size + len(index)
+    names_offset = types_offset + len(type_table)
+    header = _HEADER.pack(_MAGIC, _VERSION, 0, len(entries), len(types), types_offset, names_offset)
+
+    file_descriptor, temp_file_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            file.write(header)
+            file.write(index)
+            file.write(type_table)
+            for encoded_name, _ in entries:
+                file.write(encoded_name)
+        os.replace(temp_file_path, file_path)
+    except Exception:
+        os.remove(temp_file_path)
+        raise
+
+
+class BinaryTagList(Mapping):
+    """
+    A tag list backed by a memory-mapped binary tag list cache file (see write_binary_tag_list).
+
+    Reads like the tag list dictionary ({tag_name: {"type": data_type}}), but nothing is deserialized up front: a
+    lookup is a binary search of the sorted index in the mapped file, and the pages of the file are shared by every
+    worker process that maps it. Iterating yields the tag names sorted.
+    """
+
+    def __init__(self, file_path):
+        """
+        Map a binary tag list cache file.
+        :param file_path: the path of the file
+        """
+        with open(file_path, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self._count, type_count, types_offset, self._names_offset = \
+            _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._mm.close()
+            raise ValueError(f'{file_path} is not a binary tag list cache file (version {_VERSION})')
+
+        # The few distinct types are decoded once, and each is shared by all the tags of that type
+        self._types = []
+        offset = types_offset
+        for _ in range(type_count):
+            (length,) = _TYPE_LENGTH.unpack_from(self._mm, offset)
+            offset += _TYPE_LENGTH.size
+            self._types.append(self._mm[offset:offset + length].decode('utf-8'))
+            offset += length
+
+    def _entry(self, position):
+        """Return the (name offset, name length, type index) of the tag at a position of the index"""
+        return _INDEX_ENTRY.unpack_from(self._mm, _HEADER.size + position * _INDEX_ENTRY.size)
+
+    def _name_bytes(self, name_offset, name_length):
+        start = self._names_offset + name_offset
+        return self._mm[start:start + name_length]
+
+    def get_type(self, tag_name):
+        """
+        Get the type of a tag.
+        :param tag_name: the tag name
+        :return: the tag type, or None if the tag is not in the tag list
+        """
+        encoded_name = tag_name.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            name_offset, name_length, type_index = self._entry(middle)
+            name = self._name_bytes(name_offset, name_length)
+            if name < encoded_name:
+                low = middle + 1
+            elif name > encoded_name:
+                high = middle
+            else:
+                return self._types[type_index]
+        return None
+
+    def __getitem__(self, tag_name):
+        tag_type = self.get_type(tag_name) if isinstance(tag_name, str) else None
+        if tag_type is None:
+            raise KeyError(tag_name)
+        return {"type": tag_type}
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for name_offset, name_length, _ in self._iter_entries():
+            yield self._name_bytes(name_offset, name_length).decode('utf-8')
+
+    def items(self):
+        """Iterate the (tag_name, {"type": data_type}) pairs in one pass over the index"""
+        for name_offset, name_length, type_index in self._iter_entries():
+            yield self._name_bytes(name_offset, name_length).decode('utf-8'), {"type": self._types[type_index]}
+
+    def type_items(self):
+        """Iterate the (tag_name, tag_type) pairs, in one pass over the index"""
+        for name_offset, name_length, type_index in self._iter_entries():
+            yield self._name_bytes(name_offset, name_length).decode('utf-8'), self._types[type_index]
+
+    def _iter_entries(self):
+        # A memoryview, so the index isn't copied out of the mapped file
+        index_end = _HEADER.size + self._count * _INDEX_ENTRY.size
+        return _INDEX_ENTRY.iter_unpack(memoryview(self._mm)[_HEADER.size:index_end])
+
+    def sorted_names(self):
+        """Return the tag names, sorted, as a sequence that decodes each name only when it's accessed"""
+        return _SortedNames(self)
+
+    def sorted_type_columns(self):
+        """Return (the distinct types, the index of the type of each tag in that list, in sorted tag name order)"""
+        return self._types, (type_index for _, _, type_index in self._iter_entries())
+
+    def content_hash(self):
+        """Return a hash of the tag names and types (of the whole file, which holds nothing else)"""
+        return hashlib.blake2b(self._mm, digest_size=16).hexdigest()
+
+    def to_dict(self):
+        """Return the tag list as a dictionary (i.e. to serialize it)"""
+        return dict(self.items())
+
+
+class _SortedNames:
+    """The sorted tag names of a BinaryTagList, as a sequence (i.e. to bisect it)"""
+
+    __slots__ = ("_tag_list",)
+
+    def __init__(self, tag_list):
+        self._tag_list = tag_list
+
+    def __len__(self):
+        return len(self._tag_list)
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self._tag_list):
+            raise IndexError(position)
+        name_offset, name_length, _ = self._tag_list._entry(position)
+        return self._tag_list._name_bytes(name_offset, name_length).decode('utf-8')
@@ -0,0 +1,111 @@
+# Python dependencies
+import hashlib
+import json
+import sys
+from collections.abc import Mapping
+
+
+class CompactTagList(Mapping):
+    """
+    A tag list kept in memory as a single dictionary of tag name to type, with each distinct type string interned.
+
+    Reads like the tag list dictionary ({tag_name: {"type": data_type}}) but doesn't keep a dictionary per tag: all
+    the tags of a type share one string, so a tag costs its name and one dictionary slot. The {"type": data_type}
+    of a tag is only made when it's looked up.
+    """
+
+    __slots__ = ("_types", "_sorted_names")
+
+    def __init__(self, tag_list):
+        """
+        :param tag_list: the tag list dictionary ({tag_name: {"type": data_type}}), as read from the PLC or from a
+            JSON cache file
+        """
+        types = {}
+        for tag_name, tag_info in tag_list.items():
+            tag_type = tag_info.get("type")
+            types[tag_name] = sys.intern(tag_type) if isinstance(tag_type, str) else tag_type
+        self._types = types
+        self._sorted_names = None
+
+    @classmethod
+    def load(cls, file):
+        """
+        Read a JSON tag list cache file straight into a CompactTagList.
+        :param file: the open file
+        :return: the CompactTagList
+
+        The {"type": data_type} of each tag is replaced by a (data_type,) tuple shared by all the tags of that type
+        while it's parsed, so the dictionary per tag is never made (and the memory it took is not left behind).
+        """
+        type_refs = {}
+
+        def object_pairs_hook(pairs):
+            if len(pairs) == 1 and pairs[0][0] == "type" and not isinstance(pairs[0][1], tuple):
+                # The {"type": data_type} of a tag
+                tag_type = pairs[0][1]
+                type_ref = type_refs.get(tag_type)
+                if type_ref is None:
+                    type_ref = type_refs[tag_type] = (sys.intern(tag_type) if isinstance(tag_type, str)
+                                                      else tag_type,)
+                return type_ref
+            # The tag list itself
+            return {tag_name: tag_info[0] if isinstance(tag_info, tuple) else tag_info.get("type")
+                    for tag_name, tag_info in pairs}
+
+        tag_list = cls.__new__(cls)
+        tag_list._types = json.load(file, object_pairs_hook=object_pairs_hook)
+        tag_list._sorted_names = None
+        return tag_list
+
+    def get_type(self, tag_name):
+        """
+        Get the type of a tag.
+        :param tag_name: the tag name
+        :return: the tag type, or None if the tag is not in the tag list
+        """
+        return self._types.get(tag_name)
+
+    def __getitem__(self, tag_name):
+        return {"type": self._types[tag_name]}
+
+    def __contains__(self, tag_name):
+        return tag_name in self._types
+
+    def __len__(self):
+        return len(self._types)
+
+    def __iter__(self):
+        return iter(self._types)
+
+    def type_items(self):
+        """Iterate the (tag_name, tag_type) pairs"""
+        return iter(self._types.items())
+
+    def sorted_names(self):
+        """Return the tag names, sorted (sorted once, then kept)"""
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self._types)
+        return self._sorted_names
+
+    def sorted_type_columns(self):
+        """Return (the distinct types, the index of the type of each tag in that list, in sorted tag name order)"""
+        types = []
+        type_indexes = {}
+        column = []
+        for tag_name in self.sorted_names():
+            tag_type = self._types[tag_name]
+            type_index = type_indexes.get(tag_type)
+            if type_index is None:
+                type_index = type_indexes[tag_type] = len(types)
+                types.append(tag_type)
+            column.append(type_index)
+        return types, column
+
+    def content_hash(self):
+        """Return a hash of the tag names and types, in the order they're iterated (and served) in"""
+        return hashlib.blake2b(json.dumps(self._types, ensure_ascii=False).encode('utf-8'), digest_size=16).hexdigest()
+
+    def to_dict(self):
+        """Return the tag list as a dictionary (i.e. to serialize it)"""
+        return {tag_name: {"type": tag_type} for tag_name, tag_type in self._types.items()}
@@ -1,6 +1,9 @@
 # Python dependencies
 import json
 import os
+import re
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import List
 
@@ -8,18 +11,37 @@ from typing import List
 import utils
 import plc_io
 import model_PlcList
+from read_planner import ReadPlanner
+from binary_tag_list import BinaryTagList, write_binary_tag_list
+from compact_tag_list import CompactTagList
+from tag_list_index import TagListIndex
 
 # Default logging to DEBUG
 import modules.logger as logger
 shared_logger = logger.CustomLogger()
 
 
+# Array indexes in a tag name, i.e. the "[3]" of "Tag[3]" or the "[1,2]" of "Tag[1,2].Member"
+_ARRAY_INDEX_REGEX = re.compile(r'\[[^\]]*\]')
+
+# Types a bit can be addressed in with "Tag.<bit number>"
+_INTEGER_TYPES = ("SINT", "INT", "DINT", "LINT", "USINT", "UINT", "UDINT", "ULINT", "BYTE", "WORD", "DWORD", "LWORD")
+
+
 class _TagListForPlc:
     """A helper class to store the tag list and its timestamp for a given PLC
     """
-    def __init__(self, tag_list, tag_list_updated):
+    def __init__(self, tag_list, tag_list_updated, udt_types=None):
+        # A CompactTagList (or a BinaryTagList, for the binary cache format)
         self.tag_list = tag_list
         self.tag_list_updated = tag_list_updated
+        # The member types of the UDTs of the PLC ({udt_name: {member_name: data_type}})
+        self.udt_types = udt_types or {}
+        # Built along with the tag list, for /get_tag_list queries
+        self.index = TagListIndex(tag_list)
+        # Identifies the content of the tag list, for the ETag of /get_tag_list responses. The same in every worker,
+        # which all load the same cache file.
+        self.etag = f'W/"{tag_list.content_hash()}"'
 
     def __getitem__(self, key):
         """Helper method to get a property by name"""
@@ -34,19 +56,161 @@ class TagList:
     cache_ttl = None
     tag_lists = None
 
-    def __init__(self, cache_directory, cache_ttl):
+    # When True, an expired tag list is returned right away while it's refreshed in the background (see
+    # get_tag_list). This can be changed with the server.py command line arguments.
+    stale_while_revalidate = True
+    # Seconds before a background refresh that failed (i.e. the PLC is offline) is tried again
+    refresh_retry_interval = 60
+    # The format of the tag list cache files: "json", or "binary" (memory-mapped, see binary_tag_list.py) for PLCs
+    # with very large tag lists. This can be changed with the server.py command line arguments.
+    cache_format = "json"
+
+    def __init__(self, cache_directory, cache_ttl, stale_while_revalidate=None, cache_format=None):
         """Initialize the TagList class with the cache directory and cache TTL.
         :param cache_directory: the directory to store the tag list cache files
         :param cache_ttl: the time-to-live (in minutes) for the tag list cache files
+        :param stale_while_revalidate: optional, whether expired tag lists are refreshed in the background
+        :param cache_format: optional, the format of the tag list cache files ("json" or "binary")
         """
         self.cache_directory = cache_directory
         self.cache_ttl = cache_ttl
         self.tag_lists = {}
+        if stale_while_revalidate is not None:
+            self.stale_while_revalidate = stale_while_revalidate
+        if cache_format is not None:
+            self.cache_format = cache_format
+        self._reset_refresh_state()
+        # Threads don't survive a fork, so a worker must not inherit a lock held by a refresh in the parent
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_refresh_state)
 
-    def get_tag_list(self, plc_config: model_PlcList.PlcConfig):
+    def _reset_refresh_state(self):
+        """Set up (or, after a fork, reset) the per PLC refresh locks"""
+        self._refresh_locks_lock = threading.Lock()
+        # plc_id -> the lock held while the tag list of that PLC is loaded, so only one thread loads it at a time
+        self._refresh_locks = {}
+        # plc_ids with a background refresh running
+        self._refreshing = set()
+        # plc_id -> time.monotonic() of the last background refresh that failed
+        self._refresh_failed = {}
+
+    def get_tag_list(self, plc_config: model_PlcList.PlcConfig, revalidate=False):
         """Get tag list from either the CACHE (if exists and within TTL) or the PLC directly.
         :param plc_config: a JSON object that has the properties id, ip, port, and plc_slot
+        :param revalidate: if True, check a cache file with the PLC even if it's within TTL (i.e. one left by a
+            previous run of the server)
+        :return: a tuple of (tag_list, tag_list_timestamp)
+
+        With stale_while_revalidate, a tag list past its TTL is still returned right away, and a single background
+        refresh per PLC loads the new one. Otherwise (or if nothing is cached yet), the caller waits for the load,
+        but only one thread per PLC loads it and the others wait for its result.
+        """
+        plc_id = plc_config.id
+
+        if not revalidate:
+            # If we have the tag list in memory, return it so long as it's within ttl
+            tag_list_for_plc = self._get_tag_list_in_memory(plc_id)
+            if tag_list_for_plc is not None:
+                shared_logger.log.debug(f'Returning in-memory tag list for plc_id: {plc_id}')
+                return tag_list_for_plc.tag_list, tag_list_for_plc.tag_list_updated
+
+            if self.stale_while_revalidate:
+                tag_list_for_plc = self._get_stale_tag_list(plc_config)
+                if tag_list_for_plc is not None:
+                    shared_logger.log.debug(f'Returning expired tag list for plc_id: {plc_id} while it\'s refreshed')
+                    self._refresh_in_background(plc_config)
+                    return tag_list_for_plc.tag_list, tag_list_for_plc.tag_list_updated
+
+        with self._get_refresh_lock(plc_id):
+            # Another thread may have loaded it while we waited for the lock
+            tag_list_for_plc = None if revalidate else self._get_tag_list_in_memory(plc_id)
+            if tag_list_for_plc is not None:
+                return tag_list_for_plc.tag_list, tag_list_for_plc.tag_list_updated
+            # A PLC that just failed to answer isn't asked again before refresh_retry_interval, the expired tag
+            # list is used meanwhile
+            if not revalidate and self._is_refresh_failed(plc_id):
+                tag_list_for_plc = self._get_stale_tag_list(plc_config)
+                if tag_list_for_plc is not None:
+                    return tag_list_for_plc.tag_list, tag_list_for_plc.tag_list_updated
+            return self._load_tag_list(plc_config, revalidate)
+
+    def _get_refresh_lock(self, plc_id):
+        """Return the lock held while the tag list of a PLC is loaded"""
+        with self._refresh_locks_lock:
+            lock = self._refresh_locks.get(plc_id)
+            if lock is None:
+                lock = self._refresh_locks[plc_id] = threading.Lock()
+            return lock
+
+    def _get_stale_tag_list(self, plc_config):
+        """Return the _TagListForPlc of a PLC whatever its age (from memory, or else from an expired cache file),
+        or None if there is none"""
+        if not plc_config.id:
+            return None
+        tag_list_for_plc = self.tag_lists.get(plc_config.id)
+        if tag_list_for_plc is not None:
+            return tag_list_for_plc
+        cache_full_path = self.get_cache_file_path(plc_config.id)
+        try:
+            file_timestamp = os.path.getmtime(cache_full_path)
+            return self._load_cache_file(plc_config.id, cache_full_path, file_timestamp)
+        except (OSError, ValueError):
+            return None
+
+    def _refresh_in_background(self, plc_config):
+        """Start a background refresh of the tag list of a PLC, unless one is running or one just failed"""
+        plc_id = plc_config.id
+        with self._refresh_locks_lock:
+            if plc_id in self._refreshing:
+                return
+            failed = self._refresh_failed.get(plc_id)
+            if failed is not None and time.monotonic() - failed < self.refresh_retry_interval:
+                return
+            self._refreshing.add(plc_id)
+        threading.Thread(target=self._refresh, args=(plc_config,), name="tag-list-refresh", daemon=True).start()
+
+    def _set_refresh_failed(self, plc_id):
+        """Remember that the tag list of a PLC couldn't be refreshed, so it isn't tried again too soon"""
+        with self._refresh_locks_lock:
+            self._refresh_failed[plc_id] = time.monotonic()
+
+    def _is_refresh_failed(self, plc_id):
+        """Return True if a refresh of the tag list of a PLC failed less than refresh_retry_interval ago"""
+        with self._refresh_locks_lock:
+            failed = self._refresh_failed.get(plc_id)
+        return failed is not None and time.monotonic() - failed < self.refresh_retry_interval
+
+    def _refresh(self, plc_config):
+        """Refresh the tag list of a PLC (run by a background thread)"""
+        plc_id = plc_config.id
+        try:
+            with self._get_refresh_lock(plc_id):
+                if self._get_tag_list_in_memory(plc_id) is None:
+                    self._load_tag_list(plc_config)
+            # The expired tag list is kept if the PLC couldn't be checked, which is a failed refresh too
+            if self._get_tag_list_in_memory(plc_id) is None:
+                self._set_refresh_failed(plc_id)
+            else:
+                with self._refresh_locks_lock:
+                    self._refresh_failed.pop(plc_id, None)
+        except Exception:
+            # Already logged by _load_tag_list. Keep serving the expired tag list, and try again later.
+            self._set_refresh_failed(plc_id)
+        finally:
+            with self._refresh_locks_lock:
+                self._refreshing.discard(plc_id)
+
+    def _load_tag_list(self, plc_config: model_PlcList.PlcConfig, revalidate=False):
+        """Load the tag list from either the CACHE file (if exists and within TTL) or the PLC directly. Call with
+        the refresh lock of the PLC held.
+        :param plc_config: a JSON object that has the properties id, ip, port, and plc_slot
+        :param revalidate: if True, check a cache file with the PLC even if it's within TTL (i.e. one left by a
+            previous run of the server)
         :return: a tuple of (tag_list, tag_list_timestamp)
+
+        A cache file that is past its TTL (or asked to be revalidated) is checked against the controller's change
+        counters, a single small request. If they didn't change, the file is kept for another TTL, and the tag
+        list is only read again from the PLC when its program actually changed.
         """
         shared_logger.log.debug(f'Getting tag list for plc_config: {plc_config}')
 
@@ -61,17 +225,10 @@ class TagList:
             if not plc_ip or not isinstance(plc_slot, int) or not plc_id or not plc_port:
                 raise Exception(f'Missing required field(s) in plc_config: {plc_config}')
 
-            # If we have the tag list in memory, return it so long as it's within ttl
-            if plc_id in self.tag_lists:
-                tag_list_for_plc = self.tag_lists[plc_id]
-                # Check if the tag list is for this plc_id within TTL
-                if utils.is_timestamp_old(tag_list_for_plc.tag_list_updated, self.cache_ttl):
-                    # Return the tag list from memory
-                    shared_logger.log.debug(f'Returning in-memory tag list for plc_id: {plc_id}')
-                    return tag_list_for_plc.tag_list, tag_list_for_plc.tag_list_updated
-
-            # Calculate the file name for this PLC tag list cache file
-            cache_full_path = os.path.join(self.cache_directory, f'{utils.convert_to_safe_filename(plc_id)}.json')
+            # Calculate the file name for this PLC tag list cache file (and the one with its UDT definitions and
+            # change counters)
+            cache_full_path = self.get_cache_file_path(plc_id)
+            meta_cache_full_path = self.get_meta_cache_file_path(plc_id)
             shared_logger.log.debug(f'Cache file name: {cache_full_path}')
 
             cache_exists = os.path.exists(cache_full_path)
@@ -81,25 +238,57 @@ class TagList:
             else:
                 is_cache_old, file_timestamp = True, 0
 
-            if cache_exists and not is_cache_old:
+            # An old cache file is still good if the PLC's program didn't change since it was saved. If the PLC
+            # can't be asked (i.e. it's offline), the file is used as is rather than reading the whole tag list from
+            # a PLC that just failed to answer. A file past its TTL then stays expired, and is checked again after
+            # refresh_retry_interval.
+            is_unchecked = False
+            if cache_exists and (is_cache_old or revalidate):
+                is_unchanged = self._revalidate_cache_file(plc_config, cache_full_path, meta_cache_full_path)
+                is_unchecked = is_unchanged is None
+                if is_unchecked and is_cache_old:
+                    shared_logger.log.warning(f'plc_id="{plc_id}" using its expired cached tag list until it can '
+                                              f'be checked')
+                    self._set_refresh_failed(plc_id)
+                elif is_unchanged is not None:
+                    is_cache_old = not is_unchanged
+                if is_unchanged:
+                    file_timestamp = os.path.getmtime(cache_full_path)
+
+            if cache_exists and (not is_cache_old or is_unchecked):
                 # Read cached data from file
                 shared_logger.log.debug(f'Returning cached tag list for plc_id: {plc_id}')
-                with open(cache_full_path, "r") as file:
-                    tag_list = json.load(file)
+                tag_list_for_plc = self._load_cache_file(plc_id, cache_full_path, file_timestamp)
                 # return the tag list and the timestamp of the cache file
-                return tag_list, file_timestamp
+                return tag_list_for_plc.tag_list, tag_list_for_plc.tag_list_updated
             else:
                 # Try to pull tag_list from PLC
-                tag_list = plc_io.get_tag_list(plc_id, plc_ip, plc_slot, plc_port)
+                tag_list_info = {}
+                tag_list = plc_io.get_tag_list(plc_id, plc_ip, plc_slot, plc_port, plc_config.connection_size,
+                                               tag_list_info)
                 # If we got a tag_list, save it to cache
                 if tag_list is not None:
                     shared_logger.log.debug(f'Saving newly read tag list for plc_id: {plc_id}')
-                    with open(cache_full_path, "w") as file:
-                        json.dump(tag_list, file)
+                    udt_types = tag_list_info.get("udt_types", {})
+                    # Written to temporary files and swapped in, so readers (also in other workers) never see a
+                    # half written file
+                    utils.write_json_file_atomically(meta_cache_full_path, {
+                        "address": self._get_plc_address(plc_config),
+                        "fingerprint": tag_list_info.get("fingerprint"),
+                        "udt_types": udt_types,
+                    })
+                    if self.cache_format == "binary":
+                        write_binary_tag_list(cache_full_path, tag_list)
+                        # Use the mapped file from now on, rather than keep the dictionary in memory
+                        tag_list = BinaryTagList(cache_full_path)
+                    else:
+                        utils.write_json_file_atomically(cache_full_path, tag_list)
+                        tag_list = CompactTagList(tag_list)
                     # Get the timestamp of the cache file
                     update_time = os.path.getmtime(cache_full_path)
                     # Also save to memory
-                    self.tag_lists[plc_id] = _TagListForPlc(tag_list, update_time)
+                    self.tag_lists[plc_id] = _TagListForPlc(tag_list, update_time, udt_types)
+                    ReadPlanner.update_tag_types(plc_id, tag_list, udt_types)
                     shared_logger.log.debug(f'Returning newly cached tag list for plc_id: {plc_id}')
                     # return the tag list and the timestamp of the cache file
                     return tag_list, update_time
@@ -111,18 +300,158 @@ class TagList:
             shared_logger.log.error(custom_exception_message)
             raise Exception(custom_exception_message) from e
 
+    def _load_cache_file(self, plc_id, cache_full_path, file_timestamp):
+        """Read the tag list cache file of a PLC into memory (or map it, for the binary format), and return its
+        _TagListForPlc"""
+        if self.cache_format == "binary":
+            tag_list = BinaryTagList(cache_full_path)
+        else:
+            with open(cache_full_path, "r") as file:
+                tag_list = CompactTagList.load(file)
+        udt_types = self._read_meta_cache_file(self.get_meta_cache_file_path(plc_id)).get("udt_types", {})
+        # Keep it in memory too, so we don't read the file again until it expires
+        tag_list_for_plc = self.tag_lists[plc_id] = _TagListForPlc(tag_list, file_timestamp, udt_types)
+        # Let the read planner size reads of this PLC with the tag types
+        ReadPlanner.update_tag_types(plc_id, tag_list, udt_types)
+        return tag_list_for_plc
+
+    def get_cache_file_path(self, plc_id):
+        """Return the path of the tag list cache file of a PLC"""
+        extension = "tags" if self.cache_format == "binary" else "json"
+        return os.path.join(self.cache_directory, f'{utils.convert_to_safe_filename(plc_id)}.{extension}')
+
+    def get_meta_cache_file_path(self, plc_id):
+        """Return the path of the file saved next to the tag list cache file of a PLC, with its UDT definitions
+        and the controller's change counters"""
+        return os.path.join(self.cache_directory, f'{utils.convert_to_safe_filename(plc_id)}.meta.json')
+
+    @classmethod
+    def _get_plc_address(cls, plc_config):
+        """The address of a PLC, so a cache file isn't reused for a different PLC under the same plc_id"""
+        return f'{plc_config.ip}:{plc_config.port}/{plc_config.slot}'
+
+    @classmethod
+    def _read_meta_cache_file(cls, meta_cache_full_path):
+        """Return the content of a meta cache file, or an empty dictionary if it doesn't exist or can't be read"""
+        try:
+            with open(meta_cache_full_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _revalidate_cache_file(self, plc_config, cache_full_path, meta_cache_full_path):
+        """
+        Check a tag list cache file against the PLC's change counters and, if they didn't change, keep the file
+        for another TTL.
+        :return: True if the cache file is still good, False if it isn't (the program changed, or the file can't
+            be checked), or None if the change counters couldn't be read from the PLC
+        """
+        meta = self._read_meta_cache_file(meta_cache_full_path)
+        if not meta.get("fingerprint") or meta.get("address") != self._get_plc_address(plc_config):
+            return False
+        started = time.monotonic()
+        try:
+            fingerprint = plc_io.get_tag_list_fingerprint(plc_config.id, plc_config.ip, plc_config.slot,
+                                                          plc_config.port, plc_config.connection_size)
+        except Exception as e:
+            shared_logger.log.warning(f'plc_id="{plc_config.id}" unable to check if its program changed: {e}')
+            return None
+        elapsed_ms = (time.monotonic() - started) * 1000
+        if fingerprint != meta["fingerprint"]:
+            shared_logger.log.info(f'plc_id="{plc_config.id}" program changed ({elapsed_ms:.0f} ms check), '
+                                   f'reading its tag list again')
+            return False
+        # Unchanged, so start a new TTL for the file
+        os.utime(cache_full_path)
+        shared_logger.log.info(f'plc_id="{plc_config.id}" program unchanged ({elapsed_ms:.0f} ms check), '
+                               f'keeping its cached tag list')
+        return True
+
+    def get_tag_list_index(self, plc_config: model_PlcList.PlcConfig):
+        """Get the index of the tag list of a PLC (see get_tag_list), to query it.
+        :param plc_config: a JSON object that has the properties id, ip, port, and plc_slot
+        :return: a tuple of (TagListIndex, tag_list_timestamp)
+        """
+        self.get_tag_list(plc_config)
+        tag_list_for_plc = self.tag_lists[plc_config.id]
+        return tag_list_for_plc.index, tag_list_for_plc.tag_list_updated
+
+    def get_tag_list_with_etag(self, plc_config: model_PlcList.PlcConfig):
+        """Get the tag list of a PLC (see get_tag_list) along with its ETag.
+        :param plc_config: a JSON object that has the properties id, ip, port, and plc_slot
+        :return: a tuple of (tag_list, tag_list_timestamp, etag)
+        """
+        tag_list, tag_list_timestamp = self.get_tag_list(plc_config)
+        tag_list_for_plc = self.tag_lists.get(plc_config.id)
+        # The tag list may have been refreshed since, in which case its ETag isn't the one of this tag list
+        if tag_list_for_plc is None or tag_list_for_plc.tag_list is not tag_list:
+            return tag_list, tag_list_timestamp, None
+        return tag_list, tag_list_timestamp, tag_list_for_plc.etag
+
+    def _get_tag_list_in_memory(self, plc_id):
+        """Return the _TagListForPlc of a PLC if it's in memory and within ttl, else None"""
+        tag_list_for_plc = self.tag_lists.get(plc_id)
+        if tag_list_for_plc is None:
+            return None
+        is_old, _ = utils.is_timestamp_old(tag_list_for_plc.tag_list_updated, self.cache_ttl)
+        return None if is_old else tag_list_for_plc
+
     def get_tag_type(self, plc_config: model_PlcList.PlcConfig, tag_name):
         """Get the tag type for a given tag name.
         :param tag_name: the tag name to get the type for
         :param plc_config: a JSON object that has the properties id, ip, port, and slot_no
         :return: the PLC tag type (as a string)
         """
+        return self.get_tag_types(plc_config, [tag_name])[tag_name]
+
+    def get_tag_types(self, plc_config: model_PlcList.PlcConfig, tag_names):
+        """Get the tag types for a list of tag names, all resolved against the same tag list.
+        :param plc_config: a JSON object that has the properties id, ip, port, and slot_no
+        :param tag_names: the tag names to get the types for. Can address array elements and UDT members,
+            i.e. "Tag[3]" or "Udt.Member".
+        :return: a dictionary of {tag_name: PLC tag type (as a string)}, with "" for the tags that can't be
+            resolved (or all of them, if the tag list isn't available)
+        """
         try:
-            # get the tag list, find tag_name, and return the tag type
+            # get the tag list once for the whole list
             tag_list, _ = self.get_tag_list(plc_config)
-            if tag_list is not None:
-                return tag_list[tag_name]["type"]
-            return ""
+            tag_list_for_plc = self.tag_lists.get(plc_config.id)
+            udt_types = tag_list_for_plc.udt_types if tag_list_for_plc is not None else {}
         except Exception as e:
-            return ""
+            return {tag_name: "" for tag_name in tag_names}
+        return self.resolve_tag_types(tag_list, udt_types, tag_names)
 
+    @classmethod
+    def resolve_tag_types(cls, tag_list, udt_types, tag_names):
+        """Resolve the types of tag names against a tag list.
+        :param tag_list: the tag list dictionary of the PLC ({tag_name: {"type": data_type}})
+        :param udt_types: the member types of the UDTs of the PLC ({udt_name: {member_name: data_type}})
+        :param tag_names: the tag names to get the types for
+        :return: a dictionary of {tag_name: PLC tag type (as a string)}, with "" for the tags that can't be resolved
+        """
+        tag_types = {}
+        for tag_name in tag_names:
+            tag_info = tag_list.get(tag_name)
+            tag_types[tag_name] = tag_info["type"] if tag_info else cls._resolve_tag_type(tag_list, udt_types,
+                                                                                          tag_name)
+        return tag_types
+
+    @classmethod
+    def _resolve_tag_type(cls, tag_list, udt_types, tag_name):
+        """Resolve the type of an array element, UDT member or bit of a tag, i.e. "Tag[3]", "Udt.Member[2].Sub"
+        or "Tag.5" ("" if it can't be resolved)"""
+        members = _ARRAY_INDEX_REGEX.sub('', tag_name).split('.')
+        # Program tags are listed as "Program:Name.Tag", so their first two parts are the tag name
+        base_parts = 2 if tag_name.startswith('Program:') else 1
+        tag_info = tag_list.get('.'.join(members[:base_parts]))
+        if not tag_info:
+            return ""
+        tag_type = tag_info["type"]
+        for member in members[base_parts:]:
+            if member.isdigit():
+                # A bit of an integer
+                return "BOOL" if tag_type in _INTEGER_TYPES else ""
+            tag_type = udt_types.get(tag_type, {}).get(member)
+            if not tag_type:
+                return ""
+        return tag_type
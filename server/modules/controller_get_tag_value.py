@@ -1,10 +1,13 @@
 # Python dependencies
 import json
+import threading
+import time
 
 # Import our own dependencies
-import plc_io
 import utils
 import model_PlcList
+from read_coalescer import ReadCoalescer
+from tag_value_cache import TagValueCache
 
 # Default logging to DEBUG
 import modules.logger as logger
@@ -12,13 +15,29 @@ import modules.logger as logger
 shared_logger = logger.CustomLogger()
 
 
+class _InFlightRead:
+    """A helper class to store one PLC read that concurrent identical requests wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.tag_values = None
+        self.plc_time = None
+        self.error = None
+
+
 class TagValue:
 
+    # Registry of the PLC reads currently in progress, keyed by PLC and (filtered) tag list
+    _in_flight = {}
+    _in_flight_lock = threading.Lock()
+
     @classmethod
-    def get_tag_value(cls, plc_config: model_PlcList.PlcConfig, tag_name):
+    def get_tag_value(cls, plc_config: model_PlcList.PlcConfig, tag_name, max_age_ms=None, fresh_plc_time=False):
         """Get a tag value and coerce it to the proper TYPE.
         :param plc_config: a JSON object that has the properties id, ip, port, and plc_slot
         :param tag_name: the name of the tag to get the value for
+        :param max_age_ms: optional, serve the value from the tag value cache if it's younger than this
+        :param fresh_plc_time: optional, read the PLC (and its clock) now rather than deriving the PLC time
         :return: A tuple with a single item list of value of the tag (inside a dictionary), and the PLC time.
 
         If the tag value can't be retrieved, returns None for its value.
@@ -37,13 +56,18 @@ class TagValue:
         if not plc_ip or not isinstance(plc_slot, int) or not plc_id or not plc_port:
             raise Exception(f'Missing required field(s) in plc_config: {plc_config}')
 
-        return TagValue.get_tag_values(plc_config, [tag_name])
+        return TagValue.get_tag_values(plc_config, [tag_name], max_age_ms, fresh_plc_time)
 
     @classmethod
-    def get_tag_values(cls, plc_config: model_PlcList.PlcConfig, tag_list):
+    def get_tag_values(cls, plc_config: model_PlcList.PlcConfig, tag_list, max_age_ms=None, fresh_plc_time=False):
         """Get a list of tag values from a tag list (each coerced to the proper TYPE).
         :param plc_config: a JSON object that has the properties id, ip, port, and plc_slot
         :param tag_list: a list of tag names to get the values for (List of strings)
+        :param max_age_ms: optional, serve tags from the tag value cache if their value is younger than this. Only
+            the remaining tags are read from the PLC. When passed, each value also gets a "read_time" (unix
+            timestamp of when it was read) and the PLC time returned is the one of the oldest value.
+        :param fresh_plc_time: optional, read every tag and the PLC clock from the PLC now (no cached values), so the
+            PLC time returned comes straight from the PLC rather than from the tracked PLC clock (see plc_clock.py).
         :return: A tuple with the list of values of the tags (inside a dictionary each), and the PLC time.
 
         If any of the tags can't be retrieved, returns None for that tag's value.
@@ -76,12 +100,17 @@ class TagValue:
             raise Exception(f'Missing required field(s) in plc_config: {plc_config}')
 
         try:
-            # Process allow/disallow list (may remove some items from the tag list)
-            tag_list, tag_list_filtered = utils.process_allow_disallow_tag_list(tag_list, plc_config)
+            # Process allow/disallow list (may remove some items from the tag list). The rules are compiled once
+            # per PLC config (see tag_access_policy.py)
+            tag_list_filtered = plc_config.access_policy.filter(tag_list)
+
+            # A fresh PLC time means a fresh read, so no cached value qualifies (but values still get a read_time)
+            if fresh_plc_time and max_age_ms is not None:
+                max_age_ms = 0
 
             # Get the tag values from the PLC (note we use the filtered tag list)
-            tag_values, tag_value_timestamp = plc_io.get_tag_values(plc_id, plc_ip, plc_slot, plc_port,
-                                                                    tag_list_filtered)
+            tag_values, tag_value_timestamp = TagValue._read_with_cache(plc_config, tag_list_filtered, max_age_ms,
+                                                                        fresh_plc_time)
 
             # Did we get a tag values?
             if tag_values is None:
@@ -93,3 +122,124 @@ class TagValue:
         except Exception as e:
             shared_logger.log.error(f'GetTagValueHandler | on_post | {e}')
             return None, None
+
+    @classmethod
+    def get_batch_values(cls, plan, max_age_ms=None, fresh_plc_time=False):
+        """Get the values of a batch from its read plan (see batch_read_plan.py).
+        :param plan: the _BatchReadPlan of the batch, which has its PLC config and its already filtered tag list
+        :param max_age_ms: optional, see get_tag_values
+        :param fresh_plc_time: optional, see get_tag_values
+        :return: A tuple with the list of values of the tags (inside a dictionary each), and the PLC time.
+
+        Same as get_tag_values, without the validation and filtering that were done when the plan was built.
+        """
+        plc_config = plan.plc_config
+        try:
+            if fresh_plc_time and max_age_ms is not None:
+                max_age_ms = 0
+            tag_values, tag_value_timestamp = TagValue._read_with_cache(plc_config, plan.tag_list, max_age_ms,
+                                                                        fresh_plc_time)
+            if tag_values is None:
+                raise Exception(f"tag_values not available for plc_id='{plc_config.id}' "
+                                f"and tag_batch_id='{plan.batch_config.id}'!")
+            return tag_values, tag_value_timestamp
+
+        except Exception as e:
+            shared_logger.log.error(f'GetTagBatchHandler | on_post | {e}')
+            return None, None
+
+    @classmethod
+    def _read_with_cache(cls, plc_config: model_PlcList.PlcConfig, tag_list, max_age_ms, fresh_plc_time=False):
+        """Read a list of tag values, serving fresh enough values from the tag value cache.
+        :param plc_config: a JSON object that has the properties id, ip, port, and plc_slot
+        :param tag_list: a list of tag names to get the values for (already filtered by the allow/disallow lists)
+        :param max_age_ms: the maximum acceptable age of a cached value, or None to always read the PLC
+        :param fresh_plc_time: if True, the PLC clock is read along with the tags
+        :return: A tuple with the list of values of the tags (inside a dictionary each), and the PLC time.
+        """
+        tag_value_cache = TagValueCache()
+
+        if max_age_ms is None:
+            # Always read the PLC, but remember the values for requests that do accept cached values
+            tag_values, plc_time = cls._read_single_flight(plc_config, tag_list, fresh_plc_time)
+            tag_value_cache.put(plc_config.id, tag_values, plc_time, time.time())
+            return tag_values, plc_time
+
+        cached_values = tag_value_cache.get_fresh(plc_config.id, tag_list, max_age_ms)
+        # Read only the stale remainder from the PLC, in one read
+        stale_tag_list = list(dict.fromkeys(tag_name for tag_name in tag_list if tag_name not in cached_values))
+        shared_logger.log.debug(f'plc_id="{plc_config.id}" {len(tag_list) - len(stale_tag_list)} tag(s) from cache, '
+                                f'{len(stale_tag_list)} tag(s) from the PLC')
+
+        read_values = {}
+        plc_time = None
+        read_time = time.time()
+        if stale_tag_list:
+            tag_values, plc_time = cls._read_single_flight(plc_config, stale_tag_list, fresh_plc_time)
+            if tag_values is None:
+                return None, None
+            read_time = time.time()
+            tag_value_cache.put(plc_config.id, tag_values, plc_time, read_time)
+            # The values come back in the order of stale_tag_list
+            read_values = dict(zip(stale_tag_list, tag_values))
+
+        # Put the values back together in the requested order
+        tag_values = []
+        oldest_cached_value = None
+        for tag_name in tag_list:
+            if tag_name in read_values:
+                tag_value = dict(read_values[tag_name])
+                tag_value['read_time'] = read_time
+            else:
+                cached_value = cached_values[tag_name]
+                tag_value = dict(cached_value.tag_value)
+                tag_value['read_time'] = cached_value.read_time
+                if oldest_cached_value is None or cached_value.read_time < oldest_cached_value.read_time:
+                    oldest_cached_value = cached_value
+            tag_values.append(tag_value)
+
+        # The PLC time returned is the one of the oldest value, so it never overstates how fresh the values are
+        if oldest_cached_value is not None:
+            plc_time = oldest_cached_value.plc_time
+        return tag_values, plc_time
+
+    @classmethod
+    def _read_single_flight(cls, plc_config: model_PlcList.PlcConfig, tag_list, fresh_plc_time=False):
+        """Read a list of tag values from the PLC, sharing one PLC transaction between concurrent identical reads.
+        :param plc_config: a JSON object that has the properties id, ip, port, and plc_slot
+        :param tag_list: a list of tag names to get the values for (already filtered by the allow/disallow lists)
+        :param fresh_plc_time: if True, the PLC clock is read along with the tags
+        :return: A tuple with the list of values of the tags (inside a dictionary each), and the PLC time.
+
+        The first caller for a given PLC + tag list does the read. Anyone asking for the same values while that
+        read is in progress waits for it and gets the same result (or the same error) instead of doing its own.
+        """
+        key = (plc_config.id, plc_config.ip, plc_config.port, plc_config.slot, tuple(tag_list), fresh_plc_time)
+        with cls._in_flight_lock:
+            in_flight = cls._in_flight.get(key)
+            is_leader = in_flight is None
+            if is_leader:
+                in_flight = _InFlightRead()
+                cls._in_flight[key] = in_flight
+
+        if is_leader:
+            try:
+                # Reads for a PLC with a coalesce_window_ms may be merged with other reads (see read_coalescer.py)
+                in_flight.tag_values, in_flight.plc_time = ReadCoalescer.get_tag_values(plc_config, tag_list,
+                                                                                         fresh_plc_time)
+            except Exception as e:
+                in_flight.error = e
+            finally:
+                with cls._in_flight_lock:
+                    del cls._in_flight[key]
+                in_flight.done.set()
+        else:
+            shared_logger.log.debug(f'Joining in-flight read for plc_id="{plc_config.id}" tag_list={tag_list}')
+            in_flight.done.wait()
+
+        if in_flight.error is not None:
+            raise Exception(f'{in_flight.error}') from in_flight.error
+        if in_flight.tag_values is None:
+            return None, in_flight.plc_time
+        # Every caller gets its own copy of the values, since the handlers add to each value's dictionary
+        return [dict(tag_value) for tag_value in in_flight.tag_values], in_flight.plc_time
@@ -0,0 +1,83 @@
+# Python Dependencies
+import falcon
+from falcon_limiter import Limiter
+from falcon_limiter.utils import register
+
+# Import our own dependencies
+import utils
+from middleware_auth import AuthMiddleware
+from read_chunk_tuner import ReadChunkTuner
+import model_PlcList
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+# Define our rate limiter for this request class
+# Set the rate limiting key, which will be the plc_id for the given request
+# Note we do not set a default limit nor dynamic default limit since that will be
+# set at the handler method level based on the config for the PLC.
+limiter = Limiter(
+    key_func=utils.get_limit_key
+)
+
+
+@limiter.limit()
+class GetReadTuningHandler:
+    """
+    Class that handles the /get_read_tuning endpoint
+    Returns the read chunk size learned for a PLC and the history of its adjustments (see read_chunk_tuner.py)
+    """
+    plc_list = None
+
+    def __init__(self, plc_list: model_PlcList):
+        self.plc_list = plc_list
+
+    @register(limiter.limit(dynamic_limits=
+                            lambda req, resp, resource, params:
+                                utils.get_limit_string_for_plc(req, resp, resource, params)))
+    def on_post(self, req, resp):
+        """
+        Handler for /get_read_tuning post endpoint
+        """
+        shared_logger.log.info("GetReadTuningHandler | on_post")
+
+        # If middleware has already set a bad status, return immediately
+        if AuthMiddleware.is_bad_http_status(resp.status):
+            return  # Return response immediately if status is other than in the 200s
+
+        try:
+
+            obj = req.get_media()
+            plc_id = obj.get('plc_id')
+
+            # throw errors if missing required fields
+            if not plc_id:
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='Missing required field: plc_id',
+                )
+
+            # find a match for this plc_id in the plc_list
+            plc_config = utils.get_plc_config_for_plc_id(self.plc_list, plc_id)
+
+            # if plc_config is empty, respond with http 404 and error message
+            if plc_config is None:
+                raise falcon.HTTPNotFound(
+                    title='PLC not found',
+                    description=f"plc_id='{plc_id}' not found in the config! Check your value and try again.",
+                )
+
+            resp.media = {'plc_id': plc_id, **ReadChunkTuner().get_stats(plc_id)}
+            resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            shared_logger.log.error(f'GetReadTuningHandler | on_post | {e}')
+            # if e is type falcon.HTTPError, it means we raised it above, so just re-raise it
+            if isinstance(e, falcon.HTTPError):
+                raise e
+            # otherwise, we have an internal error, so raise a 500
+            raise falcon.HTTPInternalServerError(
+                title='Internal server error',
+                description=f'An internal error occurred. Details: {e}',
+            )
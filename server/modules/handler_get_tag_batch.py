@@ -1,4 +1,5 @@
 # Python Dependencies
+import time
 import falcon
 from falcon_limiter import Limiter
 from falcon_limiter.utils import register
@@ -8,6 +9,11 @@ import utils
 from controller_get_tag_value import *
 import model_PlcList
 import model_BatchList
+from scan_engine import ScanEngine
+from batch_read_plan import BatchReadPlans
+from batch_versions import BatchVersions
+from response_cache import ResponseCache
+from json_media import JsonMedia
 
 # Default logging to DEBUG
 import modules.logger as logger
@@ -51,6 +57,10 @@ class GetTagBatchHandler:
             # get_media and resp.media below are the no-config recommended way to form JSON API's
             obj = req.get_media()
             tag_batch_id = obj.get('tag_batch_id')
+            max_age_ms = obj.get('max_age_ms')
+            fresh_plc_time = obj.get('fresh_plc_time', False)
+            since = obj.get('since')
+            epoch = obj.get('epoch')
 
             # throw errors if missing required fields
             if not tag_batch_id:
@@ -59,6 +69,28 @@ class GetTagBatchHandler:
                     description='Missing required fields: tag_batch_id',
                 )
 
+            # max_age_ms is optional, but must be valid if passed
+            if max_age_ms is not None and not utils.is_non_negative_integer(max_age_ms):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='max_age_ms must be an integer (milliseconds) of 0 or more',
+                )
+
+            # fresh_plc_time is optional, but must be a boolean if passed
+            if not isinstance(fresh_plc_time, bool):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='fresh_plc_time must be true or false',
+                )
+
+            # since is optional, but must be valid (and come with the epoch of the response it's from) if passed
+            if since is not None and (not utils.is_non_negative_integer(since) or not isinstance(epoch, str)):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='since must be an integer (the seq of a previous response) of 0 or more, '
+                                'passed along with the epoch of that response',
+                )
+
             # find a match for this tag_batch_id in the plc_list
             plc_batch_config: model_BatchList.BatchConfig = \
                 utils.get_plc_batch_config_for_batch_id(self.batch_list, tag_batch_id)
@@ -73,7 +105,6 @@ class GetTagBatchHandler:
             # Otherwise, we found the batch plc_list, so we can continue
             # set the plc_id for this batch
             plc_id = plc_batch_config.plc_id
-            tag_list = plc_batch_config.tag_list
 
             # find a match for this batch's PLC in the plc_list
             plc_config = utils.get_plc_config_for_plc_id(self.plc_list, plc_id)
@@ -86,33 +117,60 @@ class GetTagBatchHandler:
                                 f"Check your value and try again.",
                 )
 
-            # Now we treat this as a normal tag list request
-
-            # Go get the tag list values (note the plural "values" in the method name)
-            tag_value_list, tag_value_timestamp = TagValue.get_tag_values(plc_config, tag_list)
+            # The batch resolved ahead of time: filtered tag list, tag types and packet plan (see batch_read_plan.py)
+            plan = BatchReadPlans().get(tag_batch_id)
+            if plan is None:
+                raise Exception(f"No read plan for tag_batch_id='{tag_batch_id}'!")
+
+            # Batches with a scan_rate are answered from the latest background scan (see scan_engine.py), unless a
+            # fresh PLC time was asked for, which needs a read of the PLC now
+            snapshot = None if fresh_plc_time else ScanEngine().get_batch_snapshot(tag_batch_id)
+            if snapshot is not None:
+                if snapshot.tag_values is None:
+                    raise Exception(f"tag_value_list not available for tag_batch_id='{tag_batch_id}'! "
+                                    f"{snapshot.error}")
+                # Copied below, since we add the tag type and the snapshot is shared between requests
+                tag_value_list = snapshot.tag_values
+                tag_value_timestamp = snapshot.plc_time
+                utils.set_age_headers(resp, snapshot.get_age())
+            else:
+                # Go get the batch values
+                tag_value_list, tag_value_timestamp = TagValue.get_batch_values(plan, max_age_ms, fresh_plc_time)
 
             # Did we get a tag value list response?
             if tag_value_list is None:
                 raise Exception(f"tag_value_list not available for tag_batch_id='{tag_batch_id}'!")
 
-            # tag_value_list is a list of dictionaries, so we match type on each item in the list
-            # tag_value will be a REFERENCE to each item in the list, so we can modify each item!
-            for tag_value in tag_value_list:
-                # Join with the tag list to get the tag type
-                tag_type = self.tag_lists.get_tag_type(plc_config, tag_value['tag_name'])
-                # Set the tag type on the tag value
-                tag_value['tag_type'] = tag_type
-
-            # Respond with the tag value list. Note the tag_value_list is coerced to the proper type in the
-            # get_tag_value method (so it could be ANY valid python type).
-            resp.media = {
-                'tag_values': tag_value_list,
-                'plc_time': tag_value_timestamp.timestamp()  # convert to unix timestamp
-            }
+            # Values that may have come from the tag value cache carry their read_time, so report the oldest age
+            if snapshot is None and max_age_ms is not None and tag_value_list:
+                utils.set_age_headers(resp, time.time() - min(tag_value['read_time'] for tag_value in tag_value_list))
+
+            # Version the values read for the batch, and with since, keep only the tags that changed from that response
+            batch_versions = BatchVersions()
+            # (an empty list if nothing changed)
+            seq, tag_value_list = batch_versions.update(tag_batch_id, tag_value_list,
+                                                        since if epoch == batch_versions.epoch else None)
+
+            # A whole scanned batch is the same for every client until the next scan, so it's serialized (and
+            # compressed) once per scan and then answered from the response cache
+            response_cache = ResponseCache()
+            cached = None
+            if snapshot is not None and tag_value_list is snapshot.tag_values and response_cache.is_enabled():
+                cached = response_cache.get_body(
+                    ('tag_batch', tag_batch_id), (batch_versions.epoch, seq, snapshot.read_time),
+                    req.get_header('Accept-Encoding'),
+                    lambda: JsonMedia.dumps(self._get_media(plan, plc_config, tag_value_list, tag_value_timestamp,
+                                                            seq, True)))
+            if cached is not None:
+                utils.set_encoded_body(resp, *cached)
+            else:
+                # Not cached, or too large for the response cache
+                resp.media = self._get_media(plan, plc_config, tag_value_list, tag_value_timestamp, seq,
+                                             snapshot is not None)
             resp.status = falcon.HTTP_200
 
         except Exception as e:
-            shared_logger.log.error(f'GetTagValueHandler | on_post | {e}')
+            shared_logger.log.error(f'GetTagBatchHandler | on_post | {e}')
             # if e is type falcon.HTTPError, it means we raised it above, so just re-raise it
             if isinstance(e, falcon.HTTPError):
                 raise e
@@ -121,3 +179,28 @@ class GetTagBatchHandler:
                 title='Internal server error',
                 description=f'An internal error occurred. Details: {e}',
             )
+
+    def _get_media(self, plan, plc_config, tag_value_list, tag_value_timestamp, seq, copy):
+        """Return the response of a batch read (copy the tag values first if they're shared, i.e. from a scan)"""
+        if copy:
+            tag_value_list = [dict(tag_value) for tag_value in tag_value_list]
+
+        # tag_value_list is a list of dictionaries, so we match type on each item in the list
+        # tag_value will be a REFERENCE to each item in the list, so we can modify each item!
+        # Join with the tag list to get the tag types (resolved once in the plan, if the PLC tag list is loaded)
+        tag_types = plan.tag_types
+        if tag_types is None:
+            tag_types = self.tag_lists.get_tag_types(plc_config, [tag_value['tag_name']
+                                                                  for tag_value in tag_value_list])
+        for tag_value in tag_value_list:
+            # Set the tag type on the tag value
+            tag_value['tag_type'] = tag_types.get(tag_value['tag_name'], "")
+
+        # Note the tag_value_list is coerced to the proper type in the get_tag_value method (so it could be ANY
+        # valid python type).
+        return {
+            'tag_values': tag_value_list,
+            'plc_time': tag_value_timestamp.timestamp(),  # convert to unix timestamp
+            'seq': seq,
+            'epoch': BatchVersions().epoch
+        }
@@ -1,4 +1,7 @@
 # Python Dependencies
+import base64
+import binascii
+import re
 import falcon
 from falcon_limiter import Limiter
 from falcon_limiter.utils import register
@@ -7,6 +10,8 @@ from falcon_limiter.utils import register
 import utils
 from middleware_auth import AuthMiddleware
 import model_PlcList
+from response_cache import ResponseCache
+from json_media import JsonMedia
 
 # Default logging to DEBUG
 import modules.logger as logger
@@ -20,6 +25,45 @@ limiter = Limiter(
     key_func=utils.get_limit_key
 )
 
+# The optional query fields of a /get_tag_list request. Without any of them, the whole tag list is returned.
+_QUERY_FIELDS = ('prefix', 'regex', 'glob', 'tag_type', 'scope', 'fields', 'limit', 'cursor')
+
+# The fields a query can project each tag to
+_TAG_FIELDS = ('type', 'scope')
+
+# Whole tag lists of at least this many tags are streamed (see _stream_tag_list), smaller ones are sent in one piece
+_STREAM_MIN_TAGS = 1000
+
+# The number of tags serialized into each chunk of a streamed tag list
+_STREAM_CHUNK_TAGS = 1000
+
+
+def _stream_tag_list(plc_id, tag_list, plc_time):
+    """
+    Generate the JSON of a whole tag list response, a chunk of tags at a time, straight from the tag list cache.
+
+    The response is the same JSON resp.media would send, but neither a dictionary of the tag list nor the whole
+    document is ever made: only one chunk is in memory at a time, and the first bytes go out before the last tags
+    are serialized.
+    :param plc_id: the plc_id of the response
+    :param tag_list: a CompactTagList or a BinaryTagList
+    :param plc_time: the tag list timestamp
+    :return: a generator of UTF-8 encoded chunks
+    """
+    # Each part is serialized as a JSON object, without the braces that don't belong to it
+    yield JsonMedia.dumps({'plc_id': plc_id})[:-1] + b',"tag_list":{'
+    separator = b''
+    chunk = {}
+    for tag_name, tag_type in tag_list.type_items():
+        chunk[tag_name] = {'type': tag_type}
+        if len(chunk) >= _STREAM_CHUNK_TAGS:
+            yield separator + JsonMedia.dumps(chunk)[1:-1]
+            separator = b','
+            chunk = {}
+    if chunk:
+        yield separator + JsonMedia.dumps(chunk)[1:-1]
+    yield b'},' + JsonMedia.dumps({'plc_time': plc_time})[1:]
+
 
 @limiter.limit()
 class GetTagListHandler:
@@ -35,6 +79,46 @@ class GetTagListHandler:
         self.plc_list = plc_list
         self.tag_lists = tag_lists
 
+    @register(limiter.limit(dynamic_limits=
+                            lambda req, resp, resource, params:
+                                utils.get_limit_string_for_plc(req, resp, resource, params)))
+    def on_get(self, req, resp):
+        """
+        Handler for /get_tag_list get endpoint (/get_tag_list?plc_id=some-plc-id), for the whole tag list only.
+        Unlike POST, GET responses can be revalidated by HTTP caches and browsers with If-None-Match.
+        """
+        shared_logger.log.info("GetTagListHandler | on_get")
+
+        # If middleware has already set a bad status, return immediately
+        if AuthMiddleware.is_bad_http_status(resp.status):
+            return  # Return response immediately if status is other than in the 200s
+
+        self._respond_to_get(req, resp)
+
+    @register(limiter.limit(dynamic_limits=
+                            lambda req, resp, resource, params:
+                                utils.get_limit_string_for_plc(req, resp, resource, params)))
+    def on_head(self, req, resp):
+        """
+        Handler for /get_tag_list head endpoint: the GET response without its body (Falcon drops it), i.e. for
+        HTTP caches to revalidate the tag list with If-None-Match.
+        """
+        shared_logger.log.info("GetTagListHandler | on_head")
+
+        # If middleware has already set a bad status, return immediately
+        if AuthMiddleware.is_bad_http_status(resp.status):
+            return  # Return response immediately if status is other than in the 200s
+
+        self._respond_to_get(req, resp)
+
+    def _respond_to_get(self, req, resp):
+        """Respond to a GET (or HEAD) request, with the fields from the query string"""
+        # Queries have fields that aren't strings, so they're only in POST bodies
+        if any(field in req.params for field in _QUERY_FIELDS):
+            raise falcon.HTTPBadRequest(title='Malformed request',
+                                        description=f'Query fields ({", ".join(_QUERY_FIELDS)}) need a POST')
+        self._respond(req, resp, {'plc_id': req.get_param('plc_id')})
+
     @register(limiter.limit(dynamic_limits=
                             lambda req, resp, resource, params:
                                 utils.get_limit_string_for_plc(req, resp, resource, params)))
@@ -48,10 +132,13 @@ class GetTagListHandler:
         if AuthMiddleware.is_bad_http_status(resp.status):
             return  # Return response immediately if status is other than in the 200s
 
+        # get_media and resp.media below are the no-plc_list recommended way to form JSON API's
+        self._respond(req, resp, req.get_media())
+
+    def _respond(self, req, resp, obj):
+        """Respond to a /get_tag_list request with the fields obj (from the body or the query string)"""
         try:
 
-            # get_media and resp.media below are the no-plc_list recommended way to form JSON API's
-            obj = req.get_media()
             plc_id = obj.get('plc_id')
 
             # throw errors if missing required fields
@@ -71,19 +158,52 @@ class GetTagListHandler:
                     description=f"plc_id='{plc_id}' not found in the config! Check your value and try again.",
                 )
 
+            # A query (search, filter, pagination) is answered from the index of the tag list
+            if any(field in obj for field in _QUERY_FIELDS):
+                self._respond_to_query(resp, plc_config, obj)
+                return
+
             # Otherwise, we have a plc_list, so go get the tag list for it
-            tag_list, tag_list_timestamp = self.tag_lists.get_tag_list(plc_config, )
+            tag_list, tag_list_timestamp, etag = self.tag_lists.get_tag_list_with_etag(plc_config)
 
             # Did we get a tag list?
             if tag_list is None:
                 raise Exception(f"tag_list not available for plc_id='{plc_id}'!")
 
-            # Otherwise, respond with the tag list
-            resp.media = {'plc_id': plc_id, 'tag_list': tag_list, 'plc_time': tag_list_timestamp}
+            # The ETag identifies the content of the tag list (not plc_time, so it's a weak ETag). A GET from a
+            # client that already has this tag list gets a 304 Not Modified, and nothing is serialized. 304 is only
+            # for GET and HEAD (RFC 9110), so If-None-Match is ignored on POST.
+            if etag is not None:
+                resp.set_header('ETag', etag)
+                if req.method in ('GET', 'HEAD') and req.if_none_match and \
+                        any(tag == '*' or f'W/"{tag}"' == etag for tag in req.if_none_match):
+                    resp.status = falcon.HTTP_NOT_MODIFIED
+                    return
+
+            # Otherwise, respond with the tag list. It's serialized (and compressed) once per version of the tag list
+            # and then answered from the response cache.
+            response_cache = ResponseCache()
+            cached = None
+            if etag is not None and response_cache.is_enabled():
+                cached = response_cache.get_body(
+                    ('tag_list', plc_config.id), (etag, tag_list_timestamp), req.get_header('Accept-Encoding'),
+                    lambda: b''.join(_stream_tag_list(plc_id, tag_list, tag_list_timestamp)))
+            if cached is not None:
+                utils.set_encoded_body(resp, *cached)
+            # Without the response cache (or if the tag list is too large for it), large ones are streamed from the
+            # tag list cache (kept compact in memory, or mapped from its file for the binary cache format) rather
+            # than built into one document.
+            elif not isinstance(tag_list, dict) and len(tag_list) >= _STREAM_MIN_TAGS:
+                resp.content_type = falcon.MEDIA_JSON
+                resp.stream = _stream_tag_list(plc_id, tag_list, tag_list_timestamp)
+            else:
+                if not isinstance(tag_list, dict):
+                    tag_list = tag_list.to_dict()
+                resp.media = {'plc_id': plc_id, 'tag_list': tag_list, 'plc_time': tag_list_timestamp}
             resp.status = falcon.HTTP_200
 
         except Exception as e:
-            shared_logger.log.error(f'GetTagListHandler | on_post | {e}')
+            shared_logger.log.error(f'GetTagListHandler | on_{req.method.lower()} | {e}')
             # if e is type falcon.HTTPError, it means we raised it above, so just re-raise it
             if isinstance(e, falcon.HTTPError):
                 raise e
@@ -92,3 +212,62 @@ class GetTagListHandler:
                 title='Internal server error',
                 description=f'An internal error occurred. Details: {e}',
             )
+
+    def _respond_to_query(self, resp, plc_config, obj):
+        """Respond with the tags of the tag list that match the query fields of the request body"""
+        prefix = obj.get('prefix')
+        regex = obj.get('regex')
+        glob = obj.get('glob')
+        tag_types = obj.get('tag_type')
+        scope = obj.get('scope')
+        fields = obj.get('fields', ['type'])
+        limit = obj.get('limit')
+        cursor = obj.get('cursor')
+
+        # throw errors if the query fields are not valid
+        for name, value in (('prefix', prefix), ('regex', regex), ('glob', glob), ('scope', scope),
+                            ('cursor', cursor)):
+            if value is not None and not isinstance(value, str):
+                raise falcon.HTTPBadRequest(title='Malformed body', description=f'{name} must be a string')
+        if isinstance(tag_types, str):
+            tag_types = [tag_types]
+        if tag_types is not None and not utils.is_list_of_strings(tag_types):
+            raise falcon.HTTPBadRequest(title='Malformed body',
+                                        description='tag_type must be a string or an array of strings')
+        if not isinstance(fields, list) or any(field not in _TAG_FIELDS for field in fields):
+            raise falcon.HTTPBadRequest(title='Malformed body',
+                                        description=f'fields must be an array of: {", ".join(_TAG_FIELDS)}')
+        if limit is not None and (not utils.is_non_negative_integer(limit) or limit == 0):
+            raise falcon.HTTPBadRequest(title='Malformed body', description='limit must be an integer of 1 or more')
+        if regex is not None:
+            try:
+                regex = re.compile(regex)
+            except re.error as e:
+                raise falcon.HTTPBadRequest(title='Malformed body', description=f'regex is not valid: {e}')
+        after = None
+        if cursor is not None:
+            try:
+                after = base64.b64decode(cursor.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+            except (ValueError, binascii.Error):
+                raise falcon.HTTPBadRequest(title='Malformed body', description='cursor is not valid')
+
+        index, tag_list_timestamp = self.tag_lists.get_tag_list_index(plc_config)
+        matches, has_more = index.search(prefix, regex, glob, tag_types, scope, after, limit)
+
+        tag_list = {}
+        for tag_name, tag_type in matches:
+            tag_info = {}
+            if 'type' in fields:
+                tag_info['type'] = tag_type
+            if 'scope' in fields:
+                tag_info['scope'] = tag_name.split('.', 1)[0] if tag_name.startswith('Program:') else 'controller'
+            tag_list[tag_name] = tag_info
+
+        # The cursor of the next page is the last tag name of this one
+        next_cursor = None
+        if has_more and matches:
+            next_cursor = base64.urlsafe_b64encode(matches[-1][0].encode('utf-8')).decode('ascii')
+
+        resp.media = {'plc_id': plc_config.id, 'tag_list': tag_list, 'plc_time': tag_list_timestamp,
+                      'next_cursor': next_cursor}
+        resp.status = falcon.HTTP_200
@@ -1,4 +1,5 @@
 # Python Dependencies
+import time
 import falcon
 from falcon_limiter import Limiter
 from falcon_limiter.utils import register
@@ -6,6 +7,7 @@ from falcon_limiter.utils import register
 # Import our own dependencies
 import utils
 from controller_get_tag_value import *
+from scan_engine import ScanEngine
 
 # Default logging to DEBUG
 import modules.logger as logger
@@ -58,6 +60,9 @@ class GetTagValueHandler:
             plc_id = obj.get('plc_id')
             tag_name = obj.get('tag_name')
             tag_list = obj.get('tag_list')
+            scan_rate = obj.get('scan_rate')
+            max_age_ms = obj.get('max_age_ms')
+            fresh_plc_time = obj.get('fresh_plc_time', False)
 
             # throw errors if missing required fields
             if not plc_id and not (tag_name or tag_list):
@@ -66,6 +71,27 @@ class GetTagValueHandler:
                     description='Missing required fields: plc_id and one of tag_name or tag_list',
                 )
 
+            # max_age_ms is optional, but must be valid if passed
+            if max_age_ms is not None and not utils.is_non_negative_integer(max_age_ms):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='max_age_ms must be an integer (milliseconds) of 0 or more',
+                )
+
+            # fresh_plc_time is optional, but must be a boolean if passed
+            if not isinstance(fresh_plc_time, bool):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='fresh_plc_time must be true or false',
+                )
+
+            # scan_rate is optional, but must be valid if passed (0 is the same as no scan_rate)
+            if scan_rate is not None and not utils.is_non_negative_integer(scan_rate):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='scan_rate must be an integer (milliseconds) of 0 or more',
+                )
+
             # find a match for this plc_id in the plc_list
             plc_config = utils.get_plc_config_for_plc_id(self.plc_list, plc_id)
 
@@ -76,26 +102,53 @@ class GetTagValueHandler:
                     description=f"plc_id='{plc_id}' not found in the plc_list! Check your value and try again.",
                 )
 
+            # If we received a scan_rate, the tags are scanned in the background and we answer from memory (unless a
+            # fresh PLC time was asked for, which needs a read of the PLC now)
+            snapshot = None
+            if scan_rate and not fresh_plc_time:
+                scan_tag_list = [tag_name] if tag_name else tag_list
+                if not utils.is_list_of_strings(scan_tag_list):
+                    raise falcon.HTTPBadRequest(
+                        title='Malformed body',
+                        description='With scan_rate, tag_list must be an array of strings',
+                    )
+                snapshot = ScanEngine().get_tag_snapshot(plc_config, scan_tag_list, scan_rate)
+
+            if snapshot is not None:
+                if snapshot.tag_values is None:
+                    raise Exception(f"tag_value_list not available for plc_id='{plc_id}'! {snapshot.error}")
+                # Copies of the values, in the order of the request, since we add the tag type below
+                tag_value_list = snapshot.get_tag_values(scan_tag_list)
+                tag_value_timestamp = snapshot.plc_time
+                utils.set_age_headers(resp, snapshot.get_age())
+
             # If we received tag_name, that is what we respond for
-            if tag_name:
+            elif tag_name:
                 # Go get the tag value (note the singular "value" in the method name)
-                tag_value_list, tag_value_timestamp = TagValue.get_tag_value(plc_config, tag_name)
+                tag_value_list, tag_value_timestamp = TagValue.get_tag_value(plc_config, tag_name, max_age_ms,
+                                                                                 fresh_plc_time)
 
             else:
                 # Go get the tag list values (note the plural "values" in the method name)
-                tag_value_list, tag_value_timestamp = TagValue.get_tag_values(plc_config, tag_list)
+                tag_value_list, tag_value_timestamp = TagValue.get_tag_values(plc_config, tag_list, max_age_ms,
+                                                                                  fresh_plc_time)
 
             # Did we get a tag value list response?
             if tag_value_list is None:
                 raise Exception(f"tag_value_list not available for plc_id='{plc_id}'!")
 
+            # Values that may have come from the tag value cache carry their read_time, so report the oldest age
+            if snapshot is None and max_age_ms is not None and tag_value_list:
+                utils.set_age_headers(resp, time.time() - min(tag_value['read_time'] for tag_value in tag_value_list))
+
             # tag_value_list is a list of dictionaries, so we match type on each item in the list
             # tag_value will be a REFERENCE to each item in the list, so we can modify each item!
+            # Join with the tag list to get the tag types, all at once
+            tag_types = self.tag_lists.get_tag_types(plc_config,
+                                                     [tag_value['tag_name'] for tag_value in tag_value_list])
             for tag_value in tag_value_list:
-                # Join with the tag list to get the tag type
-                tag_type = self.tag_lists.get_tag_type(plc_config, tag_value['tag_name'])
                 # Set the tag type on the tag value
-                tag_value['tag_type'] = tag_type
+                tag_value['tag_type'] = tag_types[tag_value['tag_name']]
 
             # Respond with the tag value list. Note the tag_value_list is coerced to the proper type in the
             # get_tag_value method (so it could be ANY valid python type).
@@ -0,0 +1,152 @@
+# Python Dependencies
+import falcon
+from falcon_limiter import Limiter
+from falcon_limiter.utils import register
+
+# Import our own dependencies
+import utils
+import model_PlcList
+import model_BatchList
+from scan_engine import ScanEngine
+from subscriptions import Subscriptions
+
+# Default logging to DEBUG
+import modules.logger as logger
+from middleware_auth import AuthMiddleware
+shared_logger = logger.CustomLogger()
+
+# Define our rate limiter for this request class
+# Set the rate limiting key, which will be the plc_id or the tag_batch_id for the given request
+# Note we do not set a default limit nor dynamic default limit since that will be
+# set at the handler method level based on the config for the PLC or the batch.
+limiter = Limiter(
+    key_func=utils.get_limit_key
+)
+
+# The sampling interval of a subscription when the request doesn't pass one
+_DEFAULT_INTERVAL_MS = 1000
+
+
+@limiter.limit()
+class SubscribeHandler:
+    """
+    Class that handles the /subscribe endpoint
+    Responds with a stream of Server-Sent Events with the changes of value of a batch or of a list of tags
+    (see subscriptions.py)
+    """
+    plc_list = None
+    tag_lists = None
+    batch_list = None
+
+    def __init__(self, plc_list: model_PlcList, tag_lists, batch_list: model_BatchList):
+        self.plc_list = plc_list
+        self.tag_lists = tag_lists
+        self.batch_list = batch_list
+
+    @register(limiter.limit(dynamic_limits=
+                            lambda req, resp, resource, params:
+                                utils.get_limit_string_for_subscription(req, resp, resource, params)))
+    def on_post(self, req, resp):
+        """Handler for /subscribe post endpoint"""
+        shared_logger.log.info("SubscribeHandler | on_post")
+
+        # If middleware has already set a bad status, return immediately
+        if AuthMiddleware.is_bad_http_status(resp.status):
+            return  # Return response immediately if status is other than in the 200s
+
+        try:
+
+            obj = req.get_media()
+            tag_batch_id = obj.get('tag_batch_id')
+            plc_id = obj.get('plc_id')
+            tag_name = obj.get('tag_name')
+            tag_list = [tag_name] if tag_name else obj.get('tag_list')
+            interval_ms = obj.get('interval_ms', _DEFAULT_INTERVAL_MS)
+            deadband = obj.get('deadband')
+
+            # throw errors if missing required fields
+            if not tag_batch_id and not (plc_id and tag_list):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='Missing required fields: tag_batch_id, or plc_id and one of tag_name or tag_list',
+                )
+
+            if not utils.is_non_negative_integer(interval_ms) or interval_ms == 0:
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description=f'interval_ms must be an integer (milliseconds) of 1 or more '
+                                f'(values under {ScanEngine.min_scan_rate} are read every {ScanEngine.min_scan_rate})',
+                )
+
+            if deadband is not None and (not isinstance(deadband, (int, float)) or isinstance(deadband, bool)
+                                         or not deadband >= 0):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='deadband must be a number of 0 or more',
+                )
+
+            # A batch with a scan_rate is followed at its scan rate. Any other batch, like a list of tags, is
+            # scanned at the interval of the subscription.
+            batch_id = None
+            if tag_batch_id:
+                plc_batch_config: model_BatchList.BatchConfig = \
+                    utils.get_plc_batch_config_for_batch_id(self.batch_list, tag_batch_id)
+                if plc_batch_config is None:
+                    raise falcon.HTTPNotFound(
+                        title='tag_batch_id not found',
+                        description=f"tag_batch_id='{tag_batch_id}' "
+                                    f"not found in the config! Check your value and try again.",
+                    )
+                plc_id = plc_batch_config.plc_id
+                tag_list = plc_batch_config.tag_list
+                if ScanEngine().is_batch_scanned(tag_batch_id):
+                    batch_id = tag_batch_id
+            elif not utils.is_list_of_strings(tag_list):
+                raise falcon.HTTPBadRequest(
+                    title='Malformed body',
+                    description='tag_name must be a string or tag_list an array of strings',
+                )
+
+            # find a match for this plc_id in the plc_list
+            plc_config = utils.get_plc_config_for_plc_id(self.plc_list, plc_id)
+
+            # if plc_config is empty, respond with http 404 and error message
+            if plc_config is None:
+                raise falcon.HTTPNotFound(
+                    title='PLC not found',
+                    description=f"plc_id='{plc_id}' not found in the config! Check your value and try again.",
+                )
+
+            subscription = Subscriptions().open(plc_config, tag_list, self.tag_lists, interval_ms, deadband,
+                                                batch_id)
+            if subscription is None:
+                if Subscriptions().max_subscriptions == 0:
+                    raise falcon.HTTPServiceUnavailable(
+                        title='Subscriptions disabled',
+                        description='Subscriptions need --server-mode production (the development server handles '
+                                    'one request at a time) and --max-subscriptions of 1 or more.',
+                    )
+                raise falcon.HTTPServiceUnavailable(
+                    title='Too many subscriptions',
+                    description=f'The maximum of {Subscriptions().max_subscriptions} subscription(s) are open. '
+                                f'Try again later.',
+                )
+
+            # Stream the events for as long as the client stays connected. X-Accel-Buffering tells nginx to pass
+            # each event on as soon as it's sent.
+            resp.content_type = 'text/event-stream'
+            resp.set_header('Cache-Control', 'no-cache')
+            resp.set_header('X-Accel-Buffering', 'no')
+            resp.stream = subscription
+            resp.status = falcon.HTTP_200
+
+        except Exception as e:
+            shared_logger.log.error(f'SubscribeHandler | on_post | {e}')
+            # if e is type falcon.HTTPError, it means we raised it above, so just re-raise it
+            if isinstance(e, falcon.HTTPError):
+                raise e
+            # otherwise, we have an internal error, so raise a 500
+            raise falcon.HTTPInternalServerError(
+                title='Internal server error',
+                description=f'An internal error occurred. Details: {e}',
+            )
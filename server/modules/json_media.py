@@ -0,0 +1,101 @@
+# Python dependencies
+import json
+import math
+from falcon.media import JSONHandler
+
+# orjson is optional: without it, the standard library json module is used
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    """Serialize the values JSON has no type for. pylogix returns raw data as bytes, which become a list of bytes."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return list(bytes(value))
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _replace_non_finite(value):
+    """Replace the NaN and infinite floats (which JSON has no literal for) with None, in lists and dictionaries"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_non_finite(item) for item in value]
+    return value
+
+
+def _stdlib_dumps(value):
+    try:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), allow_nan=False,
+                          default=_default).encode('utf-8')
+    except ValueError:
+        # A NaN or an infinite float somewhere. Only then is everything walked, to write them as null like orjson.
+        return json.dumps(_replace_non_finite(value), ensure_ascii=False, separators=(',', ':'), allow_nan=False,
+                          default=_default).encode('utf-8')
+
+
+def _orjson_dumps(value):
+    # orjson writes NaN and infinite floats as null on its own, and like json, non-str keys as strings with the option
+    return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class JsonMedia:
+    """
+    The JSON serializer of request and response media, and of the responses handlers serialize themselves (streamed
+    tag lists, the response cache, subscription events), so all of them match.
+
+    Two backends write the same JSON: orjson (much faster on large responses, used when it's installed) and the
+    standard library json module. Both write compact UTF-8, NaN and infinite floats as null (JSON has no literal
+    for them) and bytes as a list of byte values. Only the exponent of very large or small floats is written
+    differently (1e16 or 1e+16), which is the same number.
+    """
+
+    # Default backend. This can be changed with configure() (see the server.py command line arguments.)
+    backend = "orjson" if orjson is not None else "stdlib"
+    _dumps = staticmethod(_orjson_dumps if orjson is not None else _stdlib_dumps)
+    _loads = staticmethod(orjson.loads if orjson is not None else json.loads)
+
+    @classmethod
+    def configure(cls, backend=None):
+        """
+        Choose the JSON backend.
+        :param backend: "auto" (orjson if it's installed, else stdlib), "orjson" or "stdlib"
+        """
+        if backend is None or backend == "auto":
+            backend = "orjson" if orjson is not None else "stdlib"
+        if backend == "orjson":
+            if orjson is None:
+                raise Exception('The orjson JSON backend needs the orjson package (pip install orjson)')
+            cls._dumps, cls._loads = staticmethod(_orjson_dumps), staticmethod(orjson.loads)
+        elif backend == "stdlib":
+            cls._dumps, cls._loads = staticmethod(_stdlib_dumps), staticmethod(json.loads)
+        else:
+            raise Exception(f'Unknown JSON backend "{backend}"')
+        cls.backend = backend
+
+    @classmethod
+    def dumps(cls, value):
+        """
+        Serialize a value to JSON.
+        :param value: the value
+        :return: the JSON, UTF-8 encoded (bytes)
+        """
+        return cls._dumps(value)
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Parse JSON.
+        :param data: the JSON (str or bytes)
+        :return: the value
+        """
+        return cls._loads(data)
+
+    @classmethod
+    def media_handler(cls):
+        """Return a falcon media handler that uses the backend (to set for falcon.MEDIA_JSON on the app)"""
+        return JSONHandler(dumps=cls._dumps, loads=cls._loads)
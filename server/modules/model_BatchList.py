@@ -12,12 +12,14 @@ class BatchConfig:
       "plc_id": "some-plc-id",      // Some plc_id matching from the plc_list
       "tag_list": ["TAG3"],         // List of tags to read for this batch
       "rate_limit": "1/second",     // Rate limit for this PLC - empty for no rate limit
+      "scan_rate": 1000             // Scan in the background every N milliseconds - empty or 0 to read on request
     }
     """
     id: str
     plc_id: str
     tag_list: List[str]
     rate_limit: Optional[str] = ""
+    scan_rate: Optional[int] = 0
 
     def __getitem__(self, key):
         return getattr(self, key)
@@ -27,10 +29,17 @@ class BatchList:
     """
     A class to represent a list of Batches
     Supports a singleton pattern so that only one instance is created!
+
+    The batches are also indexed by id, so get(batch_id) is a dictionary lookup.
     """
 
     _instance = None  # Class-level variable to store the singleton instance
 
+    batch_configs = []
+    batch_configs_by_id = {}
+    # Incremented each time the batches are (re)loaded, so anything derived from them knows to rebuild
+    generation = 0
+
     def __new__(cls, *args, **kwargs):
         """
         Override the __new__ method to implement the singleton pattern
@@ -60,6 +69,19 @@ class BatchList:
         for batch in batch_config_json:
             batch_config = BatchConfig(**batch)
             self.batch_configs.append(batch_config)
+        # If an id is repeated, the first one wins (same as the linear search this replaces)
+        self.batch_configs_by_id = {}
+        for batch_config in self.batch_configs:
+            self.batch_configs_by_id.setdefault(batch_config.id, batch_config)
+        self.generation += 1
+
+    def get(self, batch_id):
+        """Return the batch config for the given batch_id, or None if not found"""
+        try:
+            return self.batch_configs_by_id.get(batch_id)
+        except TypeError:
+            # Not a valid id (for instance, a list passed in a request body)
+            return None
 
     def __iter__(self):
         return iter(self.batch_configs)
@@ -1,6 +1,9 @@
 import json
 from dataclasses import dataclass
-from typing import List, Optional
+from functools import cached_property
+from typing import List, Optional, Union
+
+from tag_access_policy import TagAccessPolicy
 
 
 @dataclass
@@ -17,6 +20,9 @@ class PlcConfig:
       "allow_tags_regex": ".*",       // Explicit tag name regex to allow
       "exclude_tags_regex": ""        // Explicit tag name regex to exclude
       "rate_limit": "1/second"        // Rate limit for this PLC - empty for no rate limit
+      "coalesce_window_ms": 5         // Merge reads arriving within N ms into one Read - empty or 0 to disable
+      "connection_size": "auto"       // CIP connection size in bytes (504 = Small, up to 4002 = Large Forward
+                                      // Open) or "auto" to try Large first and fall back to Small
     }
     """
     id: str
@@ -28,19 +34,33 @@ class PlcConfig:
     allow_tags_regex: str
     exclude_tags_regex: str
     rate_limit: Optional[str] = ""
+    coalesce_window_ms: Optional[int] = 0
+    connection_size: Optional[Union[int, str]] = "auto"
 
     def __getitem__(self, key):
         return getattr(self, key)
 
+    @cached_property
+    def access_policy(self) -> TagAccessPolicy:
+        """The allow/exclude tag rules of this PLC, compiled on first use"""
+        return TagAccessPolicy.from_plc_config(self)
+
 
 class PlcList:
     """
     A class to represent a list of PLC configurations
     Supports a singleton pattern so that only one instance is created!
+
+    The configs are also indexed by id, so get(plc_id) is a dictionary lookup.
     """
 
     _instance = None  # Class-level variable to store the singleton instance
 
+    plc_configs = []
+    plc_configs_by_id = {}
+    # Incremented each time the configs are (re)loaded, so anything derived from them knows to rebuild
+    generation = 0
+
     def __new__(cls, *args, **kwargs):
         """
         Override the __new__ method to implement the singleton pattern
@@ -70,6 +90,19 @@ class PlcList:
         for plc in plc_config_json:
             plc_config = PlcConfig(**plc)
             self.plc_configs.append(plc_config)
+        # If an id is repeated, the first one wins (same as the linear search this replaces)
+        self.plc_configs_by_id = {}
+        for plc_config in self.plc_configs:
+            self.plc_configs_by_id.setdefault(plc_config.id, plc_config)
+        self.generation += 1
+
+    def get(self, plc_id):
+        """Return the PLC config for the given plc_id, or None if not found"""
+        try:
+            return self.plc_configs_by_id.get(plc_id)
+        except TypeError:
+            # Not a valid id (for instance, a list passed in a request body)
+            return None
 
     def __iter__(self):
         return iter(self.plc_configs)
@@ -0,0 +1,87 @@
+# Python dependencies
+import threading
+import time
+from datetime import timedelta
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+class _PlcClockSync:
+    """A helper class to store the last clock sync of one PLC"""
+
+    def __init__(self, plc_time, synced_monotonic):
+        self.plc_time = plc_time
+        self.synced_monotonic = synced_monotonic
+
+
+class PlcClock:
+    """
+    Tracks the clock of each PLC, so reads don't need a GetPLCTime round trip each time.
+    Supports a singleton pattern so that only one instance is created!
+
+    Each sync stores the PLC time together with the local monotonic clock at the moment it was read (the
+    middle of the GetPLCTime round trip). In between syncs, the PLC time is derived as the synced PLC time plus
+    the monotonic time elapsed since. A PLC is synced again once its last sync is older than resync_interval.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    # Default resync interval in seconds. This can be changed with configure() (see the server.py command line
+    # arguments.) 0 syncs on every read, like before.
+    resync_interval = 60
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(PlcClock, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._syncs = {}
+        return cls._instance
+
+    def configure(self, resync_interval=None):
+        """
+        Change the clock settings.
+        :param resync_interval: the number of seconds after which the PLC clock is read again
+        """
+        if resync_interval is not None:
+            self.resync_interval = max(0, int(resync_interval))
+
+    def needs_sync(self, plc_id):
+        """Return True if the clock of the PLC was never synced, or its last sync is older than resync_interval"""
+        with self._lock:
+            sync = self._syncs.get(plc_id)
+        return sync is None or time.monotonic() - sync.synced_monotonic >= self.resync_interval
+
+    def sync(self, plc_id, plc_time, sent_monotonic, received_monotonic):
+        """
+        Record a PLC time just read from the PLC.
+        :param plc_id: The ID of the PLC
+        :param plc_time: the PLC time (datetime) returned by GetPLCTime, or None if it couldn't be read
+        :param sent_monotonic: the local monotonic clock when the GetPLCTime request was sent
+        :param received_monotonic: the local monotonic clock when its reply was received
+        """
+        if plc_time is None:
+            return
+        with self._lock:
+            # The PLC read its clock somewhere during the round trip, so the middle is our best guess
+            self._syncs[plc_id] = _PlcClockSync(plc_time, (sent_monotonic + received_monotonic) / 2)
+
+    def get_plc_time(self, plc_id):
+        """
+        Get the current PLC time, derived from the last sync.
+        :param plc_id: The ID of the PLC
+        :return: the PLC time (datetime), or None if the clock of the PLC was never synced
+        """
+        with self._lock:
+            sync = self._syncs.get(plc_id)
+        if sync is None:
+            return None
+        return sync.plc_time + timedelta(seconds=time.monotonic() - sync.synced_monotonic)
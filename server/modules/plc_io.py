@@ -1,20 +1,34 @@
 # Python dependencies
-from pylogix import PLC
+import time
+from struct import pack
 
 # Project dependencies
 import utils
+from plc_session_pool import PlcSessionPool
+from read_planner import ReadPlanner
+from read_chunk_tuner import ReadChunkTuner
+from plc_clock import PlcClock
 
 # Default logging to DEBUG
 import modules.logger as logger
 shared_logger = logger.CustomLogger()
 
+# Logix controllers count changes to their tags and data types in attributes 1, 2, 3, 4 and 10 of instance 1 of
+# class 0xAC. If none of them changed, neither did the tag list.
+_CHANGE_DETECTION_CLASS = 0xAC
+_CHANGE_DETECTION_ATTRIBUTES = (0x01, 0x02, 0x03, 0x04, 0x0A)
 
-def get_tag_list(plc_id, ip, slot_no=0, port=44818):
+
+def get_tag_list(plc_id, ip, slot_no=0, port=44818, connection_size=None, tag_list_info=None):
     """Gets a tag_list from a PLC.
     :param plc_id: The ID of the PLC
     :param slot_no: The slot number of the PLC
     :param ip: The IP address of the PLC
     :param port: The port number of the PLC
+    :param connection_size: The CIP connection size of the PLC (bytes), or None/"auto" to negotiate it
+    :param tag_list_info: optional, a dictionary to fill with more about the tag list: "udt_types", the member
+        types of each UDT of the PLC ({udt_name: {member_name: data_type}}), and "fingerprint", the controller's
+        change counters when the tag list was read (see get_tag_list_fingerprint)
     :return: A dictionary of tag names and data types
 
     If the tag list can't be retrieved, returns None.
@@ -24,44 +38,96 @@ def get_tag_list(plc_id, ip, slot_no=0, port=44818):
     if not plc_id or not ip:
         raise Exception(f'Missing required plc_id or ip call.')
 
-    with PLC() as comm:
-        comm.IPAddress = ip
-        comm.Port = port
-        if slot_no > 0:
-            comm.ProcessorSlot = int(slot_no)
-        shared_logger.log.debug(f'plc_id="{plc_id}" comm = {str(comm)}')
-
-        try:
-            tag_list_object = {}
-            tag_list = process_plc_generic_response_item(comm.GetTagList())
-            # Tag list could still be empty
-            if tag_list is not None:
-                # We have a tag list, so process into a dictionary
-                for t in tag_list:
-                    # Skip "Program:MainProgram" tag
-                    if t.TagName == "Program:MainProgram":
-                        continue
-                    tag_list_object[t.TagName] = {"type": t.DataType}
-            else:
-                # We have no tag list, so raise an error
-                raise Exception(f'No tag list retrieved for {plc_id}.')
-
-            # Otherwise, we're good, so return the new dictionary
-            return tag_list_object
-
-        except Exception as e:
-            custom_exception_message = f'plc_id="{plc_id}" {e}'
-            shared_logger.log.error(custom_exception_message)
-            raise Exception(custom_exception_message) from e
-
-
-def get_tag_value(plc_id, ip, slot_no=0, port=44818, tag_name=""):
+    try:
+        # Use a pooled (long-lived) session rather than a new connection for each call
+        def read_tag_list(comm):
+            # The change counters are read first, so a change made while the tag list is read shows up next time
+            fingerprint = read_tag_list_fingerprint(comm) if tag_list_info is not None else None
+            response = comm.GetTagList()
+            if tag_list_info is not None:
+                # GetTagList also reads the definition of each UDT the tags use
+                tag_list_info["udt_types"] = {udt_name: {field.TagName: field.DataType or "" for field in udt.Fields}
+                                              for udt_name, udt in comm.UDTByName.items()}
+                tag_list_info["fingerprint"] = fingerprint
+            return response
+
+        tag_list_response = PlcSessionPool().run(ip, port, slot_no, read_tag_list, plc_id, connection_size)
+
+        tag_list_object = {}
+        tag_list = process_plc_generic_response_item(tag_list_response)
+        # Tag list could still be empty
+        if tag_list is not None:
+            # We have a tag list, so process into a dictionary
+            for t in tag_list:
+                # Skip "Program:MainProgram" tag
+                if t.TagName == "Program:MainProgram":
+                    continue
+                tag_list_object[t.TagName] = {"type": t.DataType}
+        else:
+            # We have no tag list, so raise an error
+            raise Exception(f'No tag list retrieved for {plc_id}.')
+
+        # Otherwise, we're good, so return the new dictionary
+        return tag_list_object
+
+    except Exception as e:
+        custom_exception_message = f'plc_id="{plc_id}" {e}'
+        shared_logger.log.error(custom_exception_message)
+        raise Exception(custom_exception_message) from e
+
+
+def get_tag_list_fingerprint(plc_id, ip, slot_no=0, port=44818, connection_size=None):
+    """Gets the change counters of a PLC, which change whenever its tags or data types do.
+    :param plc_id: The ID of the PLC
+    :param slot_no: The slot number of the PLC
+    :param ip: The IP address of the PLC
+    :param port: The port number of the PLC
+    :param connection_size: The CIP connection size of the PLC (bytes), or None/"auto" to negotiate it
+    :return: the change counters (as a hex string), or None if the PLC doesn't support them
+
+    This is a single small request, so a cached tag list can be checked far more cheaply than by reading it again.
+    """
+
+    # Raise exception if plc_id, ip are missing
+    if not plc_id or not ip:
+        raise Exception('Missing required plc_id or ip call.')
+
+    try:
+        return PlcSessionPool().run(ip, port, slot_no, read_tag_list_fingerprint, plc_id, connection_size)
+    except Exception as e:
+        custom_exception_message = f'plc_id="{plc_id}" {e}'
+        shared_logger.log.error(custom_exception_message)
+        raise Exception(custom_exception_message) from e
+
+
+def read_tag_list_fingerprint(comm):
+    """Read the change counters of a PLC with a CIP Get_Attribute_List request on a PyLogix session.
+    :param comm: the PyLogix PLC session
+    :return: the change counters (as a hex string), or None if the PLC doesn't support them
+    """
+    connected, status = comm.conn.connect()
+    if not connected:
+        raise Exception(f'Unable to connect: {status}')
+
+    # Get_Attribute_List, path to instance 1 of the change detection class, then the attributes to get
+    request = pack('<BBBBBBH', 0x03, 0x02, 0x20, _CHANGE_DETECTION_CLASS, 0x24, 0x01,
+                   len(_CHANGE_DETECTION_ATTRIBUTES))
+    request += pack(f'<{len(_CHANGE_DETECTION_ATTRIBUTES)}H', *_CHANGE_DETECTION_ATTRIBUTES)
+    status, reply = comm.conn.send(request)
+    if status != 0 or not reply:
+        return None
+    # The CIP reply data (the attribute list with each attribute's status and value) starts at byte 50
+    return reply[50:].hex()
+
+
+def get_tag_value(plc_id, ip, slot_no=0, port=44818, tag_name="", connection_size=None):
     """Gets a tag value from a PLC.
     :param plc_id: The ID of the PLC
     :param slot_no: The slot number of the PLC
     :param ip: The IP address of the PLC
     :param port: The port number of the PLC
     :param tag_name: The name of the tag to read
+    :param connection_size: The CIP connection size of the PLC (bytes), or None/"auto" to negotiate it
     :return: A tuple with a single item list of value of the tag (inside a dictionary), and the PLC time.
 
     If the tag value can't be retrieved, returns None for its value.
@@ -79,10 +145,10 @@ def get_tag_value(plc_id, ip, slot_no=0, port=44818, tag_name=""):
         raise Exception(f'Missing tag_name in call to plc_id="{plc_id}"')
 
     # Call get_tag_values with a single tag and return in a list of 1
-    return get_tag_values(plc_id, ip, slot_no, port, [tag_name])
+    return get_tag_values(plc_id, ip, slot_no, port, [tag_name], connection_size)
 
 
-def get_tag_values(plc_id, ip, slot_no=0, port=44818, tag_list=[""]):
+def get_tag_values(plc_id, ip, slot_no=0, port=44818, tag_list=[""], connection_size=None, fresh_plc_time=False):
     """Gets a list of tag values from a PLC.
 
     :param plc_id: The ID of the PLC
@@ -90,10 +156,16 @@ def get_tag_values(plc_id, ip, slot_no=0, port=44818, tag_list=[""]):
     :param ip: The IP address of the PLC
     :param port: The port number of the PLC
     :param tag_list: The list of tag names to read (list of strings)
+    :param connection_size: The CIP connection size of the PLC (bytes), or None/"auto" to negotiate it
+    :param fresh_plc_time: if True, always read the PLC clock (GetPLCTime) along with the tags
     :return: A tuple with the list of values of the tags (inside a dictionary each), and the PLC time.
 
     If any of the tags can't be retrieved, returns None for that tag's value.
 
+    The PLC time is normally derived from the tracked PLC clock (see plc_clock.py), which saves a GetPLCTime
+    round trip on each read. The clock is read again along with the tags when its last sync is too old, or when
+    fresh_plc_time is True.
+
     The dictionary has the following structure:
     {
         "tag_name": "NAME-HERE",
@@ -106,46 +178,105 @@ def get_tag_values(plc_id, ip, slot_no=0, port=44818, tag_list=[""]):
     Note the tag_value returned could be of ANY type, coerced by the Pylogix library
     into the proper Python type!
 
-    NOTE: From PyLogix examples: Packets have a ~500 byte limit, so you have
-    to be cautions about not exceeding that or the read will fail. It's a little
-    difficult to predict how many bytes your reads will take up because
-    the packet will depend on the length of the tag name and the
-    reply will depend on the data type. Strings are a lot longer than
-    DINT's for example.
+    NOTE: Packets are limited by the connection size of the session (~500 bytes for a Small Forward Open, ~4000
+    for a Large one). The request depends on the length of each tag name and the reply on each data type (Strings
+    are a lot longer than DINT's for example), so large tag lists are split by the ReadPlanner into the fewest
+    packets that fit, using the types from the PLC tag list. The chunks are read back to back on the same session
+    and the values returned in the order of tag_list.
     """
 
     # Raise exception if plc_id, ip are missing
     if not plc_id or not ip:
-        raise Exception(f'Missing required plc_id or ip call.')
+        raise Exception('Missing required plc_id or ip call.')
 
     # Raise exception if tag_list is invalid
     if not utils.is_list_of_strings(tag_list):
         raise Exception(f"tag_list must be an array of strings. Received: {tag_list}.")
 
-    with PLC() as comm:
-        comm.IPAddress = ip
-        comm.Port = port
-        if slot_no > 0:
-            comm.ProcessorSlot = int(slot_no)
-        shared_logger.log.debug(f'plc_id="{plc_id}" comm = {str(comm)}')
-
-        try:
+    plc_clock = PlcClock()
+    sync_clock = fresh_plc_time or plc_clock.needs_sync(plc_id)
+    clock_round_trip = {}
+
+    def read_time_and_tags(comm):
+        # All calls run back to back on the same pooled session. The session is connected (and its connection
+        # size negotiated) before we plan the read: GetPLCTime connects it, otherwise we connect explicitly (which
+        # does nothing on a session that is already connected).
+        if not sync_clock:
+            comm.conn.connect()
+            return None, read_planned(comm)
+        clock_round_trip['sent'] = time.monotonic()
+        plc_time_response = comm.GetPLCTime()
+        clock_round_trip['received'] = time.monotonic()
+        return plc_time_response, read_planned(comm)
+
+    def read_planned(comm):
+        ReadPlanner.prime_known_tags(comm, plc_id, tag_list)
+        tuner = ReadChunkTuner()
+        chunk_size = tuner.get_chunk_size(plc_id, comm.ConnectionSize)
+
+        started = time.monotonic()
+        responses = [None] * len(tag_list)
+        packets = read_chunks(comm, range(len(tag_list)), chunk_size, responses)
+        elapsed = time.monotonic() - started
+
+        # Learn from the read. If some packets were too large, re-read those tags once in smaller packets.
+        too_large = [index for index, response in enumerate(responses)
+                     if ReadChunkTuner.is_size_failure(response.Status)]
+        size_failure_status = str(responses[too_large[0]].Status) if too_large else None
+        new_chunk_size = tuner.record_read(plc_id, chunk_size, packets, elapsed, size_failure_status)
+        if too_large and new_chunk_size < chunk_size:
+            shared_logger.log.debug(f'plc_id="{plc_id}" re-reading {len(too_large)} tags in smaller packets')
+            read_chunks(comm, too_large, new_chunk_size, responses)
+        return responses
+
+    def read_chunks(comm, indexes, chunk_size, responses):
+        # Read the tags at the given indexes of tag_list in as few packets of chunk_size as possible, putting each
+        # response at the tag's index. Returns the number of packets.
+        indexes = list(indexes)
+        chunks = ReadPlanner.plan(plc_id, [tag_list[index] for index in indexes], chunk_size)
+        if len(chunks) > 1:
+            shared_logger.log.debug(f'plc_id="{plc_id}" reading {len(indexes)} tags in {len(chunks)} packets')
+        for chunk in chunks:
+            chunk_indexes = [indexes[position] for position in chunk]
+            chunk_responses = comm.Read([tag_list[index] for index in chunk_indexes])
+            if not isinstance(chunk_responses, list):
+                chunk_responses = [chunk_responses]
+            for index, response in zip(chunk_indexes, chunk_responses):
+                responses[index] = response
+        return len(chunks)
+
+    try:
+        # Use a pooled (long-lived) session rather than a new connection for each call
+        plc_time_response, tag_list_response = PlcSessionPool().run(ip, port, slot_no, read_time_and_tags, plc_id,
+                                                                           connection_size)
+    except Exception as e:
+        custom_exception_message = f'plc_id="{plc_id}" {e}'
+        shared_logger.log.error(custom_exception_message)
+        raise Exception(custom_exception_message) from e
+
+    plc_time = None
+    try:
+        if plc_time_response is None:
+            # We didn't read the PLC clock this time, so derive the PLC time from the last sync
+            plc_time = plc_clock.get_plc_time(plc_id)
+        else:
             # read PLC TIME and set to variable
-            plc_time = process_plc_generic_response_item(comm.GetPLCTime())
-        except Exception as e:
-            custom_exception_message = f'Could not read PLCTime for plc_id="{plc_id}" {e}'
-            shared_logger.log.error(custom_exception_message)
-
-        try:
-            # read tag list
-            tag_list_values = process_plc_tag_response(comm.Read(tag_list))
-            # return the values of the tags, including status, which should be checked by the caller
-            return tag_list_values, plc_time
-
-        except Exception as e:
-            custom_exception_message = f'plc_id="{plc_id}" {e}'
-            shared_logger.log.error(custom_exception_message)
-            raise Exception(custom_exception_message) from e
+            plc_time = process_plc_generic_response_item(plc_time_response)
+            plc_clock.sync(plc_id, plc_time, clock_round_trip['sent'], clock_round_trip['received'])
+    except Exception as e:
+        custom_exception_message = f'Could not read PLCTime for plc_id="{plc_id}" {e}'
+        shared_logger.log.error(custom_exception_message)
+
+    try:
+        # read tag list
+        tag_list_values = process_plc_tag_response(tag_list_response)
+        # return the values of the tags, including status, which should be checked by the caller
+        return tag_list_values, plc_time
+
+    except Exception as e:
+        custom_exception_message = f'plc_id="{plc_id}" {e}'
+        shared_logger.log.error(custom_exception_message)
+        raise Exception(custom_exception_message) from e
 
 
 def process_plc_tag_response(response):
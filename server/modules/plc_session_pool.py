@@ -0,0 +1,366 @@
+# Python dependencies
+import os
+import threading
+import time
+from pylogix import PLC
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+class _PlcSession:
+    """A helper class to store one long-lived pylogix connection and its bookkeeping"""
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.use_count = 0
+        # True if pylogix negotiates the connection size (Large Forward Open first, then Small)
+        self.auto_connection_size = True
+
+    def is_connected(self):
+        """Returns True if pylogix still considers the underlying socket connected"""
+        return bool(self.comm.conn.SocketConnected)
+
+    def close(self):
+        """Close the connection (Forward Close, Unregister Session), ignoring errors"""
+        try:
+            self.comm.Close()
+        except Exception:
+            pass
+
+
+class _PlcSessionBucket:
+    """A helper class to store all the sessions (and their stats) for a given (ip, port, slot)"""
+
+    def __init__(self):
+        self.idle_sessions = []
+        self.in_use = 0
+        # The connection size negotiated by the last new session in auto mode, so later sessions skip straight to it
+        self.negotiated_connection_size = None
+        self.condition = threading.Condition()
+        self.stats = {
+            "created": 0,
+            "reused": 0,
+            "reconnects": 0,
+            "broken": 0,
+            "keepalives": 0,
+            "closed_idle": 0,
+            "waits": 0,
+        }
+
+
+class PlcSessionPool:
+    """
+    A pool of long-lived pylogix sessions keyed by (ip, port, slot).
+    Supports a singleton pattern so that only one instance is created!
+
+    Opening a PLC() for each request costs a TCP connect, a RegisterSession and a Forward Open before any data
+    moves. The pool keeps those sessions open between requests, keeps idle sessions alive, detects broken
+    sessions (reconnecting transparently) and caps the number of concurrent sessions per PLC.
+
+    Sessions use the connection size of the PLC config. In auto mode, pylogix tries a Large Forward Open (4002
+    bytes) and falls back to a Small one (504 bytes). The pool remembers which one worked, so later sessions to
+    the same PLC don't pay for a failed Large Forward Open each time.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    # Pool defaults. These can be changed with configure() (see the server.py command line arguments.)
+    max_sessions_per_plc = 2
+    idle_timeout = 300  # seconds an idle session is kept open before it is closed
+    keepalive_interval = 30  # seconds between keepalive requests on idle sessions
+    acquire_timeout = 30  # seconds to wait for a free session when a PLC is at its cap
+    stats_log_interval = 300  # seconds between logs of the pool stats (0 to disable)
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(PlcSessionPool, cls).__new__(cls)
+            cls._instance._reset()
+        return cls._instance
+
+    def _reset(self):
+        """Forget every session and the keepalive thread (without closing sockets)"""
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._keepalive_thread = None
+        self._stop_event = threading.Event()
+        self._stats_logged = time.monotonic()
+
+    def configure(self, max_sessions_per_plc=None, idle_timeout=None, keepalive_interval=None,
+                  stats_log_interval=None):
+        """
+        Change the pool settings. Only the passed values are changed.
+
+        :param max_sessions_per_plc: the maximum number of open sessions for a given (ip, port, slot)
+        :param idle_timeout: the number of seconds an idle session is kept open
+        :param keepalive_interval: the number of seconds between keepalive requests on idle sessions
+        :param stats_log_interval: the number of seconds between INFO logs of the pool stats (0 to disable)
+        """
+        if max_sessions_per_plc is not None:
+            self.max_sessions_per_plc = max(1, int(max_sessions_per_plc))
+        if idle_timeout is not None:
+            self.idle_timeout = int(idle_timeout)
+        if keepalive_interval is not None:
+            self.keepalive_interval = max(1, int(keepalive_interval))
+        if stats_log_interval is not None:
+            self.stats_log_interval = max(0, int(stats_log_interval))
+
+    def run(self, ip, port, slot, operation, plc_id="", connection_size=None):
+        """
+        Run an operation against a pooled session for the given PLC.
+
+        :param ip: The IP address of the PLC
+        :param port: The port number of the PLC
+        :param slot: The slot number of the PLC
+        :param operation: a callable that receives the pylogix PLC object and returns the pylogix response(s)
+        :param plc_id: The ID of the PLC (for logging only)
+        :param connection_size: the CIP connection size in bytes for new sessions, or None/"auto" to try a Large
+            Forward Open first and fall back to a Small one
+        :return: whatever the operation returns
+
+        If a REUSED session turns out to be broken (the socket was dropped since its last use), the session is
+        discarded and the operation is retried once on a brand-new session. Fresh sessions are not retried, so
+        an offline PLC only pays for one connection timeout.
+        """
+        key = (ip, int(port), int(slot))
+        bucket = self._get_bucket(key)
+
+        session, reused = self._acquire(key, bucket, connection_size)
+        try:
+            result = operation(session.comm)
+        except Exception:
+            self._release(bucket, session, broken=True)
+            raise
+
+        if session.is_connected():
+            if not reused and session.auto_connection_size:
+                self._remember_connection_size(key, bucket, session)
+            self._release(bucket, session)
+            return result
+
+        if not reused and session.auto_connection_size:
+            # The connection size we skipped to may no longer work (for instance, the module was replaced), so let
+            # the next session negotiate again
+            with bucket.condition:
+                bucket.negotiated_connection_size = None
+
+        # The session is broken (pylogix flags the socket as disconnected on IO errors and failed connects)
+        self._release(bucket, session, broken=True)
+        if not reused:
+            return result
+
+        shared_logger.log.warning(f'plc_id="{plc_id}" pooled session to {self._key_to_string(key)} was broken. '
+                                  f'Reconnecting...')
+        with bucket.condition:
+            bucket.stats["reconnects"] += 1
+        session, _ = self._acquire(key, bucket, connection_size)
+        try:
+            result = operation(session.comm)
+        except Exception:
+            self._release(bucket, session, broken=True)
+            raise
+        self._release(bucket, session, broken=not session.is_connected())
+        return result
+
+    def get_connection_size(self, ip, port, slot):
+        """
+        Return the connection size negotiated with a PLC by its latest new auto mode session, or None if unknown.
+        """
+        with self._lock:
+            bucket = self._buckets.get((ip, int(port), int(slot)))
+        return bucket.negotiated_connection_size if bucket is not None else None
+
+    def get_stats(self):
+        """
+        Return the pool stats as a dictionary keyed by "ip:port/slot".
+        """
+        with self._lock:
+            buckets = dict(self._buckets)
+        stats = {}
+        for key, bucket in buckets.items():
+            with bucket.condition:
+                stats[self._key_to_string(key)] = {
+                    **bucket.stats,
+                    "in_use": bucket.in_use,
+                    "idle": len(bucket.idle_sessions),
+                    "connection_size": bucket.negotiated_connection_size,
+                }
+        return stats
+
+    def close_all(self):
+        """Close every idle session and stop the keepalive thread. Used on server shutdown."""
+        self._stop_event.set()
+        with self._lock:
+            buckets = list(self._buckets.values())
+        for bucket in buckets:
+            with bucket.condition:
+                sessions = bucket.idle_sessions
+                bucket.idle_sessions = []
+            for session in sessions:
+                session.close()
+
+    def _get_bucket(self, key):
+        """Return the bucket for key, creating it (and starting the keepalive thread) as needed"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = _PlcSessionBucket()
+                self._buckets[key] = bucket
+            # Start the keepalive thread lazily, so it always lives in the process that uses the pool
+            if self._keepalive_thread is None:
+                self._keepalive_thread = threading.Thread(target=self._keepalive_loop,
+                                                          name="plc-session-keepalive", daemon=True)
+                self._keepalive_thread.start()
+            return bucket
+
+    def _acquire(self, key, bucket, connection_size=None):
+        """
+        Get an idle session from the bucket, or create one if under the cap, or wait for one to be released.
+        :param connection_size: the connection size for a new session (see run())
+        :return: a tuple of (session, reused)
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        with bucket.condition:
+            while True:
+                if bucket.idle_sessions:
+                    # LIFO, so the most recently used (warmest) session is used first
+                    session = bucket.idle_sessions.pop()
+                    bucket.in_use += 1
+                    bucket.stats["reused"] += 1
+                    session.use_count += 1
+                    return session, True
+                if bucket.in_use < self.max_sessions_per_plc:
+                    bucket.in_use += 1
+                    bucket.stats["created"] += 1
+                    negotiated_connection_size = bucket.negotiated_connection_size
+                    break
+                # At the cap, wait for a session to be released
+                bucket.stats["waits"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not bucket.condition.wait(remaining):
+                    raise Exception(f'Timed out waiting for a free session to {self._key_to_string(key)} '
+                                    f'(max_sessions_per_plc={self.max_sessions_per_plc}).')
+
+        # Create the new session outside the lock. The connection itself is opened by pylogix on first use.
+        ip, port, slot = key
+        comm = PLC()
+        comm.IPAddress = ip
+        comm.Port = port
+        if slot > 0:
+            comm.ProcessorSlot = int(slot)
+        auto_connection_size = not self.is_fixed_connection_size(connection_size)
+        if not auto_connection_size:
+            comm.ConnectionSize = int(connection_size)
+        elif negotiated_connection_size is not None:
+            comm.ConnectionSize = negotiated_connection_size
+        shared_logger.log.debug(f'New pooled session to {self._key_to_string(key)} comm = {str(comm)}')
+        session = _PlcSession(comm)
+        session.auto_connection_size = auto_connection_size
+        session.use_count += 1
+        return session, False
+
+    @classmethod
+    def is_fixed_connection_size(cls, connection_size):
+        """Returns True if connection_size (from the PLC config) is a fixed size rather than auto"""
+        return isinstance(connection_size, int) and not isinstance(connection_size, bool) and connection_size > 0
+
+    def _remember_connection_size(self, key, bucket, session):
+        """Remember the connection size a new auto mode session negotiated with the PLC"""
+        negotiated_connection_size = session.comm.conn.ConnectionSize
+        if negotiated_connection_size is None:
+            return
+        with bucket.condition:
+            if bucket.negotiated_connection_size != negotiated_connection_size:
+                shared_logger.log.info(f'Negotiated a connection size of {negotiated_connection_size} bytes '
+                                       f'with {self._key_to_string(key)}')
+            bucket.negotiated_connection_size = negotiated_connection_size
+
+    def _release(self, bucket, session, broken=False, touch=True):
+        """Return a session to its bucket, or close it if broken"""
+        if touch:
+            session.last_used = time.monotonic()
+        with bucket.condition:
+            bucket.in_use -= 1
+            if broken:
+                bucket.stats["broken"] += 1
+            else:
+                bucket.idle_sessions.append(session)
+            bucket.condition.notify()
+        if broken:
+            session.close()
+
+    def _keepalive_loop(self):
+        """Background loop that closes expired idle sessions and keeps the others alive"""
+        while not self._stop_event.wait(self.keepalive_interval):
+            try:
+                self._keepalive_once()
+            except Exception as e:
+                shared_logger.log.error(f'PlcSessionPool | keepalive | {e}')
+
+    def _keepalive_once(self):
+        """Run one keepalive pass over every idle session"""
+        with self._lock:
+            buckets = list(self._buckets.items())
+        for key, bucket in buckets:
+            # Take the idle sessions out of the bucket while we work on them so nobody else can use them
+            with bucket.condition:
+                sessions = bucket.idle_sessions
+                bucket.idle_sessions = []
+                bucket.in_use += len(sessions)
+            now = time.monotonic()
+            for session in sessions:
+                if now - session.last_used > self.idle_timeout:
+                    # Idle for too long, so close it (this is not counted as a broken session)
+                    with bucket.condition:
+                        bucket.in_use -= 1
+                        bucket.stats["closed_idle"] += 1
+                        bucket.condition.notify()
+                    session.close()
+                    continue
+                broken = False
+                try:
+                    if now - session.last_used >= self.keepalive_interval:
+                        # A cheap request that keeps the CIP connection from timing out on the PLC side
+                        session.comm.GetPLCTime()
+                        with bucket.condition:
+                            bucket.stats["keepalives"] += 1
+                    broken = not session.is_connected()
+                except Exception as e:
+                    shared_logger.log.warning(f'PlcSessionPool | keepalive to {self._key_to_string(key)} | {e}')
+                    broken = True
+                finally:
+                    # Every session taken out above goes back (or is closed), whatever happens to the others.
+                    # A keepalive is not a "use", so it does not push back the idle timeout.
+                    self._release(bucket, session, broken=broken, touch=False)
+
+        if self.stats_log_interval > 0 and time.monotonic() - self._stats_logged >= self.stats_log_interval:
+            self._stats_logged = time.monotonic()
+            shared_logger.log.info(f'PlcSessionPool | stats | {self.get_stats()}')
+
+    @classmethod
+    def _key_to_string(cls, key):
+        ip, port, slot = key
+        return f'{ip}:{port}/{slot}'
+
+
+def _reset_pool_after_fork():
+    """
+    A forked worker must never share the parent's PLC sockets (or its keepalive thread, which doesn't survive
+    the fork), so the worker starts with an empty pool of its own.
+    """
+    if PlcSessionPool._instance is not None:
+        PlcSessionPool._instance._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
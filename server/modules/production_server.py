@@ -0,0 +1,138 @@
+# Python Dependencies
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+class _ThreadPoolWSGIServer(WSGIServer):
+    """
+    A wsgiref WSGIServer that hands each accepted connection to a bounded pool of threads, so one slow request
+    (for instance, against an unreachable PLC) no longer blocks every other client.
+    """
+
+    # Let the kernel queue more pending connections than the wsgiref default of 5
+    request_queue_size = 128
+
+    def __init__(self, server_address, threads):
+        super().__init__(server_address, WSGIRequestHandler)
+        self.threads = threads
+        self._executor = None
+
+    def serve_forever(self, poll_interval=0.5):
+        # The executor is created here (not in __init__) so each forked worker gets its own threads
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="wsgi-worker")
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def process_request(self, request, client_address):
+        """Called by the accept loop for each new connection. Runs the request in the thread pool."""
+        self._executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        """Same as socketserver.ThreadingMixIn.process_request_thread"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve_production(app, host, port, workers=1, threads=8, on_worker_start=None):
+    """
+    Serve the WSGI app with several worker processes, each with a pool of request threads.
+
+    :param app: the WSGI app (falcon.App)
+    :param host: the host to bind to ("" for all interfaces)
+    :param port: the TCP port to bind to
+    :param workers: the number of worker processes
+    :param threads: the number of request threads per worker process
+    :param on_worker_start: optional callable run in each worker before it serves (to start background threads)
+
+    The listening socket is bound once here and shared by every worker. Workers are forked AFTER startup, so
+    each one inherits the already loaded PlcList, BatchList and TagList. Per-process resources that can't be
+    shared across a fork (the PLC session pool, the scan engine threads) reset themselves in each worker.
+
+    Workers that die are restarted. SIGINT/SIGTERM on this (master) process stops every worker.
+    """
+    if workers > 1 and not hasattr(os, "fork"):
+        shared_logger.log.warning("Multiple workers need os.fork, which this platform does not support. "
+                                  "Using a single worker.")
+        workers = 1
+
+    httpd = _ThreadPoolWSGIServer((host, port), threads)
+    httpd.set_app(app)
+
+    if workers <= 1:
+        shared_logger.log.info(f'Production mode: 1 worker with {threads} threads')
+        if on_worker_start:
+            on_worker_start()
+        with httpd:
+            httpd.serve_forever()
+        return
+
+    shared_logger.log.info(f'Production mode: {workers} workers with {threads} threads each')
+    children = {}
+
+    def spawn_worker(worker_no):
+        pid = os.fork()
+        if pid == 0:
+            # In the worker. Default SIGTERM handling so the master can stop us.
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                shared_logger.log.info(f'Worker {worker_no} (pid {os.getpid()}) started')
+                if on_worker_start:
+                    on_worker_start()
+                httpd.serve_forever()
+            except SystemExit:
+                pass
+            except Exception as e:
+                shared_logger.log.error(f'Worker {worker_no} (pid {os.getpid()}) failed: {e}')
+                exit_code = 1
+            finally:
+                # Never return into the master's code path
+                os._exit(exit_code)
+        children[pid] = worker_no
+
+    def stop_workers(signum=None, frame=None):
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    # The master only supervises, so SIGTERM stops the workers too (SIGINT goes through server.py's handler)
+    signal.signal(signal.SIGTERM, stop_workers)
+
+    try:
+        for worker_no in range(workers):
+            spawn_worker(worker_no)
+
+        # Restart any worker that exits
+        while True:
+            pid, status = os.wait()
+            worker_no = children.pop(pid, None)
+            if worker_no is None:
+                continue
+            shared_logger.log.error(f'Worker {worker_no} (pid {pid}) exited with status {status}. Restarting...')
+            # Avoid a tight restart loop if workers die immediately
+            time.sleep(1)
+            spawn_worker(worker_no)
+    finally:
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        httpd.server_close()
@@ -0,0 +1,211 @@
+# Python dependencies
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+# PyLogix statuses that mean a packet was too large for the PLC or the network path
+_SIZE_FAILURE_STATUSES = (
+    'Partial transfer',
+    'Reply data too large',
+    'Fragmentation of a primitive value',
+    'Too much data',
+    'Routing failure, request packet too large',
+    'Routing failure, response packet too large',
+)
+
+
+class _PlcChunkSize:
+    """A helper class to store the learned read chunk size of one PLC"""
+
+    def __init__(self, chunk_size=None, updated=None):
+        # None means "not learned", i.e. use the full connection size
+        self.chunk_size = chunk_size
+        self.updated = updated
+        self.connection_size = None
+        # The smallest chunk size that failed since startup. We don't grow back up to it.
+        self.failed_chunk_size = None
+        self.good_reads = 0
+        self.history = deque(maxlen=ReadChunkTuner.history_size)
+
+
+class ReadChunkTuner:
+    """
+    Learns, per PLC, the largest read packet (chunk size, in bytes) that the PLC and the network path to it handle
+    well. The read planner packs tags into packets of at most this size.
+    Supports a singleton pattern so that only one instance is created!
+
+    - A read where tags fail because a packet was too large shrinks the chunk size (and those tags are re-read
+      in smaller packets right away).
+    - Once shrunk, the chunk size grows back a little after every grow_after reads in a row that succeed with a
+      per-packet latency of at most good_latency_ms, up to the connection size (but never back up to a size that
+      failed since the server started).
+
+    Learned sizes are saved to <cache directory>/plc_io/chunk_sizes.json so they survive restarts.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    # Tuning defaults
+    min_chunk_size = 128
+    shrink_factor = 0.75
+    grow_factor = 1.1
+    grow_after = 10
+    good_latency_ms = 100
+    history_size = 50
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(ReadChunkTuner, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._plcs = {}
+            cls._instance._state_file = None
+        return cls._instance
+
+    def configure(self, cache_directory):
+        """
+        Set where learned chunk sizes are saved, and load the ones saved by a previous run.
+        :param cache_directory: the cache directory of the server. Sizes are saved in its plc_io subdirectory.
+        """
+        state_directory = os.path.join(cache_directory, 'plc_io')
+        os.makedirs(state_directory, exist_ok=True)
+        self._state_file = os.path.join(state_directory, 'chunk_sizes.json')
+
+        if not os.path.exists(self._state_file):
+            return
+        try:
+            with open(self._state_file, "r") as file:
+                saved = json.load(file)
+            with self._lock:
+                for plc_id, saved_plc in saved.items():
+                    self._plcs[plc_id] = _PlcChunkSize(saved_plc.get('chunk_size'), saved_plc.get('updated'))
+            shared_logger.log.info(f'Loaded learned read chunk sizes for {len(saved)} PLC(s)')
+        except Exception as e:
+            shared_logger.log.error(f'Unable to load learned read chunk sizes from {self._state_file}: {e}')
+
+    @classmethod
+    def is_size_failure(cls, status):
+        """Return True if a PyLogix read status means the packet was too large"""
+        status = str(status)
+        return any(size_failure in status for size_failure in _SIZE_FAILURE_STATUSES)
+
+    def get_chunk_size(self, plc_id, connection_size):
+        """
+        Get the packet size to plan reads of a PLC with.
+        :param plc_id: The ID of the PLC
+        :param connection_size: the connection size of the session about to be used
+        :return: the learned chunk size, never more than connection_size
+        """
+        with self._lock:
+            plc = self._plcs.get(plc_id)
+            if plc is None:
+                plc = self._plcs[plc_id] = _PlcChunkSize()
+            plc.connection_size = connection_size
+            if plc.chunk_size is None:
+                return connection_size
+            return min(plc.chunk_size, connection_size)
+
+    def record_read(self, plc_id, chunk_size, packets, elapsed, size_failure_status=None):
+        """
+        Learn from a read.
+        :param plc_id: The ID of the PLC
+        :param chunk_size: the chunk size the read was planned with
+        :param packets: the number of packets the read took
+        :param elapsed: how long the read took (seconds)
+        :param size_failure_status: the status of a tag that failed because its packet was too large, if any
+        :return: the chunk size to use from now on
+        """
+        with self._lock:
+            plc = self._plcs.get(plc_id)
+            if plc is None:
+                plc = self._plcs[plc_id] = _PlcChunkSize()
+            connection_size = plc.connection_size or chunk_size
+            largest_chunk_size = connection_size
+            if plc.failed_chunk_size is not None:
+                largest_chunk_size = min(largest_chunk_size, plc.failed_chunk_size - 1)
+
+            if size_failure_status:
+                plc.good_reads = 0
+                plc.failed_chunk_size = min(chunk_size, plc.failed_chunk_size or chunk_size)
+                new_chunk_size = max(self.min_chunk_size, int(chunk_size * self.shrink_factor))
+                if new_chunk_size < chunk_size:
+                    self._adjust(plc_id, plc, chunk_size, new_chunk_size, size_failure_status)
+                return new_chunk_size
+
+            # Nothing to grow back to
+            if plc.chunk_size is None or plc.chunk_size >= largest_chunk_size:
+                return min(plc.chunk_size or connection_size, connection_size)
+
+            latency_ms = elapsed * 1000 / max(1, packets)
+            if latency_ms > self.good_latency_ms:
+                plc.good_reads = 0
+                return plc.chunk_size
+
+            plc.good_reads += 1
+            if plc.good_reads >= self.grow_after:
+                plc.good_reads = 0
+                new_chunk_size = min(largest_chunk_size, int(plc.chunk_size * self.grow_factor) + 1)
+                self._adjust(plc_id, plc, plc.chunk_size, new_chunk_size,
+                             f'{self.grow_after} good reads in a row ({latency_ms:.0f} ms per packet)')
+            return plc.chunk_size
+
+    def get_stats(self, plc_id):
+        """
+        Get the tuning state of a PLC.
+        :param plc_id: The ID of the PLC
+        :return: a dictionary with the chunk_size, connection_size, failed_chunk_size, and the history of adjustments
+            (oldest first). chunk_size is None if nothing was learned yet (the full connection size is used).
+        """
+        with self._lock:
+            plc = self._plcs.get(plc_id)
+            if plc is None:
+                return {'chunk_size': None, 'connection_size': None, 'failed_chunk_size': None, 'updated': None,
+                        'history': []}
+            return {
+                'chunk_size': plc.chunk_size,
+                'connection_size': plc.connection_size,
+                'failed_chunk_size': plc.failed_chunk_size,
+                'updated': plc.updated,
+                'history': list(plc.history),
+            }
+
+    def _adjust(self, plc_id, plc, old_chunk_size, new_chunk_size, reason):
+        """Change the chunk size of a PLC, remember why, and save it. Call with the lock held."""
+        plc.chunk_size = new_chunk_size
+        plc.updated = time.time()
+        plc.history.append({
+            'time': plc.updated,
+            'from': old_chunk_size,
+            'to': new_chunk_size,
+            'reason': reason,
+        })
+        shared_logger.log.info(f'plc_id="{plc_id}" read chunk size {old_chunk_size} -> {new_chunk_size} ({reason})')
+        self._save()
+
+    def _save(self):
+        """Save the learned chunk sizes. Call with the lock held."""
+        if self._state_file is None:
+            return
+        saved = {plc_id: {'chunk_size': plc.chunk_size, 'updated': plc.updated}
+                 for plc_id, plc in self._plcs.items() if plc.chunk_size is not None}
+        try:
+            # Write to a temporary file, then swap it in, so a crash never leaves a half written file behind
+            temp_file = f'{self._state_file}.{os.getpid()}.tmp'
+            with open(temp_file, "w") as file:
+                json.dump(saved, file)
+            os.replace(temp_file, self._state_file)
+        except Exception as e:
+            shared_logger.log.error(f'Unable to save learned read chunk sizes to {self._state_file}: {e}')
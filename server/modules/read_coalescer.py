@@ -0,0 +1,123 @@
+# Python dependencies
+import threading
+import time
+
+# Import our own dependencies
+import plc_io
+import model_PlcList
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+class _PendingRead:
+    """A helper class to store one caller's tag list while it waits for the coalesced read"""
+
+    def __init__(self, tag_list, fresh_plc_time=False):
+        self.tag_list = tag_list
+        self.fresh_plc_time = fresh_plc_time
+        self.done = threading.Event()
+        self.tag_values = None
+        self.plc_time = None
+        self.error = None
+
+
+class _PlcReadWindow:
+    """A helper class to store the reads waiting for the current coalescing window of one PLC"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.is_open = False
+
+
+class ReadCoalescer:
+    """
+    Merges the reads that arrive for the same PLC within a short window (coalesce_window_ms in the PLC config)
+    into one multi-tag Read, then fans the results back out to each caller.
+
+    The first read to arrive opens the window and waits for it to close. Reads that arrive while the window is
+    open just wait. When the window closes, the first caller reads the union of every pending tag list in one
+    call to the PLC (one GetPLCTime and one Read instead of one of each per caller).
+    """
+
+    # Longest window we accept, so a config typo can't stall every request for a PLC
+    max_window_ms = 1000
+
+    _windows = {}
+    _windows_lock = threading.Lock()
+
+    @classmethod
+    def get_tag_values(cls, plc_config: model_PlcList.PlcConfig, tag_list, fresh_plc_time=False):
+        """Read a list of tag values from the PLC, coalesced with other reads for the same PLC.
+        :param plc_config: a JSON object that has the properties id, ip, port, slot and coalesce_window_ms
+        :param tag_list: a list of tag names to get the values for (already filtered by the allow/disallow lists)
+        :param fresh_plc_time: if True, the PLC clock is read along with the tags (see plc_io.get_tag_values)
+        :return: A tuple with the list of values of the tags (inside a dictionary each), and the PLC time.
+        """
+        window_ms = min(int(plc_config.coalesce_window_ms or 0), cls.max_window_ms)
+        if window_ms <= 0:
+            return plc_io.get_tag_values(plc_config.id, plc_config.ip, plc_config.slot, plc_config.port, tag_list,
+                                         plc_config.connection_size, fresh_plc_time)
+
+        key = (plc_config.id, plc_config.ip, plc_config.port, plc_config.slot)
+        with cls._windows_lock:
+            window = cls._windows.get(key)
+            if window is None:
+                window = _PlcReadWindow()
+                cls._windows[key] = window
+
+        pending_read = _PendingRead(tag_list, fresh_plc_time)
+        with window.lock:
+            window.pending.append(pending_read)
+            opens_window = not window.is_open
+            if opens_window:
+                window.is_open = True
+
+        if not opens_window:
+            pending_read.done.wait()
+        else:
+            # Give other requests for this PLC a chance to join, then close the window and read for everyone
+            time.sleep(window_ms / 1000)
+            with window.lock:
+                batch = window.pending
+                window.pending = []
+                window.is_open = False
+            cls._read_for_batch(plc_config, batch)
+
+        if pending_read.error is not None:
+            raise Exception(f'{pending_read.error}') from pending_read.error
+        return pending_read.tag_values, pending_read.plc_time
+
+    @classmethod
+    def _read_for_batch(cls, plc_config: model_PlcList.PlcConfig, batch):
+        """Read the union of the tag lists in the batch and hand each caller its own values"""
+        # Union of the tag lists, without duplicates, in order of arrival
+        union_index = {}
+        for pending_read in batch:
+            for tag_name in pending_read.tag_list:
+                if tag_name not in union_index:
+                    union_index[tag_name] = len(union_index)
+        union_tag_list = list(union_index)
+        # If any caller wants a fresh PLC time, everyone gets one
+        fresh_plc_time = any(pending_read.fresh_plc_time for pending_read in batch)
+        shared_logger.log.debug(f'Coalesced {len(batch)} read(s) for plc_id="{plc_config.id}" '
+                                f'into one read of {len(union_tag_list)} tag(s)')
+
+        try:
+            tag_values, plc_time = plc_io.get_tag_values(plc_config.id, plc_config.ip, plc_config.slot,
+                                                         plc_config.port, union_tag_list, plc_config.connection_size,
+                                                         fresh_plc_time)
+            for pending_read in batch:
+                pending_read.plc_time = plc_time
+                if tag_values is not None:
+                    # The values come back in the order of union_tag_list
+                    pending_read.tag_values = [dict(tag_values[union_index[tag_name]])
+                                               for tag_name in pending_read.tag_list]
+        except Exception as e:
+            for pending_read in batch:
+                pending_read.error = e
+        finally:
+            for pending_read in batch:
+                pending_read.done.set()
@@ -0,0 +1,213 @@
+# Python dependencies
+import threading
+from collections import OrderedDict
+from pylogix.eip import parse_tag_name
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+# CIP data type codes (as PyLogix stores them in PLC.KnownTags) for the type names reported by GetTagList.
+# STRING is a structure on the wire, so PyLogix reads it as 0xa0.
+_TYPE_CODES = {
+    "BOOL": 0xc1,
+    "SINT": 0xc2,
+    "INT": 0xc3,
+    "DINT": 0xc4,
+    "LINT": 0xc5,
+    "USINT": 0xc6,
+    "UINT": 0xc7,
+    "UDINT": 0xc8,
+    "LWORD": 0xc9,
+    "REAL": 0xca,
+    "LREAL": 0xcb,
+    "DT": 0xc0,
+    "LDT": 0xcc,
+    "BYTE": 0xd1,
+    "WORD": 0xd2,
+    "DWORD": 0xd3,
+    "TIME32": 0xd6,
+    "TIME": 0xd7,
+    "LTIME": 0xdf,
+    "STRING": 0xa0,
+}
+
+# Size in bytes of a value of each type in a read reply
+_TYPE_SIZES = {
+    0xc1: 1, 0xc2: 1, 0xc3: 2, 0xc4: 4, 0xc5: 8, 0xc6: 1, 0xc7: 2, 0xc8: 4, 0xc9: 8, 0xca: 4, 0xcb: 8,
+    0xc0: 8, 0xcc: 8, 0xd1: 1, 0xd2: 2, 0xd3: 4, 0xd6: 4, 0xd7: 8, 0xdf: 8,
+    # A STRING reply carries the structure handle, the length and the 82 characters
+    0xa0: 80,
+}
+
+# Worst case value size, for tags we don't know the type of (UDTs, or no tag list yet). Same as PyLogix.
+_UNKNOWN_TYPE_SIZE = 88
+
+# Per tag overhead of a Read Tag service inside a Multi-Service packet (request and reply), plus the packet's
+# own header. These are the numbers PyLogix splits its multi-reads with, so that each planned chunk goes out
+# as exactly one packet.
+_TAG_OVERHEAD = 24
+_PACKET_OVERHEAD = 10
+
+# Connection size to plan with when we don't know the negotiated one (a Small Forward Open)
+default_connection_size = 504
+
+
+class ReadPlanner:
+    """
+    Splits a large tag list into the fewest Multi-Service packets that fit the PLC connection size.
+
+    The size of each tag's request and reply is estimated from the tag name length and its data type, taken from
+    the tag list of the PLC (see TagList, which registers every tag list it loads here). Tags are then packed
+    largest first into packets of at most the connection size (first fit decreasing). Tags that don't fit in a
+    packet on their own (large UDTs) get a packet each, which PyLogix reads with a fragmented read.
+    """
+
+    # plc_id -> the tag list dictionary of that PLC ({tag_name: {"type": "DINT"}, ...})
+    _tag_types = {}
+    # plc_id -> the member types of the UDTs of that PLC ({udt_name: {member_name: "DINT"}, ...})
+    _udt_types = {}
+    # plc_id -> incremented each time a new tag list is registered, so plans made with the old one are rebuilt
+    _tag_types_versions = {}
+    _tag_types_lock = threading.Lock()
+
+    # Recently made plans, since the same tag lists (batches, dashboards) are read over and over
+    plan_cache_size = 256
+    _plan_cache = OrderedDict()
+    _plan_cache_lock = threading.Lock()
+
+    @classmethod
+    def update_tag_types(cls, plc_id, tag_list, udt_types=None):
+        """Register the tag list (tag names and types) of a PLC, to plan its reads with.
+        :param plc_id: The ID of the PLC
+        :param tag_list: the tag list dictionary, as returned by TagList.get_tag_list
+        :param udt_types: optional, the member types of the UDTs of the PLC
+        """
+        if not tag_list:
+            return
+        with cls._tag_types_lock:
+            if cls._tag_types.get(plc_id) is not tag_list:
+                cls._tag_types[plc_id] = tag_list
+                cls._udt_types[plc_id] = udt_types or {}
+                cls._tag_types_versions[plc_id] = cls._tag_types_versions.get(plc_id, 0) + 1
+
+    @classmethod
+    def get_tag_types(cls, plc_id):
+        """
+        Get the tag list registered for a PLC.
+        :param plc_id: The ID of the PLC
+        :return: a tuple of (the tag list dictionary or None, its version). The version changes whenever a new tag
+            list is registered.
+        """
+        with cls._tag_types_lock:
+            return cls._tag_types.get(plc_id), cls._tag_types_versions.get(plc_id, 0)
+
+    @classmethod
+    def get_udt_types(cls, plc_id):
+        """
+        Get the UDT member types registered with the tag list of a PLC.
+        :param plc_id: The ID of the PLC
+        :return: a dictionary of {udt_name: {member_name: data_type}}, empty if none were registered
+        """
+        with cls._tag_types_lock:
+            return cls._udt_types.get(plc_id, {})
+
+    @classmethod
+    def plan(cls, plc_id, tag_list, packet_size=None):
+        """Split a tag list into chunks that each fit in one Multi-Service packet.
+        :param plc_id: The ID of the PLC
+        :param tag_list: the list of tag names to read
+        :param packet_size: the largest packet to plan (bytes). The connection size of the PLC session, or the
+            smaller chunk size learned for the PLC (see ReadChunkTuner).
+        :return: a list of chunks, each a list of indexes into tag_list
+
+        Plans are cached by PLC, tag list version, packet size and tag list, so a tag list that is read over and
+        over is only planned once (until its PLC gets a new tag list). The sizes are estimated from the registered
+        tag list only (not from the types a PyLogix session has learned), so a cached plan is the plan any
+        session would make.
+        """
+        cache_key = (plc_id, cls._tag_types_versions.get(plc_id, 0), packet_size, tuple(tag_list))
+        with cls._plan_cache_lock:
+            chunks = cls._plan_cache.get(cache_key)
+            if chunks is not None:
+                cls._plan_cache.move_to_end(cache_key)
+                return chunks
+
+        chunks = cls._make_plan(plc_id, tag_list, packet_size)
+        with cls._plan_cache_lock:
+            cls._plan_cache[cache_key] = chunks
+            while len(cls._plan_cache) > cls.plan_cache_size:
+                cls._plan_cache.popitem(last=False)
+        return chunks
+
+    @classmethod
+    def _make_plan(cls, plc_id, tag_list, packet_size):
+        """Plan a tag list (see plan())"""
+        capacity = (packet_size or default_connection_size) - _PACKET_OVERHEAD
+        tag_types = cls._tag_types.get(plc_id, {})
+
+        sizes = []
+        for tag_name in tag_list:
+            _, base_tag, _ = parse_tag_name(tag_name)
+            sizes.append(_TAG_OVERHEAD + len(base_tag) + cls._value_size(tag_types, tag_name, base_tag))
+
+        # First fit decreasing: place each tag, largest first, in the first packet with room left for it
+        chunks = []
+        room_left = []
+        for index in sorted(range(len(tag_list)), key=lambda i: sizes[i], reverse=True):
+            size = sizes[index]
+            for chunk_no, room in enumerate(room_left):
+                if size <= room:
+                    chunks[chunk_no].append(index)
+                    room_left[chunk_no] = room - size
+                    break
+            else:
+                chunks.append([index])
+                room_left.append(capacity - size)
+
+        # Read each chunk in the order of the original list, which keeps the PLC's view predictable
+        for chunk in chunks:
+            chunk.sort()
+        chunks.sort(key=lambda chunk: chunk[0])
+        return chunks
+
+    @classmethod
+    def prime_known_tags(cls, comm, plc_id, tag_list):
+        """
+        Tell a PyLogix session the data types we already know from the tag list, so it doesn't have to read each
+        new tag once on its own to learn its type. Tags the session has already read are left alone.
+        :param comm: the PyLogix PLC session
+        :param plc_id: The ID of the PLC
+        :param tag_list: the list of tag names about to be read
+        """
+        tag_types = cls._tag_types.get(plc_id)
+        if not tag_types:
+            return
+        for tag_name in tag_list:
+            _, base_tag, _ = parse_tag_name(tag_name)
+            if base_tag in comm.KnownTags:
+                continue
+            type_code = cls._type_code(tag_types, tag_name, base_tag)
+            if type_code is not None:
+                comm.KnownTags[base_tag] = (type_code, 0)
+
+    @classmethod
+    def _type_code(cls, tag_types, tag_name, base_tag):
+        """The CIP type code of a tag, or None if unknown (not in the tag list, UDT or member of one)"""
+        tag_info = tag_types.get(base_tag)
+        if tag_info is None:
+            return None
+        type_code = _TYPE_CODES.get(tag_info.get("type"))
+        # BOOL arrays are read 32 bits at a time, so let PyLogix learn their type from the PLC
+        if type_code == 0xc1 and tag_name.endswith("]"):
+            return None
+        return type_code
+
+    @classmethod
+    def _value_size(cls, tag_types, tag_name, base_tag):
+        """The size in bytes of the value of a tag in a read reply"""
+        type_code = cls._type_code(tag_types, tag_name, base_tag)
+        if type_code is None:
+            return _UNKNOWN_TYPE_SIZE
+        return _TYPE_SIZES[type_code]
@@ -0,0 +1,207 @@
+# Python dependencies
+import gzip
+import os
+import threading
+from collections import OrderedDict
+
+# Brotli is optional: without it, responses are only compressed with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class _CachedResponse:
+    """A helper class to store the body of one response, in each encoding asked for so far"""
+    __slots__ = ("version", "bodies", "size")
+
+    def __init__(self, version, body):
+        self.version = version
+        # encoding ("identity", "gzip" or "br") -> bytes
+        self.bodies = {"identity": body}
+        self.size = len(body)
+
+
+class ResponseCache:
+    """
+    An in-memory cache of serialized (and compressed) response bodies, for responses that are the same for every
+    client until the data they're made of changes: whole tag lists and scanned batches.
+    Supports a singleton pattern so that only one instance is created!
+
+    Each response is kept under a key along with the version of its data. A request for the same version is
+    answered with the bytes kept, so it costs neither serialization nor compression. A new version replaces the
+    old one. The compressed bodies are made the first time an encoding is asked for. Memory is bounded by
+    max_bytes across all responses, evicting the least recently used first.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    # Defaults. These can be changed with configure() (see the server.py command line arguments.)
+    max_bytes = 64 * 1024 * 1024
+    # Bodies smaller than this aren't worth compressing
+    min_compress_size = 1024
+    gzip_level = 6
+    # Brotli's maximum quality (11) takes seconds for a large tag list, this is close to gzip's speed
+    brotli_quality = 5
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(ResponseCache, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._entries = OrderedDict()
+            cls._instance._size = 0
+            # key -> the version of the response that is too large to cache
+            cls._instance._too_large = {}
+            # key -> (version, threading.Event) of the response being serialized or compressed by a thread
+            cls._instance._pending = {}
+        return cls._instance
+
+    def configure(self, max_bytes=None):
+        """
+        Change the cache settings.
+        :param max_bytes: the maximum number of bytes of response bodies kept (0 disables the cache)
+        """
+        if max_bytes is not None:
+            self.max_bytes = max(0, int(max_bytes))
+            with self._lock:
+                self._too_large.clear()
+                self._evict()
+
+    def is_enabled(self):
+        """Return True if responses are cached"""
+        return self.max_bytes > 0
+
+    def get_body(self, key, version, accept_encoding, serialize):
+        """
+        Get the body of a response, in the best encoding the client accepts.
+        :param key: identifies the response, i.e. ("tag_list", plc_id)
+        :param version: the version of the data of the response, a tuple of plain values (str, int, float) that
+            changes whenever the data does
+        :param accept_encoding: the Accept-Encoding header of the request (None if there's none)
+        :param serialize: a function that returns the body (bytes), called if this version isn't cached yet
+        :return: a tuple of (the body, its encoding: "identity", "gzip" or "br"), or None if this version of the
+            response is too large to cache, in which case the caller should respond without the cache (i.e. stream
+            it)
+
+        Only one thread at a time serializes or compresses a response, the others asking for it wait and then get
+        it from the cache.
+        """
+        encoding = self.choose_encoding(accept_encoding)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.version == version:
+                    self._entries.move_to_end(key)
+                    body = entry.bodies.get(encoding)
+                    if body is not None:
+                        return body, encoding
+                    if len(entry.bodies["identity"]) < self.min_compress_size:
+                        return entry.bodies["identity"], "identity"
+                else:
+                    entry = None
+                if self._too_large.get(key) == version:
+                    return None
+                pending = self._pending.get(key)
+                if pending is None or pending[0] != version:
+                    # This thread makes the body, the others asking for this version wait for it
+                    event = threading.Event()
+                    self._pending[key] = (version, event)
+                    break
+            pending[1].wait()
+
+        try:
+            if entry is None:
+                identity = serialize()
+                entry = _CachedResponse(version, identity)
+            else:
+                identity = entry.bodies["identity"]
+            if len(identity) < self.min_compress_size:
+                encoding = "identity"
+            body = identity if encoding == "identity" else self._compress(identity, encoding)
+
+            with self._lock:
+                if encoding not in entry.bodies:
+                    entry.bodies[encoding] = body
+                    entry.size += len(body)
+                    if self._entries.get(key) is entry:
+                        self._size += len(body)
+                self._put(key, entry)
+            return body, encoding
+        finally:
+            with self._lock:
+                if self._pending.get(key) == (version, event):
+                    del self._pending[key]
+            event.set()
+
+    @classmethod
+    def choose_encoding(cls, accept_encoding):
+        """
+        Choose the encoding of a response from the Accept-Encoding header of the request.
+        :param accept_encoding: the Accept-Encoding header (None if there's none)
+        :return: "br" or "gzip" if the client accepts it (br first, if Brotli is installed), else "identity"
+        """
+        accepted = set()
+        for coding in (accept_encoding or "").split(","):
+            name, _, parameters = coding.partition(";")
+            quality = parameters.strip()
+            if quality.startswith("q="):
+                try:
+                    if float(quality[2:]) <= 0:
+                        continue
+                except ValueError:
+                    continue
+            accepted.add(name.strip().lower())
+        if brotli is not None and ("br" in accepted or "*" in accepted):
+            return "br"
+        if "gzip" in accepted or "*" in accepted:
+            return "gzip"
+        return "identity"
+
+    def _compress(self, body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        # No timestamp in the header, so every worker makes the same bytes
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def _put(self, key, entry):
+        """
+        Add or replace an entry (holding self._lock). An entry larger than the whole cache (with all its encodings
+        so far) isn't kept, and its version is remembered as too large, so it isn't serialized again.
+        """
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= previous.size
+        if entry.size > self.max_bytes:
+            self._too_large[key] = entry.version
+            return
+        self._too_large.pop(key, None)
+        self._entries[key] = entry
+        self._size += entry.size
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries (holding self._lock) until the cache fits max_bytes"""
+        while self._entries and self._size > self.max_bytes:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+
+
+def _reset_response_cache_after_fork():
+    """
+    The lock may have been held by another thread at the time of the fork, and that thread's pending responses
+    won't be finished in the child. The cached responses are still good.
+    """
+    if ResponseCache._instance is not None:
+        ResponseCache._instance._lock = threading.Lock()
+        ResponseCache._instance._pending = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_response_cache_after_fork)
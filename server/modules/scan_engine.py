@@ -0,0 +1,291 @@
+# Python dependencies
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Import our own dependencies
+from controller_get_tag_value import TagValue
+import model_PlcList
+import utils
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+class _ScanSnapshot:
+    """A helper class to store the result of one scan of a group of tags"""
+
+    def __init__(self, tag_values, plc_time, read_time, error=None):
+        # tag_values is None if the scan failed (in which case error is set)
+        self.tag_values = tag_values
+        self.plc_time = plc_time
+        # unix timestamp (server clock) of when the values were read
+        self.read_time = read_time
+        self.read_monotonic = time.monotonic()
+        self.error = error
+
+    def get_age(self):
+        """Return the age of the snapshot in seconds"""
+        return time.monotonic() - self.read_monotonic
+
+    def get_tag_values(self, tag_list):
+        """
+        Return copies of the values of the tags in tag_list, in its order (an ad-hoc group reads each tag once, in
+        sorted order, whatever the order of the request). Tags not read, i.e. excluded by the PLC config, are left out.
+        Copies, since the snapshot is shared between requests.
+        """
+        tag_values_by_name = {tag_value['tag_name']: tag_value for tag_value in self.tag_values}
+        return [dict(tag_values_by_name[tag_name]) for tag_name in tag_list if tag_name in tag_values_by_name]
+
+
+class _ScanGroup:
+    """A helper class to store a group of tags that is scanned at a fixed rate"""
+
+    def __init__(self, key, plc_config, tag_list, scan_rate, ad_hoc=False):
+        self.key = key
+        self.plc_config = plc_config
+        self.tag_list = tag_list
+        self.scan_rate = scan_rate  # milliseconds
+        self.ad_hoc = ad_hoc
+        self.next_due = time.monotonic()
+        self.last_requested = time.monotonic()
+        self.scanning = False
+        self.snapshot = None
+
+
+class ScanEngine:
+    """
+    A background scheduler that reads groups of tags from the PLCs at a configured rate and keeps the latest
+    values in memory. Supports a singleton pattern so that only one instance is created!
+
+    There are two kinds of groups:
+    - Batches with a scan_rate in the config. These are scanned for as long as the server runs.
+    - Ad-hoc groups, created when a /get_tag_value request passes a scan_rate. These are scanned until no
+      request has asked for them for ad_hoc_idle_timeout seconds.
+
+    Either way, the PLC sees one read per group per scan_rate, no matter how many clients ask for the values.
+
+    Since clients pick the scan_rate of ad-hoc groups, they're kept from reading a PLC more than its config allows:
+    the scan_rate is no faster than the PLC's rate_limit, the same tags (in any order, repeated or not) make one
+    group, and there are at most max_ad_hoc_groups_per_plc groups per PLC.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    min_scan_rate = 100  # milliseconds, the fastest scan rate we accept
+    max_ad_hoc_groups_per_plc = 20
+    ad_hoc_idle_timeout = 60  # seconds
+    scan_threads = 8
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(ScanEngine, cls).__new__(cls)
+            cls._instance._groups = {}
+            cls._instance._reset_threads()
+        return cls._instance
+
+    def _reset_threads(self):
+        """Forget the scheduler thread (threads don't survive a fork) and any in-flight scans"""
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._stop_event = threading.Event()
+        for group in self._groups.values():
+            group.scanning = False
+
+    def add_batches(self, batch_list, plc_list: model_PlcList):
+        """
+        Register every batch that has a scan_rate.
+        :param batch_list: the list of batch configs
+        :param plc_list: the list of PLC configs
+        """
+        for batch_config in batch_list:
+            if not batch_config.scan_rate:
+                continue
+            plc_config = plc_list.get(batch_config.plc_id)
+            if plc_config is None:
+                shared_logger.log.error(f'Not scanning tag_batch_id="{batch_config.id}": '
+                                        f'plc_id="{batch_config.plc_id}" not found in the config.')
+                continue
+            scan_rate = max(self.min_scan_rate, int(batch_config.scan_rate))
+            key = ("batch", batch_config.id)
+            with self._condition:
+                self._groups[key] = _ScanGroup(key, plc_config, batch_config.tag_list, scan_rate)
+            shared_logger.log.info(f'Scanning tag_batch_id="{batch_config.id}" every {scan_rate} ms')
+
+    def start(self):
+        """Start the scheduler thread (once per process)"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.scan_threads, thread_name_prefix="scan-worker")
+            self._thread = threading.Thread(target=self._scheduler_loop, name="scan-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread"""
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def is_stopped(self):
+        """Return True once stop() was called"""
+        return self._stop_event.is_set()
+
+    def is_batch_scanned(self, batch_id):
+        """Return True if the batch has a scan_rate (i.e. is served from memory)"""
+        return ("batch", batch_id) in self._groups
+
+    def get_batch_snapshot(self, batch_id):
+        """
+        Return the latest snapshot of a scanned batch.
+        :param batch_id: the batch ID
+        :return: the latest _ScanSnapshot, or None if the batch is not scanned or has not been scanned yet
+        """
+        group = self._groups.get(("batch", batch_id))
+        if group is None:
+            return None
+        group.last_requested = time.monotonic()
+        return group.snapshot
+
+    def get_tag_snapshot(self, plc_config: model_PlcList.PlcConfig, tag_list, scan_rate):
+        """
+        Return the latest snapshot of an ad-hoc group of tags, registering the group if it's new.
+        :param plc_config: the PLC config
+        :param tag_list: the list of tag names
+        :param scan_rate: the requested scan rate in milliseconds
+        :return: the latest _ScanSnapshot, or None if the group has not been scanned yet (or can't be added)
+        """
+        with self._condition:
+            group = self._get_ad_hoc_group(plc_config, tag_list, scan_rate)
+            if group is None:
+                return None
+            group.last_requested = time.monotonic()
+            return group.snapshot
+
+    def wait_for_batch_snapshot(self, batch_id, previous, timeout):
+        """
+        Wait for a scan of a scanned batch newer than the one a subscriber already has.
+        :param batch_id: the batch ID
+        :param previous: the _ScanSnapshot the subscriber already has (None for none)
+        :param timeout: the maximum number of seconds to wait
+        :return: the latest _ScanSnapshot, which is previous if there was no new scan in time (or None if the batch
+            is not scanned)
+        """
+        with self._condition:
+            group = self._groups.get(("batch", batch_id))
+            if group is None:
+                return None
+            return self._wait_for_snapshot(group, previous, timeout)
+
+    def wait_for_tag_snapshot(self, plc_config: model_PlcList.PlcConfig, tag_list, scan_rate, previous, timeout):
+        """
+        Wait for a scan of an ad-hoc group of tags newer than the one a subscriber already has, registering the
+        group if it's new (or was dropped). Waiting counts as a request, so the group keeps being scanned for as long
+        as someone waits on it.
+        :param plc_config: the PLC config
+        :param tag_list: the list of tag names
+        :param scan_rate: the requested scan rate in milliseconds
+        :param previous: the _ScanSnapshot the subscriber already has (None for none)
+        :param timeout: the maximum number of seconds to wait
+        :return: the latest _ScanSnapshot, which is previous if there was no new scan in time
+        :raises Exception: if the group can't be added (max_ad_hoc_groups_per_plc reached)
+        """
+        with self._condition:
+            group = self._get_ad_hoc_group(plc_config, tag_list, scan_rate)
+            if group is None:
+                raise Exception(f'max_ad_hoc_groups_per_plc={self.max_ad_hoc_groups_per_plc} reached')
+            return self._wait_for_snapshot(group, previous, timeout)
+
+    def _wait_for_snapshot(self, group: _ScanGroup, previous, timeout):
+        """Wait (holding self._condition) until group has a snapshot other than previous, or the timeout"""
+        self._condition.wait_for(lambda: group.snapshot is not previous or self._stop_event.is_set(), timeout)
+        group.last_requested = time.monotonic()
+        return group.snapshot
+
+    def _get_ad_hoc_group(self, plc_config: model_PlcList.PlcConfig, tag_list, scan_rate):
+        """Return the ad-hoc group of tags (holding self._condition), adding it if it's new. None if it can't be."""
+        # No faster than the PLC's rate limit allows
+        scan_rate = max(self.min_scan_rate, int(scan_rate), utils.get_rate_limit_interval_ms(plc_config.rate_limit))
+        tag_list = tuple(sorted(set(tag_list)))
+        key = ("ad_hoc", plc_config.id, tag_list, scan_rate)
+        group = self._groups.get(key)
+        if group is None:
+            ad_hoc_count = sum(1 for g in self._groups.values() if g.ad_hoc and g.plc_config.id == plc_config.id)
+            if ad_hoc_count >= self.max_ad_hoc_groups_per_plc:
+                shared_logger.log.warning(f'Not scanning ad-hoc tag group for plc_id="{plc_config.id}": '
+                                          f'max_ad_hoc_groups_per_plc={self.max_ad_hoc_groups_per_plc} reached.')
+                return None
+            group = _ScanGroup(key, plc_config, list(tag_list), scan_rate, ad_hoc=True)
+            self._groups[key] = group
+            shared_logger.log.info(f'Scanning ad-hoc tag group for plc_id="{plc_config.id}" '
+                                   f'every {scan_rate} ms')
+            self._condition.notify_all()
+        return group
+
+    def _scheduler_loop(self):
+        """Dispatch due groups to the scan threads, then sleep until the next group is due"""
+        while not self._stop_event.is_set():
+            with self._condition:
+                now = time.monotonic()
+                next_due = now + 1
+                for key, group in list(self._groups.items()):
+                    # Drop ad-hoc groups nobody asked for in a while
+                    if group.ad_hoc and now - group.last_requested > self.ad_hoc_idle_timeout:
+                        del self._groups[key]
+                        shared_logger.log.info(f'Stopped scanning idle ad-hoc tag group for '
+                                               f'plc_id="{group.plc_config.id}"')
+                        continue
+                    if group.scanning:
+                        continue
+                    if group.next_due <= now:
+                        group.scanning = True
+                        self._executor.submit(self._scan, group)
+                    else:
+                        next_due = min(next_due, group.next_due)
+                self._condition.wait(max(0.0, next_due - now))
+
+    def _scan(self, group: _ScanGroup):
+        """Read one group from the PLC and store the snapshot"""
+        started = time.monotonic()
+        try:
+            tag_values, plc_time = TagValue.get_tag_values(group.plc_config, group.tag_list)
+            read_time = time.time()
+            if tag_values is None:
+                snapshot = _ScanSnapshot(None, None, read_time,
+                                         error=f'tag values not available for plc_id="{group.plc_config.id}"')
+            else:
+                # Stamp each value with the time it was read, so responses can show the age of each value
+                for tag_value in tag_values:
+                    tag_value['read_time'] = read_time
+                snapshot = _ScanSnapshot(tag_values, plc_time, read_time)
+        except Exception as e:
+            shared_logger.log.error(f'ScanEngine | scan | {e}')
+            snapshot = _ScanSnapshot(None, None, time.time(), error=f'{e}')
+
+        with self._condition:
+            group.snapshot = snapshot
+            group.scanning = False
+            # Keep to the schedule, but don't try to catch up on missed scans if the read was slow
+            group.next_due = max(group.next_due + group.scan_rate / 1000, time.monotonic())
+            self._condition.notify_all()
+        shared_logger.log.debug(f'ScanEngine | scanned {group.key} in {(time.monotonic() - started) * 1000:.1f} ms')
+
+
+def _reset_scan_engine_after_fork():
+    """A forked worker starts its own scheduler thread (see ScanEngine.start)"""
+    if ScanEngine._instance is not None:
+        ScanEngine._instance._reset_threads()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_scan_engine_after_fork)
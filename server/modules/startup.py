@@ -9,6 +9,10 @@ import model_PlcList
 from model_PlcList import PlcList
 import model_BatchList
 from model_BatchList import BatchList
+from scan_engine import ScanEngine
+from read_chunk_tuner import ReadChunkTuner
+from batch_read_plan import BatchReadPlans
+from tag_list_discovery import TagListDiscovery
 
 # Load the shared logger
 import modules.logger as logger
@@ -21,11 +25,17 @@ class Startup:
     """
 
     @classmethod
-    def start(cls, config_file_path, cache_directory, cache_ttl):
+    def start(cls, config_file_path, cache_directory, cache_ttl, discovery_threads=None, discovery_deadline=None,
+              stale_while_revalidate=None, cache_format=None):
         """Prepare dependencies for the server.
         :param config_file_path: the path to the config file
         :param cache_directory: the directory to store the tag list cache files
         :param cache_ttl: the time-to-live (in minutes) for the tag list cache files
+        :param discovery_threads: the number of PLCs whose tag list is discovered at the same time
+        :param discovery_deadline: the number of seconds startup waits for tag list discovery (the PLCs that take
+            longer keep being discovered in the background)
+        :param stale_while_revalidate: whether expired tag lists are served while they're refreshed in the background
+        :param cache_format: the format of the tag list cache files ("json" or "binary")
         :return: a tuple of (plc_list, tag_list_instance)
         """
 
@@ -35,21 +45,14 @@ class Startup:
         tag_list_instance = None
 
         # each PLC will cache its tag list in a file in this cache_directory
-        # so on startup, if the cache_directory exists, remove all files. otherwise, create it
-        if os.path.exists(cache_directory):
-            werefiles = 0
-            for filename in os.listdir(cache_directory):
-                file_path = os.path.join(cache_directory, filename)
-                # Check if the current path is a file
-                if os.path.isfile(file_path):
-                    # Delete the file
-                    os.remove(file_path)
-                    werefiles = werefiles + 1
-            if werefiles > 0:
-                shared_logger.log.info("plc_tag_cache was cleared")
-        else:
+        # the files are kept across restarts (they're checked against each PLC during discovery below), so on
+        # startup only create the cache_directory if it doesn't exist
+        if not os.path.exists(cache_directory):
             os.mkdir(cache_directory)
 
+        # Learned read chunk sizes live in a subdirectory of the cache
+        ReadChunkTuner().configure(cache_directory)
+
         # load the config for PLC identification
         if os.path.exists(config_file_path):
             # Read cached data from file
@@ -65,18 +68,20 @@ class Startup:
 
         try:
             # Create an instance of the Tag List
-            tag_list_instance = TagList(cache_directory, cache_ttl)
-
-            # for each PLC, retrieve and cache tags
-            # this might fail for some, not others, so we try/catch individually
-            for plc_config in plc_list:
-                try:
-                    shared_logger.log.debug(f'Getting tag list for {plc_config}')
-                    # In this case, this gets called for the side effect on the instance
-                    # i.e. loads the tag list cache for each PLC.
-                    tag_list_instance.get_tag_list(plc_config)
-                except Exception as e:
-                    shared_logger.log.error(f'On Startup, error getting tag list: {e}')
+            tag_list_instance = TagList(cache_directory, cache_ttl, stale_while_revalidate, cache_format)
+
+            # Remove the cache files of PLCs that are no longer in the config
+            cls.remove_unused_cache_files(tag_list_instance, plc_list)
+
+            # for each PLC, retrieve and cache tags, several PLCs at a time and within the discovery deadline
+            # this might fail for some, not others, which is logged per PLC
+            TagListDiscovery.discover(tag_list_instance, plc_list, discovery_threads, discovery_deadline)
+
+            # Resolve each batch into its read plan now that the tag lists are loaded
+            BatchReadPlans().build(batch_list)
+
+            # Register the batches that are scanned in the background. Scanning starts with ScanEngine().start()
+            ScanEngine().add_batches(batch_list, plc_list)
 
             # Log and return the useful objects
             shared_logger.log.info("Startup finished")
@@ -85,3 +90,25 @@ class Startup:
         except Exception as e:
             shared_logger.log.error(f'Startup error: {e}')
             return plc_list, tag_list_instance, batch_list
+
+    @classmethod
+    def remove_unused_cache_files(cls, tag_list_instance, plc_list):
+        """Remove the files in the cache directory that don't belong to a PLC in the config.
+        :param tag_list_instance: the TagList that caches the tag lists
+        :param plc_list: the list of PLC configs
+        """
+        used_files = set()
+        for plc_config in plc_list:
+            used_files.add(tag_list_instance.get_cache_file_path(plc_config.id))
+            used_files.add(tag_list_instance.get_meta_cache_file_path(plc_config.id))
+
+        werefiles = 0
+        for filename in os.listdir(tag_list_instance.cache_directory):
+            file_path = os.path.join(tag_list_instance.cache_directory, filename)
+            # Check if the current path is a file (subdirectories hold other state)
+            if os.path.isfile(file_path) and file_path not in used_files:
+                # Delete the file
+                os.remove(file_path)
+                werefiles = werefiles + 1
+        if werefiles > 0:
+            shared_logger.log.info(f"plc_tag_cache: removed {werefiles} unused file(s)")
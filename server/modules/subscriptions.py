@@ -0,0 +1,215 @@
+# Python dependencies
+import math
+import os
+import threading
+import time
+
+# Import our own dependencies
+from scan_engine import ScanEngine
+from json_media import JsonMedia
+import model_PlcList
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+def _is_number(value):
+    """True for int and float values (but not bool, which only ever changes, it has no deadband)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _Subscription:
+    """
+    A helper class for one client's stream of Server-Sent Events (see Subscriptions.open).
+
+    Iterating generates the events: the first "update" has every tag, later ones only the tags whose value changed
+    (by more than the deadband, for numbers) or whose read started or stopped failing. A comment line is sent when
+    nothing changed for a while, which keeps proxies from timing out the connection and lets the server notice
+    clients that went away.
+    """
+
+    def __init__(self, subscriptions, plc_config: model_PlcList.PlcConfig, tag_list, tag_lists, interval_ms,
+                 deadband=None, batch_id=None):
+        self._subscriptions = subscriptions
+        self.plc_config = plc_config
+        self.tag_list = tag_list
+        self.tag_lists = tag_lists
+        self.interval_ms = interval_ms
+        self.deadband = deadband or 0
+        # Set for a batch with a scan_rate, which is followed at its own scan rate
+        self.batch_id = batch_id
+        self._last_values = {}
+        self._tag_types = {}
+        self._last_error = None
+        self._closed = False
+
+    def __iter__(self):
+        return self._generate_events()
+
+    def close(self):
+        """Called by the WSGI server when the response ends (or the client went away). Frees the slot."""
+        if not self._closed:
+            self._closed = True
+            self._subscriptions._release()
+
+    def wait_for_snapshot(self, previous, timeout):
+        """Wait for the next scan of the tags (see ScanEngine). Return previous if there was none in time."""
+        if self.batch_id is not None:
+            return ScanEngine().wait_for_batch_snapshot(self.batch_id, previous, timeout)
+        return ScanEngine().wait_for_tag_snapshot(self.plc_config, self.tag_list, self.interval_ms, previous,
+                                                  timeout)
+
+    def _generate_events(self):
+        scan_engine = ScanEngine()
+        keepalive_interval = self._subscriptions.keepalive_interval
+        snapshot = None
+        last_sent = time.monotonic()
+        while not self._closed and not scan_engine.is_stopped():
+            try:
+                latest = self.wait_for_snapshot(snapshot, max(0.0, last_sent + keepalive_interval - time.monotonic()))
+            except Exception as e:
+                yield self._format_event("error", {'error': f'{e}'})
+                return
+            event = None
+            if latest is not None and latest is not snapshot:
+                snapshot = latest
+                event = self._get_event(snapshot)
+            if event is not None:
+                yield event
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= keepalive_interval:
+                yield b': keepalive\n\n'
+                last_sent = time.monotonic()
+
+    def _get_event(self, snapshot):
+        """Return the event for a new scan of the tags, or None if there's nothing new to send"""
+        if snapshot.tag_values is None:
+            if snapshot.error == self._last_error:
+                return None
+            self._last_error = snapshot.error
+            return self._format_event("error", {'error': f'tag values not available for '
+                                                        f'plc_id="{self.plc_config.id}"! {snapshot.error}'})
+        self._last_error = None
+
+        changed = [tag_value for tag_value in snapshot.tag_values if self._is_changed(tag_value)]
+        if not changed:
+            return None
+        for tag_value in changed:
+            self._last_values[tag_value['tag_name']] = (tag_value['success'], tag_value['value'])
+        return self._format_event("update", {
+            'tag_values': self._with_tag_types(changed),
+            'plc_time': snapshot.plc_time.timestamp()  # convert to unix timestamp
+        })
+
+    def _is_changed(self, tag_value):
+        """Return True if a tag value has to be sent (see the class docstring)"""
+        last = self._last_values.get(tag_value['tag_name'])
+        if last is None:
+            return True
+        last_success, last_value = last
+        value = tag_value['value']
+        if tag_value['success'] != last_success:
+            return True
+        if _is_number(value) and _is_number(last_value):
+            if math.isnan(value) or math.isnan(last_value):
+                return math.isnan(value) != math.isnan(last_value)
+            if self.deadband:
+                return abs(value - last_value) > self.deadband
+        return value != last_value
+
+    def _with_tag_types(self, tag_values):
+        """Copy the tag values (the snapshot is shared between subscribers) and add the tag type to each"""
+        missing = [tag_value['tag_name'] for tag_value in tag_values
+                   if tag_value['tag_name'] not in self._tag_types]
+        if missing:
+            self._tag_types.update(self.tag_lists.get_tag_types(self.plc_config, missing))
+        return [dict(tag_value, tag_type=self._tag_types.get(tag_value['tag_name'], "")) for tag_value in tag_values]
+
+    @classmethod
+    def _format_event(cls, event, data):
+        # JSON has no raw newlines, so the data is always a single data line
+        return f'event: {event}\ndata: '.encode('utf-8') + JsonMedia.dumps(data) + b'\n\n'
+
+
+class Subscriptions:
+    """
+    The change-of-value subscriptions of this process, streamed to their clients as Server-Sent Events.
+    Supports a singleton pattern so that only one instance is created!
+
+    A subscription doesn't read the PLC itself: it follows a scan group of the ScanEngine (its batch's, for a batch
+    with a scan_rate, or an ad-hoc group of its tags at its interval), so all the subscribers to the same tags at the
+    same interval share one read per interval, and each only gets what changed for it.
+
+    Each open subscription holds one request thread for as long as its client stays connected, so they're limited
+    to max_subscriptions per process.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    # Defaults. These can be changed with configure() (see the server.py command line arguments.)
+    max_subscriptions = 4
+    keepalive_interval = 15  # seconds
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(Subscriptions, cls).__new__(cls)
+            cls._instance._reset()
+        return cls._instance
+
+    def _reset(self):
+        """Forget the open subscriptions (a forked worker has none)"""
+        self._lock = threading.Lock()
+        self._open_count = 0
+
+    def configure(self, max_subscriptions=None, keepalive_interval=None):
+        """
+        Change the subscription settings.
+        :param max_subscriptions: the maximum number of subscriptions open at the same time in this process
+        :param keepalive_interval: the seconds without changes after which a keepalive comment is sent
+        """
+        if max_subscriptions is not None:
+            self.max_subscriptions = max(0, int(max_subscriptions))
+        if keepalive_interval is not None:
+            self.keepalive_interval = max(1, int(keepalive_interval))
+
+    def open(self, plc_config: model_PlcList.PlcConfig, tag_list, tag_lists, interval_ms, deadband=None,
+             batch_id=None):
+        """
+        Open a subscription.
+        :param plc_config: the PLC config
+        :param tag_list: the list of tag names
+        :param tag_lists: the TagList, for the tag types
+        :param interval_ms: the sampling interval in milliseconds (not used for batches with a scan_rate)
+        :param deadband: the minimum change of a numeric value that is sent (None or 0 for any change)
+        :param batch_id: the batch ID, if the subscription is to a batch with a scan_rate
+        :return: the _Subscription, to use as the response stream, or None if max_subscriptions are already open
+        """
+        with self._lock:
+            if self._open_count >= self.max_subscriptions:
+                return None
+            self._open_count += 1
+        shared_logger.log.info(f'Subscription opened for plc_id="{plc_config.id}" ({self._open_count} open)')
+        return _Subscription(self, plc_config, tag_list, tag_lists, interval_ms, deadband, batch_id)
+
+    def _release(self):
+        with self._lock:
+            self._open_count -= 1
+        shared_logger.log.info(f'Subscription closed ({self._open_count} open)')
+
+
+def _reset_subscriptions_after_fork():
+    """A forked worker starts with no open subscriptions"""
+    if Subscriptions._instance is not None:
+        Subscriptions._instance._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_subscriptions_after_fork)
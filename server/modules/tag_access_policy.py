@@ -0,0 +1,80 @@
+# Python dependencies
+import re
+from functools import lru_cache
+
+
+class TagAccessPolicy:
+    """
+    The allow/exclude rules of a PLC config, compiled once so filtering a request's tag list is cheap.
+
+    allow_tags/exclude_tags take precedence over allow_tags_regex/exclude_tags_regex (the same rules as the config
+    file documents):
+    - allow_tags and exclude_tags are turned into sets, so each tag is a constant time lookup.
+    - allow_tags_regex and exclude_tags_regex are compiled once, and the decision for each tag name is kept in an
+      LRU cache, since clients keep asking for the same tags.
+    """
+
+    # Number of per-tag decisions remembered for regex rules
+    decision_cache_size = 10000
+
+    def __init__(self, allow_tags=None, exclude_tags=None, allow_tags_regex=None, exclude_tags_regex=None):
+        """
+        :param allow_tags: explicit tag names to allow (all if empty)
+        :param exclude_tags: explicit tag names to exclude
+        :param allow_tags_regex: regex a tag name must match (from its start) to be allowed
+        :param exclude_tags_regex: regex of the tag names (matched from their start) to exclude
+        """
+        self._allowed_tags = None
+        self._exclude_tags = None
+        self._allow_regex = None
+        self._exclude_regex = None
+        self._is_allowed = None
+
+        if allow_tags or exclude_tags:
+            if allow_tags:
+                # A single set of the allowed tags that aren't also excluded
+                self._allowed_tags = frozenset(allow_tags) - frozenset(exclude_tags or [])
+                self._is_allowed = self._allowed_tags.__contains__
+            else:
+                self._exclude_tags = frozenset(exclude_tags)
+                self._is_allowed = self._is_not_excluded
+        elif allow_tags_regex or exclude_tags_regex:
+            self._allow_regex = re.compile(allow_tags_regex) if allow_tags_regex else None
+            self._exclude_regex = re.compile(exclude_tags_regex) if exclude_tags_regex else None
+            self._is_allowed = lru_cache(maxsize=self.decision_cache_size)(self._is_allowed_by_regex)
+
+    @classmethod
+    def from_plc_config(cls, plc_config):
+        """Compile the policy of a PLC config (see PlcConfig.access_policy, which caches it)"""
+        return cls(plc_config.allow_tags, plc_config.exclude_tags, plc_config.allow_tags_regex,
+                   plc_config.exclude_tags_regex)
+
+    def is_allowed(self, tag_name):
+        """Return True if the tag can be read"""
+        return self._is_allowed is None or self._is_allowed(tag_name)
+
+    def filter(self, tag_list):
+        """
+        Remove the tags that are not allowed from a tag list.
+        :param tag_list: a list of tag names
+        :return: a new list with only the allowed tag names, in the same order
+        """
+        if self._is_allowed is None:
+            return list(tag_list)
+        # The set based rules are inlined, since this runs for every tag of every request
+        if self._allowed_tags is not None:
+            allowed_tags = self._allowed_tags
+            return [tag_name for tag_name in tag_list if tag_name in allowed_tags]
+        if self._exclude_tags is not None:
+            exclude_tags = self._exclude_tags
+            return [tag_name for tag_name in tag_list if tag_name not in exclude_tags]
+        is_allowed = self._is_allowed
+        return [tag_name for tag_name in tag_list if is_allowed(tag_name)]
+
+    def _is_not_excluded(self, tag_name):
+        return tag_name not in self._exclude_tags
+
+    def _is_allowed_by_regex(self, tag_name):
+        if self._allow_regex is not None and not self._allow_regex.match(tag_name):
+            return False
+        return self._exclude_regex is None or not self._exclude_regex.match(tag_name)
@@ -0,0 +1,75 @@
+# Python dependencies
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+class TagListDiscovery:
+    """
+    Discovers the tag list of every PLC at startup, several PLCs at a time and within a deadline.
+
+    Each PLC is discovered in a bounded pool of threads, so offline PLCs (which take a socket timeout or two each)
+    no longer hold up the others. Startup waits for all of them, but no longer than the deadline. PLCs that miss
+    it keep being discovered in the background while the server starts listening; their tag lists land in the
+    tag list cache when they're done, where requests (and the forked workers, through the cache files) pick them up.
+    """
+
+    # Defaults. These can be changed with the server.py command line arguments.
+    threads = 8
+    deadline = 30
+
+    @classmethod
+    def discover(cls, tag_list_instance, plc_list, threads=None, deadline=None):
+        """
+        Discover the tag list of each PLC.
+        :param tag_list_instance: the TagList that caches the tag lists
+        :param plc_list: the list of PLC configs
+        :param threads: the number of PLCs discovered at the same time
+        :param deadline: the number of seconds to wait for all the PLCs. 0 waits as long as it takes.
+        :return: the list of plc_ids still being discovered in the background
+        """
+        threads = max(1, int(threads or cls.threads))
+        deadline = cls.deadline if deadline is None else max(0, int(deadline))
+
+        plc_configs = list(plc_list)
+        if not plc_configs:
+            return []
+
+        started = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="tag-list-discovery")
+        futures = {executor.submit(cls._discover_plc, tag_list_instance, plc_config): plc_config
+                   for plc_config in plc_configs}
+        done, not_done = wait(futures, timeout=deadline or None)
+        # Don't wait on the PLCs still running. The executor threads finish them and then exit.
+        executor.shutdown(wait=False)
+
+        discovered = sum(1 for future in done if future.result())
+        elapsed = time.monotonic() - started
+        shared_logger.log.info(f'Discovered the tag lists of {discovered}/{len(plc_configs)} PLC(s) '
+                               f'in {elapsed:.2f} s ({threads} at a time)')
+        pending = [futures[future].id for future in not_done]
+        if pending:
+            shared_logger.log.warning(f'Startup discovery deadline of {deadline} s reached. Still discovering in '
+                                      f'the background: {", ".join(pending)}')
+        return pending
+
+    @classmethod
+    def _discover_plc(cls, tag_list_instance, plc_config):
+        """Discover the tag list of one PLC and log how long it took. Return True if it was discovered."""
+        started = time.monotonic()
+        try:
+            shared_logger.log.debug(f'Getting tag list for {plc_config}')
+            # In this case, this gets called for the side effect on the instance
+            # i.e. loads the tag list cache for the PLC. A cache file left by the previous run is checked with the
+            # PLC first.
+            tag_list, _ = tag_list_instance.get_tag_list(plc_config, revalidate=True)
+            shared_logger.log.info(f'plc_id="{plc_config.id}" tag list of {len(tag_list)} tag(s) discovered '
+                                   f'in {time.monotonic() - started:.2f} s')
+            return True
+        except Exception as e:
+            shared_logger.log.error(f'plc_id="{plc_config.id}" tag list discovery failed after '
+                                    f'{time.monotonic() - started:.2f} s: {e}')
+            return False
@@ -0,0 +1,121 @@
+# Python dependencies
+import heapq
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from fnmatch import fnmatchcase
+
+# Every tag name that starts with a prefix sorts between the prefix and the prefix followed by this character
+_LAST_CHARACTER = '\U0010ffff'
+
+# Program scoped tags are listed as "Program:<program name>.<tag name>"
+_PROGRAM_PREFIX = 'Program:'
+
+# The characters that start a wildcard in a glob pattern
+_GLOB_WILDCARDS = re.compile(r'[*?\[]')
+
+
+class TagListIndex:
+    """
+    An index of a PLC tag list, so /get_tag_list queries don't scan every tag.
+
+    - The tag names, sorted. A prefix (also the literal start of a glob pattern, and the program scope, which is
+      the prefix "Program:<name>.") is a range of positions found with a binary search, and pagination resumes
+      after the last tag name returned the same way.
+    - An inverted index of type to the sorted positions of the tags of that type.
+
+    Regex and glob patterns are then only matched against the tags left in those ranges.
+    """
+
+    def __init__(self, tag_list):
+        """
+        Index a tag list. This is done when TagList loads it, not on each query.
+        :param tag_list: a CompactTagList or a BinaryTagList
+        """
+        self._names = tag_list.sorted_names()
+        self._types, type_column = tag_list.sorted_type_columns()
+        self._type_indexes = array('H')
+        positions_by_type = [array('I') for _ in self._types]
+        for position, type_index in enumerate(type_column):
+            self._type_indexes.append(type_index)
+            positions_by_type[type_index].append(position)
+        self._positions_by_type = {tag_type: positions_by_type[type_index]
+                                   for type_index, tag_type in enumerate(self._types)}
+
+    def __len__(self):
+        return len(self._names)
+
+    def search(self, prefix=None, regex=None, glob=None, tag_types=None, scope=None, after=None, limit=None):
+        """
+        Find the tags that match all the given conditions, in tag name order.
+        :param prefix: tag names that start with this
+        :param regex: a compiled regex the tag names must match (from their start)
+        :param glob: a glob pattern the tag names must match (i.e. "Motor*.Speed")
+        :param tag_types: a list of tag types, the tags must be one of them
+        :param scope: "controller" for the controller tags, or a program name ("MainProgram" or
+            "Program:MainProgram") for the tags of that program
+        :param after: only the tags after this tag name (the last one of the previous page)
+        :param limit: the maximum number of tags to return
+        :return: a tuple of (a list of (tag_name, tag_type), True if there are more matching tags after those)
+        """
+        ranges = [(0, len(self._names))]
+        if prefix:
+            ranges = self._intersect(ranges, [self._prefix_range(prefix)])
+        if glob:
+            glob_prefix = _GLOB_WILDCARDS.split(glob, 1)[0]
+            if glob_prefix:
+                ranges = self._intersect(ranges, [self._prefix_range(glob_prefix)])
+        if scope:
+            ranges = self._intersect(ranges, self._scope_ranges(scope))
+        if after is not None:
+            ranges = self._intersect(ranges, [(bisect_right(self._names, after), len(self._names))])
+
+        matches = []
+        for position in self._candidates(ranges, tag_types):
+            tag_name = self._names[position]
+            if regex is not None and not regex.match(tag_name):
+                continue
+            if glob and not fnmatchcase(tag_name, glob):
+                continue
+            if limit is not None and len(matches) >= limit:
+                return matches, True
+            matches.append((tag_name, self._types[self._type_indexes[position]]))
+        return matches, False
+
+    def _candidates(self, ranges, tag_types):
+        """Iterate the positions in the ranges, in order, of the tags of one of tag_types (of any type if None)"""
+        if tag_types is None:
+            for start, end in ranges:
+                yield from range(start, end)
+            return
+        for start, end in ranges:
+            slices = []
+            for tag_type in set(tag_types):
+                positions = self._positions_by_type.get(tag_type)
+                if positions:
+                    slices.append(positions[bisect_left(positions, start):bisect_left(positions, end)])
+            yield from heapq.merge(*slices)
+
+    def _prefix_range(self, prefix):
+        """The range of positions of the tag names that start with prefix"""
+        return bisect_left(self._names, prefix), bisect_left(self._names, prefix + _LAST_CHARACTER)
+
+    def _scope_ranges(self, scope):
+        """The ranges of positions of the tags of a scope (see search())"""
+        if scope == "controller":
+            # Everything but the program tags, which sort together
+            start, end = self._prefix_range(_PROGRAM_PREFIX)
+            return [(0, start), (end, len(self._names))]
+        if not scope.startswith(_PROGRAM_PREFIX):
+            scope = _PROGRAM_PREFIX + scope
+        return [self._prefix_range(scope + '.')]
+
+    @classmethod
+    def _intersect(cls, ranges, other_ranges):
+        """The intersection of two sorted lists of (start, end) ranges"""
+        intersection = []
+        for start, end in ranges:
+            for other_start, other_end in other_ranges:
+                if max(start, other_start) < min(end, other_end):
+                    intersection.append((max(start, other_start), min(end, other_end)))
+        return intersection
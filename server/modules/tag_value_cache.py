@@ -0,0 +1,103 @@
+# Python dependencies
+import threading
+import time
+from collections import OrderedDict
+
+# Default logging to DEBUG
+import modules.logger as logger
+shared_logger = logger.CustomLogger()
+
+
+class _CachedTagValue:
+    """A helper class to store one cached tag value"""
+    __slots__ = ("tag_value", "plc_time", "read_time", "read_monotonic")
+
+    def __init__(self, tag_value, plc_time, read_time, read_monotonic):
+        self.tag_value = tag_value
+        self.plc_time = plc_time
+        self.read_time = read_time
+        self.read_monotonic = read_monotonic
+
+
+class TagValueCache:
+    """
+    An in-memory cache of the latest value read for each (plc_id, tag_name).
+    Supports a singleton pattern so that only one instance is created!
+
+    Every successful read is stored. Requests that pass max_age_ms are served from the cache for any tag with a
+    value younger than that, so only the stale remainder has to be read from the PLC. Memory is bounded by
+    max_entries across all PLCs, evicting the least recently used values first.
+    """
+
+    _instance = None  # Class-level variable to store the singleton instance
+
+    # Default size. This can be changed with configure() (see the server.py command line arguments.)
+    max_entries = 100000
+
+    def __new__(cls, *args, **kwargs):
+        """
+        Override the __new__ method to implement the singleton pattern
+
+        :param args: arguments
+        :param kwargs: keyword arguments
+        :return: the singleton instance
+        """
+        if cls._instance is None:
+            cls._instance = super(TagValueCache, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._entries = OrderedDict()
+        return cls._instance
+
+    def configure(self, max_entries=None):
+        """
+        Change the cache settings.
+        :param max_entries: the maximum number of tag values kept across all PLCs (0 disables the cache)
+        """
+        if max_entries is not None:
+            self.max_entries = max(0, int(max_entries))
+            with self._lock:
+                self._evict()
+
+    def get_fresh(self, plc_id, tag_list, max_age_ms):
+        """
+        Return the cached values that are younger than max_age_ms.
+        :param plc_id: The ID of the PLC
+        :param tag_list: the list of tag names to look up
+        :param max_age_ms: the maximum acceptable age in milliseconds
+        :return: a dictionary of tag_name -> _CachedTagValue for the tags with a fresh enough value
+        """
+        fresh = {}
+        oldest_acceptable = time.monotonic() - max_age_ms / 1000
+        with self._lock:
+            for tag_name in tag_list:
+                key = (plc_id, tag_name)
+                entry = self._entries.get(key)
+                if entry is not None and entry.read_monotonic >= oldest_acceptable:
+                    self._entries.move_to_end(key)
+                    fresh[tag_name] = entry
+        return fresh
+
+    def put(self, plc_id, tag_values, plc_time, read_time):
+        """
+        Store the successfully read values of a read.
+        :param plc_id: The ID of the PLC
+        :param tag_values: the list of tag value dictionaries, as returned by plc_io.get_tag_values
+        :param plc_time: the PLC time of the read
+        :param read_time: the server time (unix timestamp) of the read
+        """
+        if self.max_entries <= 0 or not tag_values:
+            return
+        read_monotonic = time.monotonic()
+        with self._lock:
+            for tag_value in tag_values:
+                if not tag_value.get('success'):
+                    continue
+                key = (plc_id, tag_value['tag_name'])
+                self._entries[key] = _CachedTagValue(dict(tag_value), plc_time, read_time, read_monotonic)
+                self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used values until we are within max_entries. Call with the lock held."""
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
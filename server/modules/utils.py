@@ -1,8 +1,13 @@
 # Python dependencies
+import json
 import os
+import tempfile
 import time
 import re
 import argparse
+import math
+# Installed with Falcon-Limiter, which parses the rate limit strings with it
+from limits import parse_many
 
 # Project dependencies
 import model_BatchList
@@ -34,6 +39,19 @@ def is_timestamp_old(timestamp, minutes_threshold):
         return False, timestamp
 
 
+def write_json_file_atomically(file_path, data):
+    """Write data as JSON to a temporary file in the same directory, then swap it in place of file_path, so
+    readers see either the old or the new file, never a half written one."""
+    file_descriptor, temp_file_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(data, file)
+        os.replace(temp_file_path, file_path)
+    except Exception:
+        os.remove(temp_file_path)
+        raise
+
+
 def convert_to_safe_filename(string):
     """Convert a string to a safe filename (Linux & Windows)."""
     # Replace reserved characters for both Linux and Windows with underscore
@@ -58,12 +76,19 @@ def is_list_of_strings(list_to_check):
     return isinstance(list_to_check, list) and all(isinstance(item, str) for item in list_to_check)
 
 
+def is_non_negative_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
 def get_plc_config_for_plc_id(plc_list: model_PlcList, plc_id):
     """Return the PLC config for the given plc_id, or None if not found.
     :param plc_list: the list of PLC configs
     :param plc_id: the PLC ID to search for
     :return: the PLC config for the given plc_id, or None if not found
     """
+    # The PlcList is indexed by id
+    if isinstance(plc_list, model_PlcList.PlcList):
+        return plc_list.get(plc_id)
     for plc_config in plc_list:
         if plc_config.id == plc_id:
             return plc_config
@@ -76,12 +101,39 @@ def get_plc_batch_config_for_batch_id(batch_list: model_BatchList, batch_id):
     :param batch_id: the batch ID to search for
     :return: the PLC batch config for the given batch_id, or None if not found
     """
+    # The BatchList is indexed by id
+    if isinstance(batch_list, model_BatchList.BatchList):
+        return batch_list.get(batch_id)
     for batch_config in batch_list:
         if batch_config.id == batch_id:
             return batch_config
     return None
 
 
+def set_age_headers(resp, age_seconds):
+    """Set the response headers that tell the client how old the (in-memory) values are.
+    :param resp: the falcon response
+    :param age_seconds: the age of the values in seconds
+    """
+    # Age is the standard HTTP header (whole seconds). X-Tag-Value-Age-Ms gives millisecond precision.
+    resp.set_header('Age', str(int(age_seconds)))
+    resp.set_header('X-Tag-Value-Age-Ms', str(int(age_seconds * 1000)))
+
+
+def set_encoded_body(resp, body, encoding):
+    """Set a JSON response body that is already serialized (and maybe compressed, see response_cache.py).
+    :param resp: the falcon response
+    :param body: the body (bytes)
+    :param encoding: the encoding of the body: "identity", "gzip" or "br"
+    """
+    resp.content_type = 'application/json'
+    resp.data = body
+    # The body depends on the Accept-Encoding header of the request
+    resp.append_header('Vary', 'Accept-Encoding')
+    if encoding != 'identity':
+        resp.set_header('Content-Encoding', encoding)
+
+
 # Command line argument validators
 
 def validate_directory(directory):
@@ -125,47 +177,42 @@ def validate_integer(value):
     return value
 
 
+def validate_workers(value):
+    """Validate the number of worker processes: an integer, or "auto" for one per CPU core this process may use."""
+    if value == "auto":
+        if hasattr(os, "sched_getaffinity"):
+            # Only the cores this process is allowed to run on (e.g. the cpuset of a container)
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
+    return validate_integer(value)
+
+
 def process_allow_disallow_tag_list(tag_list, plc_config: model_PlcList.PlcConfig):
     """
     Process the allow/disallow tag list for a PLC.
-    Note that this function modifies the passed tag_list.
     allow_tags/exclude_tags will take precedence over allow_tags_regex/exclude_tags_regex.
+    The rules are compiled once per PLC config (see tag_access_policy.py).
+    :return: a tuple of (the original tag list, the filtered tag list)
     """
-    # Save the original tag list
-    original_tag_list = tag_list
-
-    shared_logger.log.info(f"Processing allow/disallow tag list for PLC {plc_config}")
-    shared_logger.log.debug(f"Original tag list: {original_tag_list}")
-
-    # Decide which path to take based on whether allow_tags or exclude_tags is set
-    # allow_tags/exclude_tags will take precedence over allow_tags_regex/exclude_tags_regex
-    if plc_config.allow_tags or plc_config.exclude_tags:
-        shared_logger.log.debug(f"Using allow_tags/exclude_tags")
-        # If plc_config.allow_tags has any tags, remove any tags from the passed tag_list not in the allow_tags list
-        if plc_config.allow_tags:
-            tag_list = [tag for tag in tag_list if tag in plc_config.allow_tags]
-        # If plc_config.exclude_tags has any tags, remove any tags from the passed tag_list that are in the
-        # exclude_tags list
-        if plc_config.exclude_tags:
-            tag_list = [tag for tag in tag_list if tag not in plc_config.exclude_tags]
-    elif plc_config.allow_tags_regex or plc_config.exclude_tags_regex:
-        shared_logger.log.debug(f"Using allow_tags_regex/exclude_tags_regex")
-        # If plc_config.allow_tags_regex has a regex, remove any tags from the passed tag_list not matching the
-        # allow_tags_regex
-        if plc_config.allow_tags_regex:
-            tag_list = [tag for tag in tag_list if re.match(plc_config.allow_tags_regex, tag)]
-        # If plc_config.exclude_tags_regex ha a regex, remove any tags from the passed tag_list that match the
-        # exclude_tags_regex
-        if plc_config.exclude_tags_regex:
-            tag_list = [tag for tag in tag_list if not re.match(plc_config.exclude_tags_regex, tag)]
-
-    shared_logger.log.debug(f"Final tag list: {tag_list}")
-    return original_tag_list, tag_list
+    tag_list_filtered = plc_config.access_policy.filter(tag_list)
+    if len(tag_list_filtered) != len(tag_list):
+        shared_logger.log.debug(f"plc_id=\"{plc_config.id}\" allow/disallow rules removed "
+                                f"{len(tag_list) - len(tag_list_filtered)} of {len(tag_list)} tag(s)")
+    return tag_list, tag_list_filtered
 
 
 # Utilities related to rate limiting
 
 
+def get_request_fields(req):
+    """
+    Return the fields of a request: the JSON body of a POST, or the query string of a GET (or HEAD).
+    """
+    if req.method in ('GET', 'HEAD'):
+        return req.params
+    return req.get_media()
+
+
 def get_limit_key(req, resp, resource, params) -> str:
     """
     Function to return the key to use for rate limiting.
@@ -173,7 +220,7 @@ def get_limit_key(req, resp, resource, params) -> str:
     The key is the plc_id or the tag_batch_id, which are required fields in the JSON body of the request for
     fetching batches and values.
     """
-    obj = req.get_media()
+    obj = get_request_fields(req)
     tag_batch_id = obj.get('tag_batch_id')
     plc_id = obj.get('plc_id')
     return plc_id if plc_id is not None else tag_batch_id
@@ -186,14 +233,12 @@ def get_limit_string_for_plc(req, resp, resource, params) -> str:
     """
     # Pull the plc_list from the shared singleton that was initialized at startup
     plc_list = model_PlcList.PlcList()
-    # Pull the plc_id from the request body
-    obj = req.get_media()
+    # Pull the plc_id from the request body (or query string)
+    obj = get_request_fields(req)
     plc_id = obj.get('plc_id')
     # Fetch and return the rate limit, if any, for the requested plc_id
-    for plc in plc_list:
-        if plc.id == plc_id:
-            return plc.rate_limit
-    return ""
+    plc = plc_list.get(plc_id)
+    return plc.rate_limit if plc is not None else ""
 
 
 def get_limit_string_for_batch(req, resp, resource, params) -> str:
@@ -207,7 +252,32 @@ def get_limit_string_for_batch(req, resp, resource, params) -> str:
     obj = req.get_media()
     tag_batch_id = obj.get('tag_batch_id')
     # Fetch and return the rate limit, if any, for the requested tag_batch_id
-    for batch in batch_list:
-        if batch.id == tag_batch_id:
-            return batch.rate_limit
-    return ""
+    batch = batch_list.get(tag_batch_id)
+    return batch.rate_limit if batch is not None else ""
+
+
+def get_limit_string_for_subscription(req, resp, resource, params) -> str:
+    """
+    Function to return the string for rate limiting
+    This function is called by the falcon-limiter package
+    A subscription is to a batch (limited like the batch) or to tags of a PLC (limited like the PLC)
+    """
+    obj = req.get_media()
+    if obj.get('tag_batch_id') is not None:
+        return get_limit_string_for_batch(req, resp, resource, params)
+    return get_limit_string_for_plc(req, resp, resource, params)
+
+
+def get_rate_limit_interval_ms(rate_limit) -> int:
+    """
+    Return the time between requests (in milliseconds) that a rate limit string allows over time, e.g. 500 for
+    "2/second". With several limits (e.g. "10/second;100/minute"), the strictest one. 0 for no (or an invalid) limit.
+    """
+    if not rate_limit:
+        return 0
+    try:
+        rate_limit_items = parse_many(rate_limit)
+    except ValueError:
+        return 0
+    return max((math.ceil(item.get_expiry() * 1000 / item.amount) for item in rate_limit_items if item.amount),
+               default=0)
@@ -15,7 +15,19 @@ from modules.startup import Startup
 from modules.handler_get_tag_list import GetTagListHandler
 from modules.handler_get_tag_value import GetTagValueHandler
 from modules.handler_get_tag_batch import GetTagBatchHandler
+from modules.handler_get_read_tuning import GetReadTuningHandler
+from modules.handler_subscribe import SubscribeHandler
 from modules.middleware_auth import AuthMiddleware
+from modules.production_server import serve_production
+# Imported by their plain module names (like the modules themselves do) so all share the same singletons
+from plc_session_pool import PlcSessionPool
+from scan_engine import ScanEngine
+from tag_value_cache import TagValueCache
+from plc_clock import PlcClock
+from subscriptions import Subscriptions
+from response_cache import ResponseCache
+from batch_versions import BatchVersions
+from json_media import JsonMedia
 
 # Default logging to DEBUG
 import modules.logger as logger
@@ -26,6 +38,8 @@ shared_logger = logger.CustomLogger(logging.DEBUG)
 def handle_sigint(signal, frame):
     shared_logger.log.info("SIGINT received. Stopping server...")
     # Perform cleanup actions here
+    ScanEngine().stop()
+    PlcSessionPool().close_all()
     shared_logger.log.info("Server stopped.")
     sys.exit(0)
 
@@ -41,22 +55,102 @@ if __name__ == '__main__':
     parser.add_argument("-p", "--port", type=utils.validate_port, help="Valid TCP port number")
     parser.add_argument("-t", "--cache-ttl", type=utils.validate_integer, help="Valid integer")
     parser.add_argument("-a", "--auth-token-file-path", type=utils.validate_file, help="Existing auth tokens file path")
+    parser.add_argument("--server-mode", choices=["development", "production"], default="development",
+                        help="development: single process, one request at a time (default). "
+                             "production: several worker processes, each with a pool of request threads")
+    parser.add_argument("--workers", type=utils.validate_workers, default="auto",
+                        help="Number of worker processes in production mode, or auto for one per CPU core (default "
+                             "auto). Each worker keeps its own rate limit counters, background scans and caches, so "
+                             "rate limits are multiplied by the number of workers and each scanned batch is read "
+                             "once per worker. Pass 1 to opt out")
+    parser.add_argument("--threads", type=utils.validate_integer, default=8,
+                        help="Number of request threads per worker process in production mode (default 8)")
+    parser.add_argument("--plc-max-sessions", type=utils.validate_integer, default=2,
+                        help="Maximum number of pooled PLC sessions per PLC (default 2)")
+    parser.add_argument("--plc-session-idle-timeout", type=utils.validate_integer, default=300,
+                        help="Seconds an idle pooled PLC session is kept open (default 300)")
+    parser.add_argument("--plc-session-keepalive", type=utils.validate_integer, default=30,
+                        help="Seconds between keepalive requests on idle pooled PLC sessions (default 30)")
+    parser.add_argument("--plc-session-stats-interval", type=utils.validate_integer, default=300,
+                        help="Seconds between INFO logs of the PLC session pool stats, 0 to disable (default 300)")
+    parser.add_argument("--tag-value-cache-size", type=utils.validate_integer, default=100000,
+                        help="Maximum number of tag values kept in memory for max_age_ms requests, 0 to disable "
+                             "(default 100000)")
+    parser.add_argument("--plc-time-resync-interval", type=utils.validate_integer, default=60,
+                        help="Seconds between reads of each PLC clock. In between, plc_time is derived from the last "
+                             "read, 0 to read the PLC clock on every request (default 60)")
+    parser.add_argument("--startup-discovery-threads", type=utils.validate_integer, default=8,
+                        help="Number of PLCs whose tag list is discovered at the same time on startup (default 8)")
+    parser.add_argument("--startup-discovery-deadline", type=utils.validate_integer, default=30,
+                        help="Seconds startup waits for tag list discovery before the server starts listening. "
+                             "PLCs that take longer keep being discovered in the background, 0 to wait for all "
+                             "(default 30)")
+    parser.add_argument("--tag-list-refresh", choices=["background", "blocking"], default="background",
+                        help="background: a tag list past cache-ttl is still used while it's refreshed in the "
+                             "background (default). blocking: requests wait for the refresh")
+    parser.add_argument("--tag-list-cache-format", choices=["json", "binary"], default="json",
+                        help="json: tag list cache files are JSON, loaded into memory (default). binary: a compact "
+                             "format that is memory-mapped rather than loaded, for PLCs with very large tag lists")
+    parser.add_argument("--max-subscriptions", type=utils.validate_integer, default=4,
+                        help="Maximum number of /subscribe streams open at the same time per worker process. Each "
+                             "holds a request thread while its client is connected (default 4)")
+    parser.add_argument("--subscription-keepalive", type=utils.validate_integer, default=15,
+                        help="Seconds without changes after which a /subscribe stream sends a keepalive comment "
+                             "(default 15)")
+    parser.add_argument("--response-cache-mb", type=utils.validate_integer, default=64,
+                        help="Megabytes of serialized and compressed tag list and scanned batch responses kept in "
+                             "memory per worker process, 0 to disable (default 64)")
+    parser.add_argument("--json-backend", choices=["auto", "orjson", "stdlib"], default="auto",
+                        help="auto: orjson if it's installed, else the standard library json module (default). "
+                             "orjson: much faster on large tag lists and batches. stdlib: the standard library")
     # Parse the command line arguments. Note, they will be available as args.<argument_name> using the long
     # argument name as the attribute name without the initial "--" and any "-" characters replaced with "_".
     args = parser.parse_args()
 
+    # Configure the PLC session pool before anything talks to a PLC
+    PlcSessionPool().configure(args.plc_max_sessions, args.plc_session_idle_timeout, args.plc_session_keepalive,
+                               args.plc_session_stats_interval)
+    TagValueCache().configure(args.tag_value_cache_size)
+    PlcClock().configure(args.plc_time_resync_interval)
+    # A subscription holds its request thread until the client disconnects. The development server handles one
+    # request at a time, so there subscriptions are disabled (/subscribe responds 503), and in production mode at
+    # least one thread per worker is always left for the other requests.
+    if args.server_mode == "production":
+        max_subscriptions = min(args.max_subscriptions, max(0, args.threads - 1))
+    else:
+        max_subscriptions = 0
+    if max_subscriptions < args.max_subscriptions:
+        shared_logger.log.info(f'max-subscriptions lowered to {max_subscriptions} (server-mode '
+                               f'{args.server_mode}, {args.threads} threads), so subscriptions can\'t block '
+                               f'other requests')
+    Subscriptions().configure(max_subscriptions, args.subscription_keepalive)
+    ResponseCache().configure(args.response_cache_mb * 1024 * 1024)
+    JsonMedia.configure(args.json_backend)
+
     # Set up the server pre-requisites
-    plc_list, tag_lists, batch_list = Startup.start(args.config_file_path, args.cache_directory, args.cache_ttl)
+    plc_list, tag_lists, batch_list = Startup.start(args.config_file_path, args.cache_directory, args.cache_ttl,
+                                                    args.startup_discovery_threads,
+                                                    args.startup_discovery_deadline,
+                                                    args.tag_list_refresh == "background",
+                                                    args.tag_list_cache_format)
+    # Make the batch versions epoch and seq counter now, so the worker processes forked below all share them
+    BatchVersions().configure([batch_config.id for batch_config in batch_list])
 
     # Set up an empty rate limiter. This will be populated in the handler classes.
     limiter = Limiter()
 
     # Instantiate the server and hook up the middleware packages for auth and rate limiting
     app = falcon.App(middleware=[AuthMiddleware(args.auth_token_file_path), limiter.middleware])
+    # Parse request bodies and serialize responses with the JSON backend (see json_media.py)
+    json_handler = JsonMedia.media_handler()
+    app.req_options.media_handlers[falcon.MEDIA_JSON] = json_handler
+    app.resp_options.media_handlers[falcon.MEDIA_JSON] = json_handler
     # define Server Endpoint Routes and Handlers
     app.add_route('/get_tag_list', GetTagListHandler(plc_list, tag_lists))
     app.add_route('/get_tag_value', GetTagValueHandler(plc_list, tag_lists))
     app.add_route('/get_tag_batch', GetTagBatchHandler(plc_list, tag_lists, batch_list))
+    app.add_route('/get_read_tuning', GetReadTuningHandler(plc_list))
+    app.add_route('/subscribe', SubscribeHandler(plc_list, tag_lists, batch_list))
 
     # Below "" means localhost - but you can't use that value directly. (localhost or 127.0.0.1)
     # https://docs.python.org/3/library/wsgiref.html#module-wsgiref.simple_server
@@ -65,7 +159,15 @@ if __name__ == '__main__':
         target_host = ""
     else:
         target_host = args.host
-    with make_server(target_host, args.port, app) as httpd:
+    if args.server_mode == "production":
         shared_logger.log.info('Serving on ' + args.host + ':' + str(args.port) + ' ...')
-        # Serve until process is killed
-        httpd.serve_forever()
+        # Serve with worker processes and threads until process is killed
+        # Each worker starts its own background scan engine
+        serve_production(app, target_host, args.port, max(1, args.workers), max(1, args.threads),
+                         on_worker_start=ScanEngine().start)
+    else:
+        ScanEngine().start()
+        with make_server(target_host, args.port, app) as httpd:
+            shared_logger.log.info('Serving on ' + args.host + ':' + str(args.port) + ' ...')
+            # Serve until process is killed
+            httpd.serve_forever()